@@ -1,11 +1,12 @@
 # OPEX item model for validation
 from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import os
 import json
+import logging
 frontend_dist_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../frontend/dist'))
 
 app = FastAPI(title="Fresh Budget API", version="0.1.0")
@@ -208,14 +209,94 @@ async def get_opex_working():
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional
-import ast, math
-import io, csv
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+import ast, math, functools, re, copy, itertools
+import io, csv, gzip, contextlib
+import bisect, multiprocessing, threading, time, uuid, hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
 try:
     import pandas as pd  # type: ignore
 except Exception:  # pandas optional
     pd = None  # fallback
+try:
+    import openpyxl  # type: ignore
+except Exception:  # openpyxl optional: .xlsx uploads are then read with pandas
+    openpyxl = None
+
+try:
+    import orjson  # type: ignore
+except Exception:  # orjson optional: responses fall back to pydantic's serializer
+    orjson = None
+
+# ------------------ Calculation Admission Control ------------------
+# CPU-heavy endpoints (calculations, file parsing) are plain `def` endpoints
+# marked with @calc_endpoint: FastAPI runs them on worker threads instead of the
+# event loop, so cheap endpoints such as /api/health stay responsive. At most
+# CALC_MAX_CONCURRENCY of them compute at once and up to CALC_MAX_QUEUE more may
+# wait (including while their request body is read); further requests are
+# turned away before their body is parsed with 503 + Retry-After.
+CALC_MAX_CONCURRENCY = max(int(os.environ.get('CALC_MAX_CONCURRENCY', '4')), 1)
+CALC_MAX_QUEUE = max(int(os.environ.get('CALC_MAX_QUEUE', '16')), 0)
+CALC_RETRY_AFTER = int(os.environ.get('CALC_RETRY_AFTER', '5'))
+_calc_slots = threading.BoundedSemaphore(CALC_MAX_CONCURRENCY)
+_calc_state_lock = threading.Lock()
+_calc_in_flight = 0
+_calc_route_paths: Optional[Tuple[set, list]] = None
+
+
+def calc_endpoint(fn):
+    """Decorator for sync CPU-bound endpoints: admission control + concurrency limit."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _calc_slots:
+            return fn(*args, **kwargs)
+    wrapper._calc_endpoint = True
+    return wrapper
+
+
+def _is_calc_path(path: str) -> bool:
+    global _calc_route_paths
+    if _calc_route_paths is None:
+        routes = [r for r in app.routes if getattr(getattr(r, 'endpoint', None), '_calc_endpoint', False)]
+        # Plain paths are matched exactly; templated ones (e.g. session ids) by their route regex
+        _calc_route_paths = ({r.path for r in routes if '{' not in r.path},
+                             [r.path_regex for r in routes if '{' in r.path])
+    exact, templated = _calc_route_paths
+    return path in exact or any(rx.match(path) for rx in templated)
+
+
+class CalcAdmissionMiddleware:
+    """ASGI middleware counting in-flight calculation requests and shedding excess load."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _calc_in_flight
+        if scope['type'] != 'http' or not _is_calc_path(scope.get('path', '')):
+            await self.app(scope, receive, send)
+            return
+        with _calc_state_lock:
+            admitted = _calc_in_flight < CALC_MAX_CONCURRENCY + CALC_MAX_QUEUE
+            if admitted:
+                _calc_in_flight += 1
+        if not admitted:
+            response = JSONResponse({"detail": "Server is busy with other calculations, retry shortly"},
+                                    status_code=503, headers={"Retry-After": str(CALC_RETRY_AFTER)})
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            with _calc_state_lock:
+                _calc_in_flight -= 1
+
+
+app.add_middleware(CalcAdmissionMiddleware)
+
 
 class RevenueRow(BaseModel):
     dimensions: Dict[str, str]
@@ -276,6 +357,235 @@ class RevenueCalcResponse(BaseModel):
     peak_funding: float = 0.0
     total_net_cashflow: float = 0.0
 
+class RevenueColumns(BaseModel):
+    """Revenue rows in columnar form (response layout 'columnar').
+
+    Row i of every array belongs to `dimensions[i]`, whose values follow
+    `dimension_names` (None where a row lacks that dimension). Monthly metrics
+    are flat row-major arrays of len(rows) * len(months) values.
+    """
+    dimension_names: List[str]
+    dimensions: List[List[Optional[str]]]
+    monthly_revenue: List[float]
+    monthly_recurring: List[float]
+    monthly_one_time: List[float]
+    monthly_existing_one_time: List[float]
+    monthly_fresh_one_time: List[float]
+    monthly_cashflow_recurring: List[float]
+    monthly_cashflow_one_time: List[float]
+    total_recurring: List[float]
+    total_one_time: List[float]
+    total_revenue: List[float]
+    existing_recurring: List[float]
+    fresh_recurring: List[float]
+    existing_one_time: List[float]
+    fresh_one_time: List[float]
+
+
+class RevenueCalcColumnarResponse(RevenueCalcResponse):
+    """RevenueCalcResponse with `rows` left empty and carried in `columns` instead."""
+    columns: RevenueColumns
+
+
+# ------------------ Response Serialization ------------------
+# Engines build RevenueRow objects without validation (their values are
+# already floats in month order), and calculation endpoints write responses
+# straight from the objects' field values with orjson instead of letting
+# FastAPI validate and serialize them again through `response_model`.
+# CALC_STRICT_VALIDATION=1 (tests, debugging) validates every row and
+# re-validates each response against its model before serializing. Without
+# orjson installed, pydantic's serializer is used.
+CALC_STRICT_VALIDATION = os.environ.get('CALC_STRICT_VALIDATION', '').strip().lower() in ('1', 'true', 'yes')
+
+
+def _revenue_row(**fields) -> RevenueRow:
+    """RevenueRow from engine-built values; validated only in strict mode."""
+    if CALC_STRICT_VALIDATION:
+        return RevenueRow(**fields)
+    return RevenueRow.model_construct(**fields)
+
+
+def _plain(value: Any) -> Any:
+    """Models (and lists / dicts of models) as plain dicts of their field values."""
+    if isinstance(value, BaseModel):
+        return {name: _plain(v) for name, v in value.__dict__.items()}
+    if isinstance(value, list) and value and isinstance(value[0], BaseModel):
+        first = value[0]
+        if all(_plain(v) is v for v in first.__dict__.values()):
+            # Flat models such as RevenueRow: their field dicts serialize as they are
+            return [v.__dict__ for v in value]
+        return [_plain(v) for v in value]
+    if isinstance(value, dict) and value and isinstance(next(iter(value.values())), BaseModel):
+        return {k: _plain(v) for k, v in value.items()}
+    return value
+
+
+def _response_bytes(res: BaseModel) -> bytes:
+    if CALC_STRICT_VALIDATION:
+        return type(res).model_validate(res.model_dump()).model_dump_json().encode('utf-8')
+    if orjson is None:
+        return res.model_dump_json().encode('utf-8')
+    return orjson.dumps(_plain(res), option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def _json_response(res: BaseModel, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(content=_response_bytes(res), media_type='application/json', headers=headers)
+
+
+RESPONSE_LAYOUTS = ('rows', 'columnar')
+
+
+def _columnar_response(res: RevenueCalcResponse) -> RevenueCalcColumnarResponse:
+    months = res.months
+    names: Dict[str, None] = {}
+    for row in res.rows:
+        names.update(dict.fromkeys(row.dimensions))
+    columns: Dict[str, Any] = {
+        'dimension_names': list(names),
+        'dimensions': [[row.dimensions.get(name) for name in names] for row in res.rows],
+    }
+    for field in RevenueColumns.model_fields:
+        if field.startswith('monthly_'):
+            columns[field] = [values[m] for values in (getattr(row, field) for row in res.rows) for m in months]
+        elif field not in columns:
+            columns[field] = [getattr(row, field) for row in res.rows]
+    data = {name: getattr(res, name) for name in RevenueCalcResponse.model_fields}
+    data['rows'] = []
+    return RevenueCalcColumnarResponse.model_construct(**data, columns=RevenueColumns.model_construct(**columns))
+
+
+# ------------------ Wire Formats ------------------
+# Calculation endpoints negotiate the response format from the Accept header:
+# MessagePack (application/msgpack) or an Arrow IPC stream
+# (application/vnd.apache.arrow.stream) when the msgpack / pyarrow packages
+# are installed, JSON otherwise. Bodies of RESPONSE_COMPRESS_MIN bytes or more
+# are compressed with brotli or gzip, following Accept-Encoding. msgpack,
+# pyarrow and brotli are listed in requirements.txt; without them the server
+# still runs and serves JSON with gzip.
+#
+# The Arrow stream holds the response rows as a table (one column per
+# dimension, fixed-size list columns for monthly series, float columns for row
+# totals); all other response fields travel as JSON in the schema metadata
+# under b'response', with the month names under b'months'.
+RESPONSE_COMPRESS_MIN = int(os.environ.get('RESPONSE_COMPRESS_MIN', '16384'))
+JSON_MEDIA_TYPE = 'application/json'
+MSGPACK_MEDIA_TYPES = ('application/msgpack', 'application/x-msgpack')
+ARROW_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+
+try:
+    import msgpack  # type: ignore
+except Exception:  # msgpack optional
+    msgpack = None
+try:
+    import pyarrow as pa  # type: ignore
+except Exception:  # pyarrow optional
+    pa = None
+try:
+    import brotli  # type: ignore
+except Exception:  # brotli optional: gzip only
+    brotli = None
+
+
+def _accept_values(header: Optional[str]) -> List[Tuple[str, float]]:
+    """Accept-style header as (value, q) pairs, highest q first (header order on ties)."""
+    values = []
+    for part in (header or '').split(','):
+        fields = [f.strip() for f in part.split(';')]
+        if not fields[0]:
+            continue
+        q = 1.0
+        for f in fields[1:]:
+            if f.startswith('q='):
+                try:
+                    q = float(f[2:])
+                except ValueError:
+                    q = 0.0
+        values.append((fields[0].lower(), q))
+    return sorted(values, key=lambda v: -v[1])
+
+
+def _negotiate_media_type(accept: Optional[str]) -> str:
+    supported = [JSON_MEDIA_TYPE]
+    if msgpack is not None:
+        supported.extend(MSGPACK_MEDIA_TYPES)
+    if pa is not None:
+        supported.append(ARROW_MEDIA_TYPE)
+    for value, q in _accept_values(accept):
+        if q > 0 and value in supported:
+            return value
+    return JSON_MEDIA_TYPE
+
+
+def _negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    supported = ['br', 'gzip'] if brotli is not None else ['gzip']
+    accepted = {value: q for value, q in _accept_values(accept_encoding)}
+    candidates = [(accepted.get(enc, accepted.get('*', 0.0)), -supported.index(enc), enc) for enc in supported]
+    q, _, enc = max(candidates)
+    return enc if q > 0 else None
+
+
+def _json_bytes(data: Any) -> bytes:
+    return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY) if orjson is not None else json.dumps(data).encode('utf-8')
+
+
+def _arrow_dimension_columns(names: List[str], values: List[List[Optional[str]]]) -> Dict[str, Any]:
+    return {name: pa.array([row[i] for row in values], type=pa.string()) for i, name in enumerate(names)}
+
+
+def _arrow_series(flat: List[float], width: int):
+    return pa.FixedSizeListArray.from_arrays(pa.array(flat, type=pa.float64()), width)
+
+
+def _arrow_bytes(res: BaseModel) -> bytes:
+    months = list(res.months)
+    meta = _plain(res)
+    meta.pop('rows', None)
+    if isinstance(res, RevenueCalcResponse):
+        cols = res.columns if isinstance(res, RevenueCalcColumnarResponse) else _columnar_response(res).columns
+        meta.pop('columns', None)
+        arrays = _arrow_dimension_columns(cols.dimension_names, cols.dimensions)
+        for field in RevenueColumns.model_fields:
+            if field.startswith('monthly_'):
+                arrays[field] = _arrow_series(getattr(cols, field), len(months))
+            elif field not in ('dimension_names', 'dimensions'):
+                arrays[field] = pa.array(getattr(cols, field), type=pa.float64())
+    else:
+        # Volume rows: {dimensions, months, total, prior_exit_volumes}
+        rows = res.rows
+        names = list(dict.fromkeys(name for row in rows for name in row['dimensions']))
+        arrays = _arrow_dimension_columns(names, [[row['dimensions'].get(n) for n in names] for row in rows])
+        arrays['months'] = _arrow_series([row['months'][m] for row in rows for m in months], len(months))
+        arrays['total'] = pa.array([row['total'] for row in rows], type=pa.float64())
+        arrays['prior_exit_volumes'] = pa.array([list((row.get('prior_exit_volumes') or {}).items()) for row in rows],
+                                                type=pa.map_(pa.string(), pa.float64()))
+    table = pa.table(arrays).replace_schema_metadata({b'months': _json_bytes(months), b'response': _json_bytes(meta)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _encode_response(res: BaseModel, media_type: str, encoding: Optional[str]) -> Tuple[bytes, Dict[str, str]]:
+    """Serialized (and possibly compressed) body plus its Content-Type / Content-Encoding headers."""
+    if media_type in MSGPACK_MEDIA_TYPES:
+        body = msgpack.packb(_plain(res), use_bin_type=True)
+    elif media_type == ARROW_MEDIA_TYPE:
+        body = _arrow_bytes(res)
+    else:
+        body = _response_bytes(res)
+    headers = {'Content-Type': media_type}
+    if encoding and len(body) >= RESPONSE_COMPRESS_MIN:
+        body = brotli.compress(body, quality=5) if encoding == 'br' else gzip.compress(body, compresslevel=6)
+        headers['Content-Encoding'] = encoding
+    return body, headers
+
+
+def _negotiated_response(request: Request, res: BaseModel) -> Response:
+    media_type = _negotiate_media_type(request.headers.get('accept'))
+    body, headers = _encode_response(res, media_type, _negotiate_encoding(request.headers.get('accept-encoding')))
+    return Response(content=body, headers={**headers, 'Vary': 'Accept, Accept-Encoding'})
+
+
 def _dim_key(dimensions: Dict[str,str]) -> str:
     return '|'.join(f"{k}={dimensions[k]}" for k in sorted(dimensions.keys()))
 
@@ -382,6 +692,8 @@ class DynamicMultiYearVolumePayload(BaseModel):
     prior_years: List[str] = []
     dimensions: List[str] = []  # ordered list of dimension names (for reference/display)
     combinations: List[DynamicVolumeCombination] = []
+    group_by: List[List[str]] = Field(default_factory=list, description="Dimension sets to roll volumes up by, e.g. [['customer', 'circle'], ['circle', 'type']]. An empty set is the grand total.")
+    include_rows: bool = Field(default=True, description="Return the per-combination rows; false returns totals and roll-ups only.")
 
 class DynamicMultiYearVolumeResponse(BaseModel):
     fiscal_year: str
@@ -390,6 +702,7 @@ class DynamicMultiYearVolumeResponse(BaseModel):
     totals: Dict[str, float]
     grand_total: float
     dimension_totals: Dict[str, Any] = Field(default_factory=dict, description="Optional per-dimension aggregated totals")
+    rollups: List[Dict[str, Any]] = Field(default_factory=list, description="Grouped monthly totals per requested group_by set: [{group_by, groups: [{values, months, total}]}]")
 
 # ------------------ Revenue Calculation Models ------------------
 class RateEntry(BaseModel):
@@ -423,6 +736,7 @@ class RevenueCalcPayload(BaseModel):
     capex_items: List[Dict[str, Any]] = Field(default_factory=list, description="List of CAPEX items. Fields: name, group (First Time Inventory, First Time Capex, Capex People, Replacement Inventory, Replacement Capex, ROW Deposit, Deposit Refund), type ('first_time' or 'replacement' or 'people' or 'deposit_refund'), recognition_offset_months (>=0), cashflow_offset_months (>=0), is_refund (bool). First time & people & deposits: fresh only; replacement: existing + fresh logic like revenue.")
     capex_rates: List[Dict[str, Any]] = Field(default_factory=list, description="Per-combination per-item CAPEX rates. Fields: dimensions (mapping), item (str), existing_rate, fresh_rate.")
     existing_capex_overrides: List[Dict[str, Any]] = Field(default_factory=list, description="Existing CAPEX overrides for replacement items only. Each: {item: str, fiscal_year: str, months: {Apr:val,...}} replacing existing portion only.")
+    engine: Optional[str] = Field(default=None, description="Calculation engine override: 'vectorized' (NumPy, default) or 'python' (reference per-month loop). Defaults to the REVENUE_ENGINE server setting.")
 
     # ------------------ Template / Upload Endpoints ------------------
     @app.get("/api/template/existing")
@@ -440,140 +754,50 @@ class RevenueCalcPayload(BaseModel):
         return {"filename": "existing_revenue_template.csv", "content": csv_content}
 
     @app.post("/api/upload/existing")
-    async def upload_existing(file: UploadFile = File(...)):
+    @calc_endpoint
+    def upload_existing(file: UploadFile = File(...), sheets: Optional[str] = None, upload_id: Optional[str] = None):
         """Parse uploaded existing revenue file in new template format.
 
         Hard errors on missing columns, invalid revenue type, non-numeric or negative numbers.
         Duplicate rows aggregated (sum) per (Customer,Circle,Type,Fiscal Year,Revenue Type).
         Output rows aggregated per (Customer,Circle,Type,Fiscal Year) with recurring & one_time maps and total Exit Volume.
+        Excel sheet selection and progress reporting: see Upload Ingestion.
         """
         filename = file.filename.lower()
-        content = await file.read()
         required_base = {"Customer","Circle","Type","Revenue Type","Fiscal Year","Exit Volume"}
         month_cols = set(FISCAL_MONTHS)
-        def _validate_and_aggregate(df_rows):
-            errors: List[str] = []
-            group: Dict[tuple, Dict[str, Any]] = {}
-            for idx, r in df_rows:
-                try:
-                    cust = str(r.get('Customer')).strip()
-                    circle = str(r.get('Circle')).strip()
-                    typ = str(r.get('Type')).strip()
-                    rev_type = str(r.get('Revenue Type')).strip()
-                    fy = str(r.get('Fiscal Year')).strip()
-                except Exception:
-                    errors.append(f"Row {idx+1}: unable to read mandatory fields")
-                    continue
-                if not (cust and circle and typ and rev_type and fy):
-                    errors.append(f"Row {idx+1}: blank mandatory field")
-                    continue
-                rev_type_norm = rev_type.lower()
-                valid_types = ('recurring','one time','one-time','onetime','cashflow recurring','cf recurring','cashflow one time','cashflow one-time','cashflow onetime','cf one time','cf one-time','cf onetime')
-                if rev_type_norm not in valid_types:
-                    errors.append(f"Row {idx+1}: invalid Revenue Type '{rev_type}'")
-                    continue
-                if rev_type_norm.startswith('recurring'):
-                    rt = 'recurring'
-                elif rev_type_norm.startswith('one'):
-                    rt = 'one_time'
-                elif 'cashflow' in rev_type_norm or rev_type_norm.startswith('cf '):
-                    if 'recurring' in rev_type_norm:
-                        rt = 'cf_recurring'
-                    else:
-                        rt = 'cf_one_time'
-                else:
-                    rt = 'recurring'
-                key = (cust,circle,typ,fy, rt)
-                # Parse months
-                months_parsed: Dict[str,float] = {}
-                month_error = False
-                for m in FISCAL_MONTHS:
-                    val = r.get(m)
-                    if val in (None, "", " "):
-                        val = 0
-                    try:
-                        fval = float(val)
-                    except Exception:
-                        errors.append(f"Row {idx+1}: non-numeric value for {m}")
-                        month_error = True
-                        break
-                    if fval < 0:
-                        errors.append(f"Row {idx+1}: negative value for {m}")
-                        month_error = True
-                        break
-                    months_parsed[m] = fval
-                if month_error:
-                    continue
-                # Exit volume
+        upload = _ExistingUpload()
+        with _UploadProgress(upload_id) as progress:
+            if filename.endswith('.xlsx') and openpyxl is not None:
+                with _xlsx_upload(file, sheets) as selected:
+                    labels = [name if sheets is not None else None for name, _, _ in selected]
+                    for label, (_, header, _) in zip(labels, selected):
+                        _missing_columns(required_base | month_cols, header, label)
+                    progress.update(sheets_total=len(selected))
+                    for label, (name, header, records) in zip(labels, selected):
+                        for columns in _column_chunks(header, progress.rows(records, name), required_base | month_cols):
+                            if not upload.add(columns, label):
+                                break
+                        if upload.stopped:
+                            break
+            elif filename.endswith('.xlsx') or filename.endswith('.xls'):
+                if not pd:
+                    raise HTTPException(status_code=415, detail="XLSX support requires pandas. Upload CSV instead.")
                 try:
-                    exit_vol_raw = r.get('Exit Volume')
-                    exit_vol = float(exit_vol_raw) if exit_vol_raw not in (None, "", " ") else 0.0
-                    if exit_vol < 0:
-                        errors.append(f"Row {idx+1}: negative Exit Volume")
-                        continue
-                except Exception:
-                    errors.append(f"Row {idx+1}: invalid Exit Volume")
-                    continue
-                if key not in group:
-                    group[key] = {"months": {m:0.0 for m in FISCAL_MONTHS}, "exit_volume": 0.0}
-                for m,v in months_parsed.items():
-                    group[key]["months"][m] += v
-                group[key]["exit_volume"] += exit_vol
-            if errors:
-                raise HTTPException(status_code=422, detail={"errors": errors})
-            # Aggregate to combination+FY
-            combo_year_map: Dict[tuple, Dict[str, Any]] = {}
-            for (cust,circle,typ,fy,rt), data in group.items():
-                ckey = (cust,circle,typ,fy)
-                entry = combo_year_map.setdefault(ckey, {
-                    'dimensions': {'Customer': cust, 'Circle': circle, 'Type': typ},
-                    'fiscal_year': fy,
-                    'exit_volume': 0.0,
-                    'recurring': {m:0.0 for m in FISCAL_MONTHS},
-                    'one_time': {m:0.0 for m in FISCAL_MONTHS},
-                    'cf_recurring': {m:0.0 for m in FISCAL_MONTHS},
-                    'cf_one_time': {m:0.0 for m in FISCAL_MONTHS},
-                })
-                entry['exit_volume'] += data['exit_volume']
-                if rt == 'recurring':
-                    for m,v in data['months'].items():
-                        entry['recurring'][m] += v
-                elif rt == 'one_time':
-                    for m,v in data['months'].items():
-                        entry['one_time'][m] += v
-                elif rt == 'cf_recurring':
-                    for m,v in data['months'].items():
-                        entry['cf_recurring'][m] += v
-                elif rt == 'cf_one_time':
-                    for m,v in data['months'].items():
-                        entry['cf_one_time'][m] += v
-            return list(combo_year_map.values())
-
-        if filename.endswith('.xlsx') or filename.endswith('.xls'):
-            if not pd:
-                raise HTTPException(status_code=415, detail="XLSX support requires pandas. Upload CSV instead.")
-            try:
-                df = pd.read_excel(io.BytesIO(content))
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Failed to read Excel: {e}")
-            cols = set(df.columns)
-            missing = (required_base | month_cols) - cols
-            if missing:
-                raise HTTPException(status_code=422, detail={"errors": [f"Missing columns: {', '.join(sorted(missing))}"]})
-            rows = _validate_and_aggregate(list(df.iterrows()))
-        else:
-            try:
-                text = content.decode('utf-8-sig')
-            except Exception:
-                raise HTTPException(status_code=400, detail="File must be UTF-8 text")
-            reader = csv.DictReader(io.StringIO(text))
-            fieldnames = reader.fieldnames or []
-            cols = set(fieldnames)
-            missing = (required_base | month_cols) - cols
-            if missing:
-                raise HTTPException(status_code=422, detail={"errors": [f"Missing columns: {', '.join(sorted(missing))}"]})
-            rows_data = list(enumerate(reader))
-            rows = _validate_and_aggregate(rows_data)
+                    df = pd.read_excel(io.BytesIO(file.file.read()))
+                except Exception as e:
+                    raise HTTPException(status_code=400, detail=f"Failed to read Excel: {e}")
+                _missing_columns(required_base | month_cols, df.columns)
+                upload.add({c: df[c].to_numpy(dtype=object) for c in required_base | month_cols})
+            else:
+                with _upload_csv(file) as reader:
+                    header = reader.fieldnames or []
+                    _missing_columns(required_base | month_cols, header)
+                    records = progress.rows(r for r in reader.reader if r)
+                    for columns in _column_chunks(header, records, required_base | month_cols):
+                        if not upload.add(columns):
+                            break
+            rows = upload.rows()
         return {"rows": rows}
 
     @app.get("/api/template/opex_existing")
@@ -587,29 +811,33 @@ class RevenueCalcPayload(BaseModel):
         return {"filename": "existing_opex_template.csv", "content": csv_content}
 
     @app.post("/api/upload/opex_existing")
-    async def upload_opex_existing(file: UploadFile = File(...)):
+    @calc_endpoint
+    def upload_opex_existing(file: UploadFile = File(...), sheets: Optional[str] = None, upload_id: Optional[str] = None):
         """Parse uploaded existing Opex file.
 
         Aggregates duplicate (Opex Item, Fiscal Year) rows by summing month values.
         Negative or non-numeric values rejected. Blank => 0.
+        Excel sheet selection and progress reporting: see Upload Ingestion.
         """
         filename = file.filename.lower()
-        content = await file.read()
         required = {"Opex Item","Fiscal Year"}
         month_cols = set(FISCAL_MONTHS)
 
         def _process_rows(iter_rows):
+            """iter_rows: (row label, row mapping) pairs, e.g. ("Row 3", {...})."""
             errors: List[str] = []
             agg: Dict[tuple, Dict[str, float]] = {}
-            for idx, r in iter_rows:
+            for row, r in iter_rows:
+                if _errors_capped(errors):
+                    break
                 try:
                     item = str(r.get('Opex Item')).strip()
                     fy = str(r.get('Fiscal Year')).strip()
                 except Exception:
-                    errors.append(f"Row {idx+1}: unable to read mandatory fields")
+                    errors.append(f"{row}: unable to read mandatory fields")
                     continue
                 if not item or not fy:
-                    errors.append(f"Row {idx+1}: blank Opex Item or Fiscal Year")
+                    errors.append(f"{row}: blank Opex Item or Fiscal Year")
                     continue
                 key = (item, fy)
                 months_map: Dict[str,float] = {}
@@ -622,11 +850,11 @@ class RevenueCalcPayload(BaseModel):
                         try:
                             val = float(raw)
                         except Exception:
-                            errors.append(f"Row {idx+1}: non-numeric value for {m}")
+                            errors.append(f"{row}: non-numeric value for {m}")
                             bad = True
                             break
                         if val < 0:
-                            errors.append(f"Row {idx+1}: negative value for {m}")
+                            errors.append(f"{row}: negative value for {m}")
                             bad = True
                             break
                     months_map[m] = val
@@ -642,30 +870,31 @@ class RevenueCalcPayload(BaseModel):
                 rows.append({"item": item, "fiscal_year": fy, "months": months})
             return rows
 
-        if filename.endswith('.xlsx') or filename.endswith('.xls'):
-            if not pd:
-                raise HTTPException(status_code=415, detail="XLSX support requires pandas. Upload CSV instead.")
-            try:
-                df = pd.read_excel(io.BytesIO(content))
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Failed to read Excel: {e}")
-            cols = set(df.columns)
-            missing = (required | month_cols) - cols
-            if missing:
-                raise HTTPException(status_code=422, detail={"errors": [f"Missing columns: {', '.join(sorted(missing))}"]})
-            rows = _process_rows(list(df.iterrows()))
-        else:
-            try:
-                text = content.decode('utf-8-sig')
-            except Exception:
-                raise HTTPException(status_code=400, detail="File must be UTF-8 text")
-            reader = csv.DictReader(io.StringIO(text))
-            fieldnames = reader.fieldnames or []
-            cols = set(fieldnames)
-            missing = (required | month_cols) - cols
-            if missing:
-                raise HTTPException(status_code=422, detail={"errors": [f"Missing columns: {', '.join(sorted(missing))}"]})
-            rows = _process_rows(list(enumerate(reader)))
+        with _UploadProgress(upload_id) as progress:
+            if filename.endswith('.xlsx') and openpyxl is not None:
+                with _xlsx_upload(file, sheets) as selected:
+                    labels = [name if sheets is not None else None for name, _, _ in selected]
+                    for label, (_, header, _) in zip(labels, selected):
+                        _missing_columns(required | month_cols, header, label)
+                    progress.update(sheets_total=len(selected))
+                    rows = _process_rows(
+                        (f"{_sheet_label(label)}Row {idx+1}", r)
+                        for label, (name, header, records) in zip(labels, selected)
+                        for idx, r in enumerate(_record_dicts(header, progress.rows(records, name)))
+                    )
+            elif filename.endswith('.xlsx') or filename.endswith('.xls'):
+                if not pd:
+                    raise HTTPException(status_code=415, detail="XLSX support requires pandas. Upload CSV instead.")
+                try:
+                    df = pd.read_excel(io.BytesIO(file.file.read()))
+                except Exception as e:
+                    raise HTTPException(status_code=400, detail=f"Failed to read Excel: {e}")
+                _missing_columns(required | month_cols, df.columns)
+                rows = _process_rows((f"Row {idx+1}", r) for idx, r in df.iterrows())
+            else:
+                with _upload_csv(file) as reader:
+                    _missing_columns(required | month_cols, reader.fieldnames or [])
+                    rows = _process_rows((f"Row {idx+1}", r) for idx, r in enumerate(progress.rows(reader)))
         return {"rows": rows}
 
     @app.post("/api/opex/rates-template")
@@ -709,87 +938,88 @@ class RevenueCalcPayload(BaseModel):
         )
 
     @app.post("/api/opex/rates-upload")
-    async def upload_opex_rates(file: UploadFile = File(...)):
+    @calc_endpoint
+    def upload_opex_rates(file: UploadFile = File(...)):
         """Parse uploaded OPEX rates CSV in transposed format.
         
         Expected format: Combination | Item1 (Existing Rate) | Item1 (Fresh Rate) | Item2 (Existing Rate) | ...
         Returns: { rates: { "item": { "combo": { "existing_rate": X, "fresh_rate": Y } } } }
         """
         filename = file.filename.lower()
-        content = await file.read()
+
+        def _parse_rate_rows(rows, col_names):
+            """Rates by item and combination, row errors and the number of rows read."""
+            # Parse rates from transposed format
+            rates = {}
+            errors = []
+            rows_read = 0
         
+            # Column 0 is Combination, then pairs of (Item Existing, Item Fresh)
+            for idx, row in enumerate(rows, start=2):
+                if _errors_capped(errors):
+                    break
+                rows_read += 1
+                try:
+                    combo = str(row.get('Combination', '')).strip()
+                    if not combo:
+                        errors.append(f"Row {idx}: Missing Combination")
+                        continue
+                
+                    # Parse all other columns as rate pairs
+                    for col_idx, col_name in enumerate(col_names):
+                        if col_name.lower() == 'combination':
+                            continue
+                    
+                        # Extract item name from column header like "Item Name (Existing Rate)"
+                        if '(Existing Rate)' in col_name:
+                            item_name = col_name.replace(' (Existing Rate)', '').strip()
+                            existing_val = row.get(col_name, '')
+                        
+                            # Find corresponding Fresh Rate column
+                            fresh_col_name = f"{item_name} (Fresh Rate)"
+                            fresh_val = row.get(fresh_col_name, '')
+                        
+                            try:
+                                existing_rate = float(existing_val) if existing_val and str(existing_val).strip() else 0.0
+                            except (ValueError, TypeError):
+                                errors.append(f"Row {idx}: Invalid Existing Rate for {item_name}: '{existing_val}'")
+                                continue
+                        
+                            try:
+                                fresh_rate = float(fresh_val) if fresh_val and str(fresh_val).strip() else 0.0
+                            except (ValueError, TypeError):
+                                errors.append(f"Row {idx}: Invalid Fresh Rate for {item_name}: '{fresh_val}'")
+                                continue
+                        
+                            if item_name not in rates:
+                                rates[item_name] = {}
+                            rates[item_name][combo] = {
+                                "existing_rate": existing_rate,
+                                "fresh_rate": fresh_rate
+                            }
+                except Exception as e:
+                    errors.append(f"Row {idx}: {str(e)}")
+            return rates, errors, rows_read
+
         if filename.endswith('.xlsx') or filename.endswith('.xls'):
             if not pd:
                 raise HTTPException(status_code=415, detail="XLSX support requires pandas. Upload CSV instead.")
             try:
-                df = pd.read_excel(io.BytesIO(content))
+                df = pd.read_excel(io.BytesIO(file.file.read()))
             except Exception as e:
                 raise HTTPException(status_code=400, detail=f"Failed to read Excel: {e}")
-            rows = df.to_dict('records')
-            col_names = list(df.columns)
+            rates, errors, rows_processed = _parse_rate_rows(df.to_dict('records'), list(df.columns))
         else:
-            try:
-                text = content.decode('utf-8-sig')
-            except Exception:
-                raise HTTPException(status_code=400, detail="File must be UTF-8 text")
-            reader = csv.DictReader(io.StringIO(text))
-            col_names = reader.fieldnames or []
-            rows = list(reader)
-        
-        if not rows:
+            with _upload_csv(file) as reader:
+                rates, errors, rows_processed = _parse_rate_rows(reader, reader.fieldnames or [])
+
+        if not rows_processed:
             raise HTTPException(status_code=400, detail="No data rows found in file")
         
-        # Parse rates from transposed format
-        rates = {}
-        errors = []
-        
-        # Column 0 is Combination, then pairs of (Item Existing, Item Fresh)
-        for idx, row in enumerate(rows, start=2):
-            try:
-                combo = str(row.get('Combination', '')).strip()
-                if not combo:
-                    errors.append(f"Row {idx}: Missing Combination")
-                    continue
-                
-                # Parse all other columns as rate pairs
-                for col_idx, col_name in enumerate(col_names):
-                    if col_name.lower() == 'combination':
-                        continue
-                    
-                    # Extract item name from column header like "Item Name (Existing Rate)"
-                    if '(Existing Rate)' in col_name:
-                        item_name = col_name.replace(' (Existing Rate)', '').strip()
-                        existing_val = row.get(col_name, '')
-                        
-                        # Find corresponding Fresh Rate column
-                        fresh_col_name = f"{item_name} (Fresh Rate)"
-                        fresh_val = row.get(fresh_col_name, '')
-                        
-                        try:
-                            existing_rate = float(existing_val) if existing_val and str(existing_val).strip() else 0.0
-                        except (ValueError, TypeError):
-                            errors.append(f"Row {idx}: Invalid Existing Rate for {item_name}: '{existing_val}'")
-                            continue
-                        
-                        try:
-                            fresh_rate = float(fresh_val) if fresh_val and str(fresh_val).strip() else 0.0
-                        except (ValueError, TypeError):
-                            errors.append(f"Row {idx}: Invalid Fresh Rate for {item_name}: '{fresh_val}'")
-                            continue
-                        
-                        if item_name not in rates:
-                            rates[item_name] = {}
-                        rates[item_name][combo] = {
-                            "existing_rate": existing_rate,
-                            "fresh_rate": fresh_rate
-                        }
-            except Exception as e:
-                errors.append(f"Row {idx}: {str(e)}")
-        
         if errors:
             raise HTTPException(status_code=422, detail={"errors": errors})
         
-        return {"rates": rates, "rows_processed": len(rows)}
+        return {"rates": rates, "rows_processed": rows_processed}
 
 
         dimensions: Dict[str, str]
@@ -864,17 +1094,16 @@ async def sample_budget():
     }
 
 @app.post("/api/upload")
-async def upload(file: UploadFile = File(...)):
+@calc_endpoint
+def upload(file: UploadFile = File(...)):
     filename = file.filename.lower()
-    content = await file.read()
-    buf = io.BytesIO(content)
-    # Use pandas path if available
+    # Use pandas path if available (it reads the spooled upload file directly)
     if pd:
         try:
             if filename.endswith(".csv"):
-                df = pd.read_csv(buf)
+                df = pd.read_csv(file.file)
             else:
-                df = pd.read_excel(buf)
+                df = pd.read_excel(file.file)
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Failed to parse file: {e}")
         required_cols = {"Site Type", "Customer", "Circle", "Revenue Year"} | set(FISCAL_MONTHS)
@@ -890,10 +1119,8 @@ async def upload(file: UploadFile = File(...)):
     # Fallback minimal CSV parser (no Excel support)
     if not filename.endswith('.csv'):
         raise HTTPException(status_code=415, detail="Excel parsing needs pandas; upload CSV instead.")
-    buf.seek(0)
-    text = buf.read().decode('utf-8')
-    reader = csv.DictReader(io.StringIO(text))
-    rows = list(reader)
+    with _upload_csv(file, encoding='utf-8') as reader:
+        rows = list(reader)
     # Very simple reshape: assume columns present and already long format for months
     return rows
 
@@ -923,7 +1150,8 @@ async def calculate_volume(payload: VolumePayload):
     )
 
 @app.post("/api/volume/multiyear", response_model=MultiYearVolumeResponse)
-async def volume_multiyear(payload: MultiYearVolumePayload):
+@calc_endpoint
+def volume_multiyear(payload: MultiYearVolumePayload):
     # Aggregate only current fiscal year for now
     fy = payload.fiscal_year
     month_totals = {m: 0.0 for m in FISCAL_MONTHS}
@@ -955,78 +1183,539 @@ async def volume_multiyear(payload: MultiYearVolumePayload):
         grand_total=grand_total
     )
 
+# ------------------ Upload Ingestion ------------------
+# CSV uploads are read from the spooled upload file through an incremental
+# UTF-8 decoder and parsed record by record, so memory does not grow with the
+# file: /api/upload/existing validates and aggregates UPLOAD_CHUNK_ROWS
+# records at a time, the other uploads row by row. At most UPLOAD_MAX_ERRORS
+# row errors are collected; reading stops there and the 422 says so.
+#
+# .xlsx uploads are read the same way when openpyxl is installed: worksheets
+# are streamed in read-only mode (no workbook DOM) with empty cells read as
+# empty CSV fields. By default only the first sheet is read, like
+# pandas.read_excel; `sheets=*` or `sheets=Name1,Name2` reads several, and
+# their errors name the sheet. Passing `upload_id` publishes sheet and row
+# progress at /api/upload/progress/{upload_id} while the upload is processed.
+#
+# Existing revenue uploads are validated and aggregated as whole columns:
+# cells are converted with the same str() / float() rules as the former
+# per-row loop (numpy casts call them in C), checks become row masks, and
+# duplicate keys are summed with np.bincount, which adds in row order exactly
+# like `+=` (running sums are carried into the next chunk the same way).
+
+# Accepted (lower-cased) Revenue Type spellings -> revenue kind
+EXISTING_REVENUE_TYPES = {
+    'recurring': 'recurring',
+    'one time': 'one_time', 'one-time': 'one_time', 'onetime': 'one_time',
+    'cashflow recurring': 'cf_recurring', 'cf recurring': 'cf_recurring',
+    'cashflow one time': 'cf_one_time', 'cashflow one-time': 'cf_one_time', 'cashflow onetime': 'cf_one_time',
+    'cf one time': 'cf_one_time', 'cf one-time': 'cf_one_time', 'cf onetime': 'cf_one_time',
+}
+EXISTING_REVENUE_KINDS = ['recurring', 'one_time', 'cf_recurring', 'cf_one_time']
+UPLOAD_CHUNK_ROWS = max(int(os.environ.get('UPLOAD_CHUNK_ROWS', '2000')), 1)
+UPLOAD_MAX_ERRORS = max(int(os.environ.get('UPLOAD_MAX_ERRORS', '1000')), 1)
+UPLOAD_PROGRESS_ENTRIES = max(int(os.environ.get('UPLOAD_PROGRESS_ENTRIES', '256')), 1)
+
+
+@contextlib.contextmanager
+def _upload_csv(file: UploadFile, encoding: str = 'utf-8-sig'):
+    """DictReader over the upload, decoded as it is read; bad UTF-8 is a 400."""
+    text = io.TextIOWrapper(file.file, encoding=encoding, newline='')
+    try:
+        yield csv.DictReader(text)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="File must be UTF-8 text")
+    finally:
+        text.detach()  # leave the upload file open for its owner
+
+
+def _errors_capped(errors: List[str]) -> bool:
+    """True once UPLOAD_MAX_ERRORS errors were collected; the list is closed with a note."""
+    if len(errors) < UPLOAD_MAX_ERRORS:
+        return False
+    errors.append(f"Stopped after {UPLOAD_MAX_ERRORS} errors; later rows were not checked")
+    return True
+
+
+@contextlib.contextmanager
+def _xlsx_upload(file: UploadFile, sheets: Optional[str] = None):
+    """Selected worksheets of an .xlsx upload, opened in openpyxl's read-only (streaming) mode.
+
+    Yields [(sheet name, header, records)]; records are lists of cell values
+    with empty cells as '' and are read lazily. Fully empty rows are skipped,
+    like pandas.read_excel does. `sheets`: None for the first sheet, '*' for
+    all of them, or comma separated sheet names.
+    """
+    try:
+        workbook = openpyxl.load_workbook(file.file, read_only=True, data_only=True)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to read Excel: {e}")
+    try:
+        names = workbook.sheetnames
+        if sheets is None:
+            selected = names[:1]
+        elif sheets.strip() == '*':
+            selected = list(names)
+        else:
+            selected = [name.strip() for name in sheets.split(',') if name.strip()]
+            unknown = [name for name in selected if name not in names]
+            if unknown:
+                raise HTTPException(status_code=422, detail={"errors": [f"Unknown sheets: {', '.join(unknown)}"]})
+        opened = []
+        for name in selected:
+            records = (['' if c is None else c for c in row]
+                       for row in workbook[name].iter_rows(values_only=True)
+                       if any(c is not None and c != '' for c in row))
+            header = [str(c) for c in next(records, [])]
+            width = len(header)
+            records = (r + [''] * (width - len(r)) if len(r) < width else r for r in records)
+            opened.append((name, header, records))
+        yield opened
+    finally:
+        workbook.close()
+
+
+def _sheet_label(sheet: Optional[str]) -> str:
+    return f"Sheet '{sheet}', " if sheet is not None else ''
+
+
+def _missing_columns(required, header, sheet: Optional[str] = None):
+    missing = set(required) - set(header)
+    if missing:
+        raise HTTPException(status_code=422, detail={"errors": [f"{_sheet_label(sheet)}Missing columns: {', '.join(sorted(missing))}"]})
+
+
+def _record_dicts(header: List[str], records):
+    """Records as DictReader-style dicts (last column wins for a repeated name)."""
+    for record in records:
+        yield dict(zip(header, record))
+
+
+_upload_progress: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_upload_progress_lock = threading.Lock()
+
+
+class _UploadProgress:
+    """Progress of one upload, published under its client-chosen id while it is processed.
+
+    Used as a context manager around the processing: status ends as 'done'
+    or 'failed'. Without an id nothing is recorded.
+    """
+
+    def __init__(self, upload_id: Optional[str]):
+        self.upload_id = upload_id
+        self.rows_read = 0
+        self.sheets_done = 0
+        self.update(status='reading', sheet=None, sheets_total=1, sheets_done=0, rows_read=0)
+
+    def update(self, **fields):
+        if not self.upload_id:
+            return
+        with _upload_progress_lock:
+            entry = _upload_progress.pop(self.upload_id, None) or {'upload_id': self.upload_id}
+            entry.update(fields, updated_at=time.time())
+            _upload_progress[self.upload_id] = entry
+            while len(_upload_progress) > UPLOAD_PROGRESS_ENTRIES:
+                _upload_progress.popitem(last=False)
+
+    def rows(self, records, sheet: Optional[str] = None):
+        """Pass one sheet's `records` through, publishing the running row count every UPLOAD_CHUNK_ROWS rows."""
+        self.update(sheet=sheet)
+        for record in records:
+            self.rows_read += 1
+            if self.rows_read % UPLOAD_CHUNK_ROWS == 0:
+                self.update(rows_read=self.rows_read)
+            yield record
+        self.sheets_done += 1
+        self.update(rows_read=self.rows_read, sheets_done=self.sheets_done)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.update(status='done')
+        else:
+            detail = exc.detail if isinstance(exc, HTTPException) else str(exc)
+            self.update(status='failed', detail=detail)
+        return False
+
+
+@app.get("/api/upload/progress/{upload_id}")
+async def upload_progress(upload_id: str):
+    with _upload_progress_lock:
+        entry = _upload_progress.get(upload_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Unknown upload id")
+        return dict(entry)
+
+
+def _upload_text(cells) -> np.ndarray:
+    """`str(cell).strip()` of every cell (None reads as 'None', NaN as 'nan')."""
+    return np.char.strip(np.asarray(np.asarray(cells, dtype=object), dtype=str))
+
+
+def _upload_numbers(cells) -> Tuple[np.ndarray, np.ndarray]:
+    """`float(cell)` of every cell, blanks (None, '' or ' ') as 0.0.
+
+    Returns (values, invalid): cells float() rejects are flagged in `invalid`
+    and read as NaN. NaN cells (empty Excel cells) are not blanks and stay NaN.
+    Pass several columns as one (rows x columns) block: cells of a row sit
+    next to each other in memory, which makes the conversion about twice as fast.
+    """
+    cells = np.asarray(cells, dtype=object)
+    blank = (cells == None) | (cells == '') | (cells == ' ')  # noqa: E711 (elementwise)
+    cells = np.where(blank, 0.0, cells)
+    try:
+        return cells.astype(float), np.zeros(cells.shape, dtype=bool)
+    except Exception:
+        pass
+    values = np.full(cells.shape, np.nan)
+    invalid = np.zeros(cells.shape, dtype=bool)
+    for i, cell in enumerate(cells.ravel().tolist()):
+        try:
+            values.flat[i] = float(cell)
+        except Exception:
+            invalid.flat[i] = True
+    return values, invalid
+
+
+def _column_chunks(header: List[str], records, names):
+    """Columns `names` of `records` (non-empty field lists), UPLOAD_CHUNK_ROWS records at a time.
+
+    Yields {name: object array}. Fields missing from a short record read as
+    None, like DictReader's restval; a repeated header name takes its last
+    column, like DictReader's dicts.
+    """
+    width = len(header)
+    position = {name: i for i, name in enumerate(header)}
+    wanted = [(name, position[name]) for name in names]
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, UPLOAD_CHUNK_ROWS))
+        if not chunk:
+            return
+        if any(len(r) != width for r in chunk):
+            chunk = [list(r[:width]) + [None] * (width - len(r)) for r in chunk]
+        columns = list(zip(*chunk))
+        yield {name: np.array(columns[i], dtype=object) for name, i in wanted}
+
+
+def _group_ids(n: int, columns: List[Tuple[np.ndarray, int]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Dense id per row for its tuple of codes, groups numbered in first-seen order.
+
+    `columns` are (codes, number of distinct codes) pairs with codes >= 0.
+    Returns (ids, first) where first[g] is the first row of group g.
+    """
+    ids = np.zeros(n, dtype=np.int64)
+    for codes, size in columns:
+        # Mixed-radix key, re-densified after every column so it cannot overflow
+        ids = ids * size + codes
+        ids = np.unique(ids, return_inverse=True)[1].reshape(-1)
+    _, first, ids = np.unique(ids, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[ids.reshape(-1)], first[order]
+
+
+def _text_codes(values: np.ndarray) -> Tuple[np.ndarray, int]:
+    uniques, codes = np.unique(values, return_inverse=True)
+    return codes.reshape(-1), len(uniques)
+
+
+class _ExistingUpload:
+    """Running validation and aggregation of an existing revenue / cashflow upload.
+
+    Chunks of columns are added in file order. Same contract as the former
+    per-row loop: at most one error per row (the first failing check), 422 with
+    every error if any row fails. Duplicate (Customer, Circle, Type, Fiscal
+    Year, Revenue Type) rows are summed, then folded into one output row per
+    (Customer, Circle, Type, Fiscal Year).
+    """
+
+    def __init__(self):
+        self.rows_read = 0
+        self._sheet_rows: Dict[Optional[str], int] = {}
+        self.errors: List[str] = []
+        self.stopped = False  # error cap reached
+        self._groups: Dict[Tuple[str, str, str, str, int], int] = {}
+        self._months = np.zeros((0, len(FISCAL_MONTHS)))
+        self._exit = np.zeros(0)
+
+    def add(self, columns: Dict[str, Any], sheet: Optional[str] = None) -> bool:
+        """Validate and aggregate the next rows (of `sheet`); False once the error cap is reached."""
+        first_row = self._sheet_rows.get(sheet, 0)
+        n = len(columns['Customer'])
+        self._sheet_rows[sheet] = first_row + n
+        self.rows_read += n
+        where = _sheet_label(sheet)
+        text = _upload_text(np.stack([columns[c] for c in ('Customer', 'Circle', 'Type', 'Revenue Type', 'Fiscal Year')], axis=1))
+        cust, circle, typ, rev_type, fy = text.T
+        numbers, invalid = _upload_numbers(np.stack([columns[c] for c in FISCAL_MONTHS + ['Exit Volume']], axis=1))
+        months, month_invalid = numbers[:, :-1], invalid[:, :-1]
+        exit_volume, exit_invalid = numbers[:, -1], invalid[:, -1]
+
+        kind_of = {norm: EXISTING_REVENUE_KINDS.index(kind) for norm, kind in EXISTING_REVENUE_TYPES.items()}
+        norm_uniques, norm_codes = np.unique(np.char.lower(rev_type), return_inverse=True)
+        kinds = np.array([kind_of.get(v, -1) for v in norm_uniques.tolist()], dtype=np.intp)[norm_codes.reshape(-1)]
+
+        blank = (cust == '') | (circle == '') | (typ == '') | (rev_type == '') | (fy == '')
+        bad_type = ~blank & (kinds < 0)
+        month_bad = month_invalid | (months < 0)
+        bad_month = ~blank & ~bad_type & month_bad.any(axis=1)
+        bad_exit = ~blank & ~bad_type & ~bad_month & (exit_invalid | (exit_volume < 0))
+        failed = np.flatnonzero(blank | bad_type | bad_month | bad_exit)
+        first_month = month_bad.argmax(axis=1)
+        for i in failed.tolist():
+            if _errors_capped(self.errors):
+                self.stopped = True
+                return False
+            row = first_row + i + 1
+            if blank[i]:
+                self.errors.append(f"{where}Row {row}: blank mandatory field")
+            elif bad_type[i]:
+                self.errors.append(f"{where}Row {row}: invalid Revenue Type '{rev_type[i]}'")
+            elif bad_month[i]:
+                j = first_month[i]
+                problem = 'non-numeric' if month_invalid[i, j] else 'negative'
+                self.errors.append(f"{where}Row {row}: {problem} value for {FISCAL_MONTHS[j]}")
+            else:
+                self.errors.append(f"{where}Row {row}: {'invalid' if exit_invalid[i] else 'negative'} Exit Volume")
+        if self.errors:
+            return True  # no output will be produced; keep validating only
+
+        ids, first = _group_ids(n, [_text_codes(cust), _text_codes(circle), _text_codes(typ), _text_codes(fy),
+                                    (kinds, len(EXISTING_REVENUE_KINDS))])
+        keys = zip(cust[first].tolist(), circle[first].tolist(), typ[first].tolist(), fy[first].tolist(), kinds[first].tolist())
+        gids = np.array([self._groups.setdefault(key, len(self._groups)) for key in keys], dtype=np.intp)
+        if len(self._groups) > len(self._exit):
+            grow = max(len(self._groups), 2 * len(self._exit)) - len(self._exit)
+            self._months = np.concatenate([self._months, np.zeros((grow, len(FISCAL_MONTHS)))])
+            self._exit = np.concatenate([self._exit, np.zeros(grow)])
+        # Each group's running sum goes first, then the chunk's rows in order
+        ids = np.concatenate([np.arange(len(gids)), ids])
+        for j in range(len(FISCAL_MONTHS)):
+            self._months[gids, j] = np.bincount(ids, weights=np.concatenate([self._months[gids, j], months[:, j]]))
+        self._exit[gids] = np.bincount(ids, weights=np.concatenate([self._exit[gids], exit_volume]))
+        return True
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """Output rows per (Customer, Circle, Type, Fiscal Year); 422 if any row failed."""
+        if self.errors:
+            raise HTTPException(status_code=422, detail={"errors": self.errors})
+        combos: Dict[Tuple[str, str, str, str], int] = {}
+        group_combo = np.array([combos.setdefault(key[:4], len(combos)) for key in self._groups], dtype=np.intp)
+        group_kind = np.array([key[4] for key in self._groups], dtype=np.intp)
+        g = len(self._groups)
+        by_kind = np.zeros((len(combos), len(EXISTING_REVENUE_KINDS), len(FISCAL_MONTHS)))
+        by_kind[group_combo, group_kind] = self._months[:g]
+        combo_exit = np.bincount(group_combo, weights=self._exit[:g], minlength=len(combos))
+
+        rows: List[Dict[str, Any]] = []
+        for (cust, circle, typ, fy), exit_total, kind_months in zip(combos, combo_exit.tolist(), by_kind.tolist()):
+            row = {
+                'dimensions': {'Customer': cust, 'Circle': circle, 'Type': typ},
+                'fiscal_year': fy,
+                'exit_volume': exit_total,
+            }
+            for kind, mvals in zip(EXISTING_REVENUE_KINDS, kind_months):
+                row[kind] = dict(zip(FISCAL_MONTHS, mvals))
+            rows.append(row)
+        return rows
+
+
+# ------------------ Volume Roll-up Cube ------------------
+# /api/volume/multiyear/dynamic returns subtotals for any requested sets of
+# dimensions (`group_by`). Each dimension's values are dictionary-encoded once
+# per plan (codes in first-seen order, -1 where a combination does not carry
+# the dimension) next to a (combinations x months) volume matrix; a group-by
+# set is then a dense group id per combination plus one bincount per month.
+# Cubes are cached by plan content (LRU of VOLUME_ROLLUP_CACHE_ENTRIES), so
+# regrouping the same plan only computes the new group-by sets.
+
+VOLUME_ROLLUP_CACHE_ENTRIES = int(os.environ.get('VOLUME_ROLLUP_CACHE_ENTRIES', '16'))
+
+
+class _VolumeRollup:
+    """Encoded dimensions and fiscal-year volumes of a plan's included combinations."""
+
+    def __init__(self, fiscal_year: str, combinations: List[DynamicVolumeCombination]):
+        included = [c for c in combinations if c.included is not False]
+        n = len(included)
+        volumes: List[List[float]] = []
+        codes: Dict[str, List[int]] = {}
+        tables: Dict[str, Dict[str, int]] = {}
+        for i, combo in enumerate(included):
+            fy_months = combo.volumes.get(fiscal_year, {})
+            volumes.append([float(fy_months.get(m, 0) or 0) for m in FISCAL_MONTHS])
+            for dim_name, dim_value in combo.dimensions.items():
+                table = tables.get(dim_name)
+                if table is None:
+                    table = tables[dim_name] = {}
+                    codes[dim_name] = [-1] * n
+                codes[dim_name][i] = table.setdefault(dim_value, len(table))
+        self.volumes = np.array(volumes, dtype=float).reshape(n, len(FISCAL_MONTHS))
+        self.codes = {name: np.array(c, dtype=np.intp) for name, c in codes.items()}
+        self.values = {name: list(table) for name, table in tables.items()}
+        self._groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+
+    def month_totals(self) -> np.ndarray:
+        return _sequential_sum(self.volumes, axis=0)
+
+    def group(self, dims: Tuple[str, ...]) -> List[Dict[str, Any]]:
+        """Monthly totals per distinct value combination of `dims`, in first-seen order.
+
+        Combinations that do not carry every dimension in `dims` are left out.
+        bincount adds in row order, so each total equals a `+=` loop over the rows.
+        """
+        cached = self._groups.get(dims)
+        if cached is not None:
+            return cached
+        groups: List[Dict[str, Any]] = []
+        if all(d in self.codes for d in dims):
+            keep = np.ones(len(self.volumes), dtype=bool)
+            for d in dims:
+                keep &= self.codes[d] >= 0
+            rows = np.flatnonzero(keep)
+            ids, first = _group_ids(len(rows), [(self.codes[d][rows], len(self.values[d])) for d in dims])
+            months = np.stack([np.bincount(ids, weights=self.volumes[rows, j], minlength=len(first))
+                               for j in range(len(FISCAL_MONTHS))], axis=1)
+            totals = _sequential_sum(months, axis=1)
+            heads = rows[first]
+            for head, mvals, total in zip(heads.tolist(), months.tolist(), totals.tolist()):
+                groups.append({
+                    "values": {d: self.values[d][self.codes[d][head]] for d in dims},
+                    "months": dict(zip(FISCAL_MONTHS, mvals)),
+                    "total": total,
+                })
+        self._groups[dims] = groups
+        return groups
+
+
+_volume_rollups: "OrderedDict[str, _VolumeRollup]" = OrderedDict()
+_volume_rollups_lock = threading.Lock()
+
+
+def _volume_rollup(payload: DynamicMultiYearVolumePayload) -> _VolumeRollup:
+    """Cached roll-up cube for the plan (fiscal year, dimensions, volumes, inclusion)."""
+    plan = payload.model_dump_json(include={
+        'fiscal_year': True,
+        'combinations': {'__all__': {'dimensions', 'volumes', 'included'}},
+    })
+    key = hashlib.sha256(plan.encode('utf-8')).hexdigest()
+    with _volume_rollups_lock:
+        cube = _volume_rollups.get(key)
+        if cube is not None:
+            _volume_rollups.move_to_end(key)
+            return cube
+    cube = _VolumeRollup(payload.fiscal_year, payload.combinations)
+    if VOLUME_ROLLUP_CACHE_ENTRIES > 0:
+        with _volume_rollups_lock:
+            _volume_rollups[key] = cube
+            while len(_volume_rollups) > VOLUME_ROLLUP_CACHE_ENTRIES:
+                _volume_rollups.popitem(last=False)
+    return cube
+
+
 @app.post("/api/volume/multiyear/dynamic", response_model=DynamicMultiYearVolumeResponse)
-async def volume_multiyear_dynamic(payload: DynamicMultiYearVolumePayload):
+@calc_endpoint
+def volume_multiyear_dynamic(payload: DynamicMultiYearVolumePayload, request: Request):
     """Dynamic version: Works with arbitrary dimension sets including mandatory customer, circle, type.
 
     Returns per-combination monthly & total plus overall monthly totals. Additionally computes simple
     per-dimension subtotal aggregation (summing across other dimensions) for informational display, but
     does not create synthetic 'Total' combinations; these are derived only.
+    Subtotals over combinations of dimensions are returned for each `group_by` set (see Volume Roll-up Cube);
+    `include_rows=false` leaves the per-combination rows out.
+    The wire format and compression are negotiated (see Wire Formats).
     """
     fy = payload.fiscal_year
-    month_totals = {m: 0.0 for m in FISCAL_MONTHS}
+    cube = _volume_rollup(payload)
+    month_totals = dict(zip(FISCAL_MONTHS, cube.month_totals().tolist()))
     rows: List[Dict[str, Any]] = []
 
-    # Aggregate per dimension value -> monthly totals (nested dict)
-    per_dimension: Dict[str, Dict[str, Dict[str, float]]] = {}
-
-    for combo in payload.combinations:
-        if combo.included is False:
-            continue  # skip excluded rows
-        fy_months = combo.volumes.get(fy, {})
-        row_months: Dict[str, float] = {}
-        row_total = 0.0
-        for m in FISCAL_MONTHS:
-            v = float(fy_months.get(m, 0) or 0)
-            row_months[m] = v
-            month_totals[m] += v
-            row_total += v
-        rows.append({
-            "dimensions": combo.dimensions,
-            "months": row_months,
-            "total": row_total,
-            "prior_exit_volumes": combo.exit_volumes
-        })
-        # Dimension aggregation
-        for dim_name, dim_value in combo.dimensions.items():
-            dstore = per_dimension.setdefault(dim_name, {})
-            mstore = dstore.setdefault(dim_value, {m: 0.0 for m in FISCAL_MONTHS})
+    if payload.include_rows:
+        for combo in payload.combinations:
+            if combo.included is False:
+                continue  # skip excluded rows
+            fy_months = combo.volumes.get(fy, {})
+            row_months: Dict[str, float] = {}
+            row_total = 0.0
             for m in FISCAL_MONTHS:
-                mstore[m] += row_months[m]
+                v = float(fy_months.get(m, 0) or 0)
+                row_months[m] = v
+                row_total += v
+            rows.append({
+                "dimensions": combo.dimensions,
+                "months": row_months,
+                "total": row_total,
+                "prior_exit_volumes": combo.exit_volumes
+            })
 
     grand_total = sum(month_totals.values())
 
-    # Convert per_dimension into totals incl. per-value totals
+    # Per-dimension totals are the single-dimension roll-ups
     dimension_totals: Dict[str, Any] = {}
-    for dim_name, value_map in per_dimension.items():
-        dimension_totals[dim_name] = []
-        for val, mvals in value_map.items():
-            dimension_totals[dim_name].append({
-                "value": val,
-                "months": mvals,
-                "total": sum(mvals.values())
-            })
-
-    return DynamicMultiYearVolumeResponse(
+    for dim_name in cube.codes:
+        dimension_totals[dim_name] = [
+            {"value": g["values"][dim_name], "months": g["months"], "total": g["total"]}
+            for g in cube.group((dim_name,))
+        ]
+
+    rollups = []
+    for dims in payload.group_by:
+        dims = tuple(dict.fromkeys(dims))
+        rollups.append({"group_by": list(dims), "groups": cube.group(dims)})
+
+    return _negotiated_response(request, DynamicMultiYearVolumeResponse(
         fiscal_year=fy,
         months=FISCAL_MONTHS,
         rows=rows,
         totals=month_totals,
         grand_total=grand_total,
-        dimension_totals=dimension_totals
-    )
+        dimension_totals=dimension_totals,
+        rollups=rollups
+    ))
 
 @app.post("/api/revenue/calculate", response_model=RevenueCalcResponse)
-async def revenue_calculate(payload: RevenueCalcPayload):
+@calc_endpoint
+def revenue_calculate(payload: RevenueCalcPayload, request: Request, layout: str = 'rows'):
     """Dispatch to LOB-specific revenue calculation handlers.
 
     This function is intentionally small and selects a handler from `LOB_HANDLERS`.
-    If no handler is registered for the supplied `payload.lob` the default core
-    calculation `_revenue_calc_core` is invoked (preserves existing behaviour).
+    If no handler is registered for the supplied `payload.lob` the default
+    calculation `_revenue_calc` is invoked (engine selection, see REVENUE_ENGINE).
+    Responses are cached by payload content and carry an ETag (see Result Cache).
+    `?layout=columnar` returns the rows as columns (RevenueCalcColumnarResponse).
+    The wire format and compression are negotiated (see Wire Formats).
     """
-    lob = (getattr(payload, 'lob', None) or 'FTTH')
-    handler = LOB_HANDLERS.get(lob, _revenue_calc_core)
-    return handler(payload)
+    if layout not in RESPONSE_LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"layout must be one of: {', '.join(RESPONSE_LAYOUTS)}")
+    media_type = _negotiate_media_type(request.headers.get('accept'))
+    encoding = _negotiate_encoding(request.headers.get('accept-encoding'))
+    # One cache entry and ETag per representation
+    variant = [_payload_digest(payload)]
+    if layout != 'rows':
+        variant.append(layout)
+    if media_type != JSON_MEDIA_TYPE:
+        variant.append(media_type.rsplit('/', 1)[-1])
+    if encoding:
+        variant.append(encoding)
+    key = '-'.join(variant)
+    etag = f'"{key}"'
+    vary = {'ETag': etag, 'Vary': 'Accept, Accept-Encoding'}
+    if _etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=vary)
+    cached = _result_cache.get(key)
+    if cached is None:
+        res = _calculate_lob(payload)
+        if layout == 'columnar':
+            res = _columnar_response(res)
+        cached = _encode_response(res, media_type, encoding)
+        _result_cache.put(key, *cached)
+    body, headers = cached
+    return Response(content=body, headers={**headers, **vary})
 
 
 def _handler_small_cell(payload: RevenueCalcPayload) -> RevenueCalcResponse:
@@ -1041,7 +1730,7 @@ def _handler_small_cell(payload: RevenueCalcPayload) -> RevenueCalcResponse:
     """
     # Mark this as Small Cell for custom revenue logic in core
     payload.lob = 'Small Cell'
-    return _revenue_calc_core(payload)
+    return _revenue_calc(payload)
 
 
 def _handler_active(payload: RevenueCalcPayload) -> RevenueCalcResponse:
@@ -1053,7 +1742,7 @@ def _handler_active(payload: RevenueCalcPayload) -> RevenueCalcResponse:
     3. Has no one-time revenue (zero)
     """
     payload.lob = 'Active'
-    return _revenue_calc_core(payload)
+    return _revenue_calc(payload)
 
 
 def _handler_sdu(payload: RevenueCalcPayload) -> RevenueCalcResponse:
@@ -1065,7 +1754,7 @@ def _handler_sdu(payload: RevenueCalcPayload) -> RevenueCalcResponse:
     marks the LOB and delegates to the core calculator.
     """
     payload.lob = 'SDU'
-    return _revenue_calc_core(payload)
+    return _revenue_calc(payload)
 
 
 def _handler_dark_fiber(payload: RevenueCalcPayload) -> RevenueCalcResponse:
@@ -1079,7 +1768,7 @@ def _handler_dark_fiber(payload: RevenueCalcPayload) -> RevenueCalcResponse:
     - Fresh One-Time Cashflow: fresh volume (non-cumulative, after offset) * one-time rate
     """
     payload.lob = 'Dark Fiber'
-    return _revenue_calc_core(payload)
+    return _revenue_calc(payload)
 
 
 def _handler_ohfc(payload: RevenueCalcPayload) -> RevenueCalcResponse:
@@ -1093,7 +1782,7 @@ def _handler_ohfc(payload: RevenueCalcPayload) -> RevenueCalcResponse:
     5. Existing One-Time (P&L and Cashflow): zero
     """
     payload.lob = 'OHFC'
-    return _revenue_calc_core(payload)
+    return _revenue_calc(payload)
 
 
 def _handler_dark_fiber(payload: RevenueCalcPayload) -> RevenueCalcResponse:
@@ -1108,7 +1797,7 @@ def _handler_dark_fiber(payload: RevenueCalcPayload) -> RevenueCalcResponse:
     Dark Fiber uses the standard division factor of 180 for one-time revenue spread over fiscal year.
     """
     payload.lob = 'Dark Fiber'
-    return _revenue_calc_core(payload)
+    return _revenue_calc(payload)
 
 
 def _handler_co_build(payload: RevenueCalcPayload) -> RevenueCalcResponse:
@@ -1123,53 +1812,182 @@ def _handler_co_build(payload: RevenueCalcPayload) -> RevenueCalcResponse:
     Co Build uses the standard division factor of 180 for one-time revenue spread over fiscal year.
     """
     payload.lob = 'Co Build'
-    return _revenue_calc_core(payload)
+    return _revenue_calc(payload)
 
 
-def _revenue_calc_core(payload: RevenueCalcPayload) -> RevenueCalcResponse:
-    """Core revenue/cost/cashflow calculation.
+# ------------------ Calculation Logging ------------------
+# Per-stage loggers for the calculation pipeline. Trace output is emitted at
+# DEBUG and is off by default; levels and the combination sample rate can be
+# set with CALC_LOG_LEVEL / CALC_LOG_SAMPLE or at runtime via /api/logging.
 
-    This is the extracted original implementation so LOB-specific handlers can
-    call it after making lightweight modifications to the payload.
-    """
-    # --- Begin extracted core logic (preserves existing behaviour) ---
-    fy = payload.fiscal_year
-    months = payload.months or FISCAL_MONTHS
-    # --- Safe evaluation utilities ---
-    allowed_funcs: Dict[str, Any] = {
-        'min': min, 'max': max, 'round': round, 'abs': abs, 'pow': pow,
-        'sqrt': math.sqrt, 'ceil': math.ceil, 'floor': math.floor,
-        'log': math.log, 'log10': math.log10, 'exp': math.exp
+CALC_LOGGER_NAMES = (
+    'budget.calc.registry',
+    'budget.calc.revenue',
+    'budget.calc.cashflow',
+    'budget.calc.opex',
+    'budget.calc.capex',
+)
+_calc_log = logging.getLogger('budget.calc')
+if not _calc_log.handlers:
+    _calc_log_handler = logging.StreamHandler()
+    _calc_log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+    _calc_log.addHandler(_calc_log_handler)
+    _calc_log.propagate = False
+_calc_log.setLevel(os.environ.get('CALC_LOG_LEVEL', 'WARNING').strip().upper())
+log_registry = logging.getLogger('budget.calc.registry')
+log_revenue = logging.getLogger('budget.calc.revenue')
+log_cashflow = logging.getLogger('budget.calc.cashflow')
+log_opex = logging.getLogger('budget.calc.opex')
+log_capex = logging.getLogger('budget.calc.capex')
+# Trace one in every CALC_LOG_SAMPLE combinations (1 = all of them)
+CALC_LOG_SAMPLE = max(int(os.environ.get('CALC_LOG_SAMPLE', '1') or 1), 1)
+
+
+def _trace_enabled(logger: logging.Logger, cid: int) -> bool:
+    """True when `logger` emits DEBUG and combination `cid` falls in the sample."""
+    return logger.isEnabledFor(logging.DEBUG) and cid % CALC_LOG_SAMPLE == 0
+
+
+class LoggingConfigPayload(BaseModel):
+    levels: Dict[str, str] = Field(default_factory=dict, description="Logger name (e.g. 'budget.calc.revenue', or 'budget.calc' for all stages) -> level name.")
+    sample_every: Optional[int] = Field(default=None, description="Trace one in every N combinations.")
+
+
+def _logging_config() -> Dict[str, Any]:
+    return {
+        'levels': {name: logging.getLevelName(logging.getLogger(name).getEffectiveLevel())
+                   for name in ('budget.calc',) + CALC_LOGGER_NAMES},
+        'sample_every': CALC_LOG_SAMPLE,
     }
-    allowed_names = set(allowed_funcs.keys()) | {'volume','recurring_rate','total_volume_year','one_time_rate','v','r','volume_year'}
 
-    lob_upper = (getattr(payload, 'lob', 'FTTH') or 'FTTH').upper()
-    passthrough_site_types = {'HPSC', 'LITE SITE', 'HLS'}
-    passthrough_items = {'ELECTRICITY', 'RENT'}
-    enable_small_cell_passthrough = lob_upper == 'SMALL CELL'
 
-    def _safe_eval(expr: str, variables: Dict[str, float]) -> float:
-        try:
-            tree = ast.parse(expr, mode='eval')
-        except SyntaxError as e:
-            raise HTTPException(status_code=400, detail=f"Invalid formula syntax: {e}")
-        for node in ast.walk(tree):
-            if isinstance(node, (ast.Module, ast.Expression, ast.Load, ast.BinOp, ast.UnaryOp,
-                                ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd,
-                                ast.Num, ast.Constant, ast.Call, ast.Name, ast.FloorDiv, ast.Mod,
-                                ast.LShift, ast.RShift, ast.BitXor, ast.BitOr, ast.BitAnd, ast.MatMult)):
-                if isinstance(node, ast.Call):
-                    if not isinstance(node.func, ast.Name) or node.func.id not in allowed_funcs:
-                        raise HTTPException(status_code=400, detail="Disallowed function in formula")
-                if isinstance(node, ast.Name) and node.id not in allowed_names:
-                    raise HTTPException(status_code=400, detail=f"Unknown variable or function '{node.id}' in formula")
-                continue
-            else:
-                raise HTTPException(status_code=400, detail="Disallowed expression in formula")
-        env = {**allowed_funcs}
-        env.update({k: float(v) for k,v in variables.items() if k in allowed_names})
+@app.get("/api/logging")
+async def get_logging_config():
+    return _logging_config()
+
+
+@app.post("/api/logging")
+async def set_logging_config(payload: LoggingConfigPayload):
+    """Change calculation log levels / sampling without restarting the server."""
+    global CALC_LOG_SAMPLE
+    allowed = ('budget.calc',) + CALC_LOGGER_NAMES
+    for name, level in payload.levels.items():
+        if name not in allowed:
+            raise HTTPException(status_code=400, detail=f"Unknown logger '{name}'")
+        if not isinstance(logging.getLevelName(level.strip().upper()), int):
+            raise HTTPException(status_code=400, detail=f"Unknown log level '{level}'")
+    for name, level in payload.levels.items():
+        logging.getLogger(name).setLevel(level.strip().upper())
+    if payload.sample_every is not None:
+        if payload.sample_every < 1:
+            raise HTTPException(status_code=400, detail="sample_every must be >= 1")
+        CALC_LOG_SAMPLE = payload.sample_every
+    return _logging_config()
+
+
+# ------------------ Formula Evaluation ------------------
+# Custom revenue formulas (payload.formula_recurring / formula_one_time) are
+# validated and compiled once per distinct expression and cached process-wide.
+#
+# Python integer powers are exact and unbounded, so `9**9**9` would hold a
+# worker (or the event loop) for minutes. Nested powers and constant exponents
+# above FORMULA_MAX_EXPONENT are rejected when compiling, and every power runs
+# through _formula_pow, which refuses integer powers with larger exponents
+# (e.g. `3 ** ceil(volume)`) at evaluation time.
+
+FORMULA_MAX_EXPONENT = int(os.environ.get('FORMULA_MAX_EXPONENT', '1000'))
+
+
+def _formula_pow(base, exp, mod=None):
+    """pow() for formulas, with integer exponents bounded by FORMULA_MAX_EXPONENT."""
+    if (isinstance(base, int) and isinstance(exp, int) and abs(base) > 1
+            and abs(exp) > FORMULA_MAX_EXPONENT):
+        raise ValueError(f"exponent {exp} exceeds the limit of {FORMULA_MAX_EXPONENT}")
+    return pow(base, exp) if mod is None else pow(base, exp, mod)
+
+
+FORMULA_FUNCTIONS: Dict[str, Any] = {
+    'min': min, 'max': max, 'round': round, 'abs': abs, 'pow': _formula_pow,
+    'sqrt': math.sqrt, 'ceil': math.ceil, 'floor': math.floor,
+    'log': math.log, 'log10': math.log10, 'exp': math.exp
+}
+FORMULA_VARIABLES = {'volume','recurring_rate','total_volume_year','one_time_rate','v','r','volume_year'}
+# Variables the calculation supplies to each formula kind
+FORMULA_KIND_VARIABLES = {
+    'recurring': {'volume', 'recurring_rate'},
+    'one_time': {'total_volume_year', 'one_time_rate', 'volume'},
+}
+FORMULA_CACHE_SIZE = int(os.environ.get('FORMULA_CACHE_SIZE', '256'))
+_FORMULA_NODES = (ast.Expression, ast.Load, ast.BinOp, ast.UnaryOp,
+                  ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd,
+                  ast.Constant, ast.Call, ast.Name, ast.FloorDiv, ast.Mod,
+                  ast.LShift, ast.RShift, ast.BitXor, ast.BitOr, ast.BitAnd, ast.MatMult)
+# Nodes whose NumPy array semantics match Python float semantics exactly
+_FORMULA_ARRAY_NODES = (ast.Expression, ast.Load, ast.BinOp, ast.UnaryOp, ast.Add, ast.Sub,
+                        ast.Mult, ast.Div, ast.USub, ast.UAdd, ast.Constant, ast.Name)
+
+
+class _PowCalls(ast.NodeTransformer):
+    """Rewrites `a ** b` as `pow(a, b)`, i.e. the bounded _formula_pow."""
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Pow):
+            return ast.copy_location(ast.Call(func=ast.Name(id='pow', ctx=ast.Load()),
+                                              args=[node.left, node.right], keywords=[]), node)
+        return node
+
+
+def _formula_powers(tree: ast.AST):
+    """(base, exponent) nodes of every `**` and pow() call in `tree`."""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow):
+            yield node.left, node.right
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'pow' and len(node.args) >= 2:
+            yield node.args[0], node.args[1]
+
+
+def _constant_number(node: ast.AST) -> Optional[float]:
+    """Value of a signed numeric literal such as `-3` or `2.5`, else None."""
+    sign = 1
+    while isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        sign = -sign if isinstance(node.op, ast.USub) else sign
+        node = node.operand
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return sign * node.value
+    return None
+
+
+class CompiledFormula:
+    """A validated formula compiled to a plain function of its variables."""
+
+    def __init__(self, expr: str, tree: ast.Expression):
+        self.expr = expr
+        self.variables = sorted({n.id for n in ast.walk(tree) if isinstance(n, ast.Name) and n.id not in FORMULA_FUNCTIONS})
+        self.functions = sorted({n.func.id for n in ast.walk(tree) if isinstance(n, ast.Call)})
+        lam = ast.Expression(body=ast.Lambda(
+            args=ast.arguments(posonlyargs=[], args=[ast.arg(arg=n) for n in self.variables],
+                               kwonlyargs=[], kw_defaults=[], defaults=[]),
+            body=_PowCalls().visit(copy.deepcopy(tree.body))))
+        ast.fix_missing_locations(lam)
+        self._fn = eval(compile(lam, '<formula>', 'eval'), {'__builtins__': {}, **FORMULA_FUNCTIONS})
+        # Plain + - * / over names and float/small int constants can run directly on arrays
+        self.array_safe = all(
+            isinstance(n, _FORMULA_ARRAY_NODES)
+            and not (isinstance(n, ast.Constant) and (isinstance(n.value, bool) or not isinstance(n.value, (int, float)) or abs(n.value) >= 2 ** 53))
+            for n in ast.walk(tree))
+
+    def _args(self, variables: Dict[str, Any]) -> List[Any]:
+        missing = [n for n in self.variables if n not in variables]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Error evaluating formula: name '{missing[0]}' is not defined")
+        return [variables[n] for n in self.variables]
+
+    def evaluate(self, variables: Dict[str, float]) -> float:
+        """Evaluate for one set of scalar variables."""
+        args = [float(v) for v in self._args(variables)]
         try:
-            value = eval(compile(tree, '<formula>', 'eval'), {'__builtins__': {}}, env)
+            value = self._fn(*args)
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Error evaluating formula: {e}")
         try:
@@ -1177,203 +1995,926 @@ def _revenue_calc_core(payload: RevenueCalcPayload) -> RevenueCalcResponse:
         except Exception:
             raise HTTPException(status_code=400, detail="Formula did not return a numeric value")
 
-    # Build volume map
-    vol_map: Dict[str, Dict[str,float]] = {}
-    offset_map: Dict[str, int | None] = {}  # Deprecated: backward compatibility
-    recurring_offset_map: Dict[str, int | None] = {}
-    one_time_offset_map: Dict[str, int | None] = {}
-    cashflow_offset_map: Dict[str, int] = {}
-    cashflow_rec_offset_map: Dict[str, int | None] = {}
-    cashflow_ot_offset_map: Dict[str, int | None] = {}
-    existing_cashflow_rec_map: Dict[str, Dict[str,float]] = {}
-    existing_cashflow_ot_map: Dict[str, Dict[str,float]] = {}
-    # Track combos that represent decommissioning so we can invert exit volumes (E)
-    decom_map: Dict[str, bool] = {}
-    for combo in payload.volumes:
-        fy_months = combo.volumes.get(fy, {})
-        key = _dim_key(combo.dimensions)
-        # Treat combinations whose `type` dimension equals 'Decom' (case-insensitive)
-        is_decom = False
+    def evaluate_array(self, variables: Dict[str, "np.ndarray"], fallback: "np.ndarray | None" = None) -> "np.ndarray":
+        """Evaluate element-wise over equally shaped 1-D arrays.
+
+        Without `fallback` the first failing element raises exactly as evaluate()
+        would; with it, failing elements take the fallback value instead.
+        """
+        n = len(next(iter(variables.values()))) if variables else 0
+        if n == 0:
+            return np.zeros(0)
         try:
-            is_decom = str(combo.dimensions.get('type','')).strip().lower() == 'decom'
-        except Exception:
-            is_decom = False
-        decom_map[key] = is_decom
-        # If decom, negate monthly volumes so downstream calculations treat them as reductions
-        vol_map[key] = {m: (-(float(fy_months.get(m,0) or 0)) if is_decom else float(fy_months.get(m,0) or 0)) for m in months}
-        # Store offsets - handle both int and string inputs
-        combo_fresh_offset = getattr(combo, 'fresh_offset_months', None)
-        combo_recurring_offset = getattr(combo, 'recurring_offset_months', None)
-        combo_one_time_offset = getattr(combo, 'one_time_offset_months', None)
-        combo_cf_rec_offset = getattr(combo, 'cashflow_recurring_offset_months', None)
-        combo_cf_ot_offset = getattr(combo, 'cashflow_one_time_offset_months', None)
-        # Existing cashflow (already timed, no offsets applied). Use base_exit_year key if provided.
-        if payload.base_exit_year:
-            cf_map = getattr(combo, 'existing_cashflow', {}) or {}
-            cf_entry = cf_map.get(payload.base_exit_year, {}) if isinstance(cf_map, dict) else {}
-            if cf_entry:
-                rec_cf = cf_entry.get('recurring', {}) or {}
-                ot_cf = cf_entry.get('one_time', {}) or {}
-                existing_cashflow_rec_map[key] = {m: float(rec_cf.get(m,0) or 0) for m in FISCAL_MONTHS}
-                existing_cashflow_ot_map[key] = {m: float(ot_cf.get(m,0) or 0) for m in FISCAL_MONTHS}
-        if combo_fresh_offset is not None:
-            try:
-                combo_fresh_offset = int(combo_fresh_offset)
-            except (ValueError, TypeError):
-                combo_fresh_offset = None
-        if combo_recurring_offset is not None:
-            try:
-                combo_recurring_offset = int(combo_recurring_offset)
-            except (ValueError, TypeError):
-                combo_recurring_offset = None
-        if combo_one_time_offset is not None:
+            args = self._args(variables)
+        except HTTPException:
+            if fallback is None:
+                raise
+            return np.array(fallback, dtype=float)
+        if self.array_safe:
             try:
-                combo_one_time_offset = int(combo_one_time_offset)
-            except (ValueError, TypeError):
-                combo_one_time_offset = None
-        if combo_cf_rec_offset is not None:
-            try:
-                combo_cf_rec_offset = int(combo_cf_rec_offset)
-            except (ValueError, TypeError):
-                combo_cf_rec_offset = None
-        if combo_cf_ot_offset is not None:
+                with np.errstate(all='raise'):
+                    out = np.asarray(self._fn(*args), dtype=float)
+                return np.broadcast_to(out, (n,)).copy()
+            except Exception:
+                pass  # division by zero, overflow, ...: redo per element for exact semantics
+        out = np.empty(n)
+        columns = [a.tolist() for a in args]
+        for i in range(n):
             try:
-                combo_cf_ot_offset = int(combo_cf_ot_offset)
-            except (ValueError, TypeError):
-                combo_cf_ot_offset = None
-        offset_map[key] = combo_fresh_offset  # Backward compatibility
-        recurring_offset_map[key] = combo_recurring_offset
-        one_time_offset_map[key] = combo_one_time_offset
-        if combo_recurring_offset is not None and combo_recurring_offset > 0:
-            print(f"[OFFSET] {key}: recurring_offset_months={combo_recurring_offset}")
-        if combo_one_time_offset is not None and combo_one_time_offset > 0:
-            print(f"[OFFSET] {key}: one_time_offset_months={combo_one_time_offset}")
-        cf_off = getattr(combo, 'cashflow_offset_months', 0) or 0
-        cashflow_offset_map[key] = max(int(cf_off), 0)
-        # Specific cashflow offsets for recurring / one-time (fallback to combo CF offset later)
-        cashflow_rec_offset_map[key] = combo_cf_rec_offset if combo_cf_rec_offset is not None else None
-        cashflow_ot_offset_map[key] = combo_cf_ot_offset if combo_cf_ot_offset is not None else None
-    rate_map: Dict[str, RateEntry] = {}
-    for r in payload.rates:
-        rate_map[_dim_key(r.dimensions)] = r
+                out[i] = self.evaluate({name: col[i] for name, col in zip(self.variables, columns)})
+            except HTTPException:
+                if fallback is None:
+                    raise
+                out[i] = fallback[i]
+        return out
 
-    monthly_totals = {m:0.0 for m in months}
-    monthly_recurring_totals = {m:0.0 for m in months}
-    monthly_one_time_totals = {m:0.0 for m in months}
-    # Passthrough P&L trackers (e.g., Small Cell rent/electricity)
-    monthly_passthrough_revenue = {m:0.0 for m in months}
-    monthly_passthrough_expense = {m:0.0 for m in months}
-    total_passthrough_revenue = 0.0
-    total_passthrough_expense = 0.0
-    rows: List[RevenueRow] = []
-    grand_total = 0.0
-    DEN = 180.0
-    DECIMALS = 2  # rounding precision for all monetary outputs
-    
-    for key, month_vols in vol_map.items():
-        r = rate_map.get(key, RateEntry(dimensions={}, recurring_rate=0, one_time_rate=0))
-        FR = r.recurring_rate if r else 0.0
-        FO = r.one_time_rate if r else 0.0
-        ER = r.existing_recurring_rate if r else 0.0
-        EO = r.existing_one_time_rate if r else 0.0
-        print(f"[RATES] key={key}: FR={FR}, FO={FO}, ER={ER}, EO={EO}")
-        include_fresh = getattr(payload, 'include_fresh_volumes', True)
-        combo_obj = None
-        for c in payload.volumes:
-            if _dim_key(c.dimensions) == key:
-                combo_obj = c
-                break
 
-        # Existing per-Lob example preserved (Small Cell multiplier handled by handler if needed)
-        E = 0.0
-        if payload.base_exit_year and combo_obj:
-            E = float(combo_obj.exit_volumes.get(payload.base_exit_year, 0) or 0)
-            # If this combination is a decommissioning entry, treat the base exit volume as negative
-            if decom_map.get(key):
-                E = -E
-        print(f"[BASE-EXIT] key={key}, base_exit_year={payload.base_exit_year}, E={E}, exit_volumes={combo_obj.exit_volumes if combo_obj else 'N/A'}")
-        existing_override_rec: Dict[str, float] | None = None
-        existing_override_ot: Dict[str, float] | None = None
-        if payload.base_exit_year and combo_obj and combo_obj.existing_revenue:
-            override = combo_obj.existing_revenue.get(payload.base_exit_year)
-            if override:
-                existing_override_rec = {m: float(override.get('recurring', {}).get(m, 0) or 0) for m in months}
-                existing_override_ot = {m: float(override.get('one_time', {}).get(m, 0) or 0) for m in months}
-        ordered_months = list(months)
-        raw_vols = [float(month_vols.get(m,0.0)) for m in ordered_months]
-        cum_raw: List[float] = []
-        running = 0.0
-        for v in raw_vols:
-            running += v
-            cum_raw.append(running)
-        print(f"[VOL-DEBUG] key={key}, raw_vols={raw_vols}, cum_raw={cum_raw}")
-        combo_offset = offset_map.get(key)
-        combo_recurring_off = recurring_offset_map.get(key)
-        combo_one_time_off = one_time_offset_map.get(key)
-        
-        # Coerce offsets to integers safely (handle strings like '02')
-        parsed_combo_offset = None
-        parsed_recurring_offset = None
-        parsed_one_time_offset = None
-        
-        try:
-            if combo_offset is not None:
-                parsed_combo_offset = int(combo_offset)
-                if parsed_combo_offset < 0:
-                    parsed_combo_offset = None
-        except (ValueError, TypeError):
-            parsed_combo_offset = None
-        
-        try:
-            if combo_recurring_off is not None:
-                parsed_recurring_offset = int(combo_recurring_off)
-                if parsed_recurring_offset < 0:
-                    parsed_recurring_offset = None
-        except (ValueError, TypeError):
-            parsed_recurring_offset = None
-            
+@functools.lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def _compile_formula(expr: str) -> CompiledFormula:
+    """Parse, validate and compile a formula; cached by expression text."""
+    try:
+        tree = ast.parse(expr, mode='eval')
+    except SyntaxError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid formula syntax: {e}")
+    for node in ast.walk(tree):
+        if isinstance(node, _FORMULA_NODES):
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or node.func.id not in FORMULA_FUNCTIONS:
+                    raise HTTPException(status_code=400, detail="Disallowed function in formula")
+            if isinstance(node, ast.Name) and node.id not in FORMULA_FUNCTIONS and node.id not in FORMULA_VARIABLES:
+                raise HTTPException(status_code=400, detail=f"Unknown variable or function '{node.id}' in formula")
+            continue
+        else:
+            raise HTTPException(status_code=400, detail="Disallowed expression in formula")
+    for base, exp in _formula_powers(tree):
+        if any(True for _ in _formula_powers(base)) or any(True for _ in _formula_powers(exp)):
+            raise HTTPException(status_code=400, detail="Nested powers are not allowed in formula")
+        value = _constant_number(exp)
+        if value is not None and abs(value) > FORMULA_MAX_EXPONENT:
+            raise HTTPException(status_code=400, detail=f"Exponent too large in formula (limit {FORMULA_MAX_EXPONENT})")
+    return CompiledFormula(expr, tree)
+
+
+def _evaluate_formula(expr: str, variables: Dict[str, float]) -> float:
+    return _compile_formula(expr).evaluate(variables)
+
+
+class FormulaValidatePayload(BaseModel):
+    formula: str
+    kind: Optional[str] = Field(default=None, description="'recurring' or 'one_time'. When given, variables the calculation does not supply for that kind are reported as errors.")
+    variables: Dict[str, float] = Field(default_factory=dict, description="Optional sample values; when every variable is supplied the formula is evaluated.")
+
+
+class FormulaValidateResponse(BaseModel):
+    valid: bool
+    error: Optional[str] = None
+    variables: List[str] = Field(default_factory=list)
+    functions: List[str] = Field(default_factory=list)
+    value: Optional[float] = None
+
+
+@app.post("/api/formula/validate", response_model=FormulaValidateResponse)
+@calc_endpoint
+def validate_formula(payload: FormulaValidatePayload):
+    """Check a custom revenue formula without running a calculation."""
+    try:
+        compiled = _compile_formula(payload.formula)
+    except HTTPException as e:
+        return FormulaValidateResponse(valid=False, error=str(e.detail))
+    resp = FormulaValidateResponse(valid=True, variables=compiled.variables, functions=compiled.functions)
+    if payload.kind:
+        supplied = FORMULA_KIND_VARIABLES.get(payload.kind)
+        if supplied is None:
+            raise HTTPException(status_code=400, detail=f"Unknown formula kind '{payload.kind}'")
+        unsupported = [v for v in compiled.variables if v not in supplied]
+        if unsupported:
+            resp.valid = False
+            resp.error = f"Variables not available for {payload.kind} formulas: {', '.join(unsupported)}"
+            return resp
+    if payload.variables and all(v in payload.variables for v in compiled.variables):
         try:
-            if combo_one_time_off is not None:
-                parsed_one_time_offset = int(combo_one_time_off)
-                if parsed_one_time_offset < 0:
-                    parsed_one_time_offset = None
-        except (ValueError, TypeError):
-            parsed_one_time_offset = None
-        
-        # Determine offsets with fallback logic:
-        # 1. Use combo-specific recurring/one-time offset if provided
-        # 2. Fall back to combo fresh_offset_months (deprecated)
-        # 3. Fall back to payload-level recurring/one-time offset if provided
-        # 4. Fall back to payload fresh_offset_months (deprecated)
+            resp.value = compiled.evaluate(payload.variables)
+        except HTTPException as e:
+            resp.valid = False
+            resp.error = str(e.detail)
+    return resp
+
+
+class _CombinationRegistry:
+    """Per-request index of `payload.volumes`, built once at ingress.
+
+    Unique combinations get integer ids in first-appearance order; every stage
+    works with these ids instead of recomputing `_dim_key` and scanning the
+    payload. Duplicate keys keep the historical precedence: volumes, offsets and
+    cashflow settings come from the last occurrence, exit volume, uploaded
+    existing revenue and dimension attributes from the first. Opex and CAPEX
+    still visit every included occurrence (`included_positions`), so per-entry
+    data is kept alongside the per-id data.
+    """
+
+    def __init__(self, payload: RevenueCalcPayload):
+        fy = payload.fiscal_year
+        months = payload.months or FISCAL_MONTHS
+        base_year = payload.base_exit_year
         payload_recurring = max(int(getattr(payload, 'recurring_offset_months', 0) or 0), 0)
         payload_one_time = max(int(getattr(payload, 'one_time_offset_months', 0) or 0), 0)
         payload_fresh = max(int(getattr(payload, 'fresh_offset_months', 0) or 0), 0)
-        
-        # Recurring offset: prefer specific recurring, then combo fresh, then payload recurring, then payload fresh
-        if parsed_recurring_offset is not None:
-            recurring_offset = parsed_recurring_offset
-        elif parsed_combo_offset is not None:
-            recurring_offset = parsed_combo_offset
-        elif payload_recurring > 0:
-            recurring_offset = payload_recurring
-        else:
-            recurring_offset = payload_fresh
-            
-        # One-time offset: prefer specific one-time, then combo fresh, then payload one-time, then payload fresh
-        if parsed_one_time_offset is not None:
-            one_time_offset = parsed_one_time_offset
-        elif parsed_combo_offset is not None:
-            one_time_offset = parsed_combo_offset
-        elif payload_one_time > 0:
-            one_time_offset = payload_one_time
-        else:
-            one_time_offset = payload_fresh
-        
+
+        self.keys: List[str] = []
+        self.key_to_id: Dict[str, int] = {}
+        self.first_pos: List[int] = []
+        self.last_pos: List[int] = []
+        self.decom: List[bool] = []
+        # Monthly volumes for the planning year (decom negated), from the last occurrence
+        self.volumes: List[Dict[str, float]] = []
+        # Resolved P&L offsets (combo specific -> combo fresh -> payload specific -> payload fresh)
+        self.fresh_offset: List[int] = []
+        self.recurring_offset: List[int] = []
+        self.one_time_offset: List[int] = []
+        # Cashflow offsets: base, and resolved recurring / one-time shifts
+        self.cashflow_offset: List[int] = []
+        self.cashflow_rec_offset: List[int] = []
+        self.cashflow_ot_offset: List[int] = []
+        self.existing_cashflow_rec: Dict[int, Dict[str, float]] = {}
+        self.existing_cashflow_ot: Dict[int, Dict[str, float]] = {}
+        # Per payload entry (position in payload.volumes)
+        self.entry_ids: List[int] = []
+        self.entry_exit: List[float] = []
+        self.entry_site_type: List[str] = []
+        self.entry_capex_cashflow_offset: List[int] = []
+        self.included_positions: List[int] = []
+
+        for pos, combo in enumerate(payload.volumes):
+            key = _dim_key(combo.dimensions)
+            cid = self.key_to_id.get(key)
+            if cid is None:
+                cid = len(self.keys)
+                self.key_to_id[key] = cid
+                self.keys.append(key)
+                self.first_pos.append(pos)
+                self.last_pos.append(pos)
+                for lst in (self.decom, self.volumes, self.fresh_offset, self.recurring_offset, self.one_time_offset,
+                            self.cashflow_offset, self.cashflow_rec_offset, self.cashflow_ot_offset):
+                    lst.append(None)
+            self.last_pos[cid] = pos
+            # Treat combinations whose `type` dimension equals 'Decom' (case-insensitive)
+            try:
+                is_decom = str(combo.dimensions.get('type','')).strip().lower() == 'decom'
+            except Exception:
+                is_decom = False
+            self.decom[cid] = is_decom
+            fy_months = combo.volumes.get(fy, {})
+            # If decom, negate monthly volumes so downstream calculations treat them as reductions
+            self.volumes[cid] = {m: (-(float(fy_months.get(m,0) or 0)) if is_decom else float(fy_months.get(m,0) or 0)) for m in months}
+            # Existing cashflow (already timed, no offsets applied). Use base_exit_year key if provided.
+            if base_year:
+                cf_map = getattr(combo, 'existing_cashflow', {}) or {}
+                cf_entry = cf_map.get(base_year, {}) if isinstance(cf_map, dict) else {}
+                if cf_entry:
+                    rec_cf = cf_entry.get('recurring', {}) or {}
+                    ot_cf = cf_entry.get('one_time', {}) or {}
+                    self.existing_cashflow_rec[cid] = {m: float(rec_cf.get(m,0) or 0) for m in FISCAL_MONTHS}
+                    self.existing_cashflow_ot[cid] = {m: float(ot_cf.get(m,0) or 0) for m in FISCAL_MONTHS}
+            combo_fresh = self._parse_offset(getattr(combo, 'fresh_offset_months', None))
+            combo_recurring = self._parse_offset(getattr(combo, 'recurring_offset_months', None))
+            combo_one_time = self._parse_offset(getattr(combo, 'one_time_offset_months', None))
+            combo_cf_rec = self._parse_offset(getattr(combo, 'cashflow_recurring_offset_months', None), allow_negative=True)
+            combo_cf_ot = self._parse_offset(getattr(combo, 'cashflow_one_time_offset_months', None), allow_negative=True)
+            if _trace_enabled(log_registry, cid):
+                if combo_recurring is not None and combo_recurring > 0:
+                    log_registry.debug("[OFFSET] %s: recurring_offset_months=%s", key, combo_recurring)
+                if combo_one_time is not None and combo_one_time > 0:
+                    log_registry.debug("[OFFSET] %s: one_time_offset_months=%s", key, combo_one_time)
+            if combo_recurring is not None:
+                self.recurring_offset[cid] = combo_recurring
+            elif combo_fresh is not None:
+                self.recurring_offset[cid] = combo_fresh
+            else:
+                self.recurring_offset[cid] = payload_recurring if payload_recurring > 0 else payload_fresh
+            if combo_one_time is not None:
+                self.one_time_offset[cid] = combo_one_time
+            elif combo_fresh is not None:
+                self.one_time_offset[cid] = combo_fresh
+            else:
+                self.one_time_offset[cid] = payload_one_time if payload_one_time > 0 else payload_fresh
+            self.fresh_offset[cid] = combo_fresh if combo_fresh is not None else payload_fresh
+            cf_off = max(int(getattr(combo, 'cashflow_offset_months', 0) or 0), 0)
+            self.cashflow_offset[cid] = cf_off
+            # Specific cashflow offsets for recurring / one-time fall back to the combo CF offset
+            self.cashflow_rec_offset[cid] = combo_cf_rec if combo_cf_rec is not None else cf_off
+            self.cashflow_ot_offset[cid] = combo_cf_ot if combo_cf_ot is not None else cf_off
+
+            E = 0.0
+            if base_year:
+                E = float(combo.exit_volumes.get(base_year, 0) or 0)
+                # Decom combos reduce base exit volume
+                if is_decom:
+                    E = -E
+            self.entry_ids.append(cid)
+            self.entry_exit.append(E)
+            # Use dimensions-based site type; fallback to explicit site_type attr if present
+            site_type_val = _get_site_type(getattr(combo, 'dimensions', None)) or str(getattr(combo, 'site_type', '') or '')
+            self.entry_site_type.append(site_type_val.strip().upper())
+            self.entry_capex_cashflow_offset.append(int(getattr(combo, 'capex_cashflow_offset_months', 0) or 0))
+            if combo.included is not False:
+                self.included_positions.append(pos)
+
+    def replace(self, sub: "_CombinationRegistry", ids: List[int], positions: List[int]):
+        """Take over the data of combinations `ids` from the registry of a sub-plan.
+
+        `sub` indexes exactly the entries at `positions` (every occurrence of
+        those combinations, in payload order); sub-plan id `k` is `ids[k]` here.
+        """
+        for name in ('decom', 'volumes', 'fresh_offset', 'recurring_offset', 'one_time_offset',
+                     'cashflow_offset', 'cashflow_rec_offset', 'cashflow_ot_offset'):
+            mine, theirs = getattr(self, name), getattr(sub, name)
+            for k, cid in enumerate(ids):
+                mine[cid] = theirs[k]
+        for mine, theirs in ((self.existing_cashflow_rec, sub.existing_cashflow_rec),
+                             (self.existing_cashflow_ot, sub.existing_cashflow_ot)):
+            for k, cid in enumerate(ids):
+                if k in theirs:
+                    mine[cid] = theirs[k]
+                else:
+                    mine.pop(cid, None)
+        for k, pos in enumerate(positions):
+            self.entry_exit[pos] = sub.entry_exit[k]
+            self.entry_site_type[pos] = sub.entry_site_type[k]
+            self.entry_capex_cashflow_offset[pos] = sub.entry_capex_cashflow_offset[k]
+        included = (set(self.included_positions) - set(positions)) | {positions[k] for k in sub.included_positions}
+        self.included_positions = sorted(included)
+
+    @staticmethod
+    def _parse_offset(value, allow_negative: bool = False) -> int | None:
+        """Coerce an offset to int (handles strings like '02'); invalid or negative -> None."""
+        if value is None:
+            return None
+        try:
+            parsed = int(value)
+        except (ValueError, TypeError):
+            return None
+        if parsed < 0 and not allow_negative:
+            return None
+        return parsed
+
+    @property
+    def size(self) -> int:
+        return len(self.keys)
+
+    def id_for(self, dimensions: Dict[str, str]) -> int | None:
+        """Combination id for a dimensions mapping (rate entries etc.), None if not planned."""
+        return self.key_to_id.get(_dim_key(dimensions))
+
+    def base_exit(self, cid: int) -> float:
+        """Signed base exit volume of the combination (first occurrence)."""
+        return self.entry_exit[self.first_pos[cid]]
+
+    def rate_entries(self, rates: List[RateEntry]) -> List[RateEntry | None]:
+        """Revenue RateEntry per combination id (last entry for a key wins)."""
+        out: List[RateEntry | None] = [None] * self.size
+        for r in rates:
+            cid = self.id_for(r.dimensions)
+            if cid is not None:
+                out[cid] = r
+        return out
+
+    def item_rates(self, entries: List[Dict[str, Any]]) -> Dict[str, Dict[int, Dict[str, float]]]:
+        """Opex/CAPEX rate lookup: item -> combination id -> {existing_rate, fresh_rate}."""
+        rate_map: Dict[str, Dict[int, Dict[str, float]]] = {}
+        for entry in entries or []:
+            item_name = entry.get('item')
+            if not item_name:
+                continue
+            cid = self.id_for(entry.get('dimensions') or {})
+            if cid is None:
+                continue
+            rate_map.setdefault(item_name, {})[cid] = {
+                'existing_rate': float(entry.get('existing_rate') or 0),
+                'fresh_rate': float(entry.get('fresh_rate') or 0)
+            }
+        return rate_map
+
+    def item_rate_matrices(self, rate_map: Dict[str, Dict[int, Dict[str, float]]],
+                           names: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Dense (items x combinations) existing / fresh rates for `names`; unrated pairs are 0.0."""
+        existing = np.zeros((len(names), self.size))
+        fresh = np.zeros((len(names), self.size))
+        for i, name in enumerate(names):
+            for cid, rates in rate_map.get(name, {}).items():
+                existing[i, cid] = rates['existing_rate']
+                fresh[i, cid] = rates['fresh_rate']
+        return existing, fresh
+
+    def included_combinations(self) -> Tuple[np.ndarray, np.ndarray, List[int]]:
+        """Included entry positions, the slot of each, and the combination id per slot.
+
+        Slots number the included combinations by first occurrence, the order in
+        which the per-combination opex / CAPEX stores are filled.
+        """
+        slot_of: Dict[int, int] = {}
+        entry_slot = [slot_of.setdefault(self.entry_ids[pos], len(slot_of)) for pos in self.included_positions]
+        return (np.asarray(self.included_positions, dtype=np.intp),
+                np.asarray(entry_slot, dtype=np.intp), list(slot_of))
+
+
+class _VolumeCube:
+    """Month volume series for one request, built once and read by every stage.
+
+    `signed_*` arrays have one row per combination id and carry the
+    decommissioning sign used by revenue; `entry_*` arrays have one row per
+    `payload.volumes` position with the uploaded (unsigned) volumes used by opex
+    and CAPEX. Cumulative series are running totals in month order, identical
+    to the `running += v` loops they replace. Offset-shifted cumulatives are
+    cached per distinct offset, so each is computed at most once per request.
+    """
+
+    def __init__(self, payload: RevenueCalcPayload, reg: _CombinationRegistry):
+        fy = payload.fiscal_year
+        self.months = list(payload.months or FISCAL_MONTHS)
+        n_months = len(self.months)
+        self.signed_raw = np.array(
+            [[float(reg.volumes[cid].get(m, 0.0)) for m in self.months] for cid in range(reg.size)],
+            dtype=float).reshape(reg.size, n_months)
+        self.entry_raw = np.array(
+            [[float(combo.volumes.get(fy, {}).get(m, 0) or 0) for m in self.months] for combo in payload.volumes],
+            dtype=float).reshape(len(payload.volumes), n_months)
+        self.signed_cum = self._running_total(self.signed_raw)
+        self.entry_cum = self._running_total(self.entry_raw)
+        self._shifted: Dict[Tuple[bool, int], np.ndarray] = {}
+        self._lists: Dict[str, List[List[float]]] = {}
+
+    @staticmethod
+    def _running_total(values: np.ndarray) -> np.ndarray:
+        # np.cumsum adds left to right like the loop; + 0.0 matches its 0.0 start (no -0.0)
+        return np.cumsum(values, axis=1) + 0.0
+
+    def shifted(self, offset: int, signed: bool = False) -> np.ndarray:
+        """Cumulative volumes delayed by `offset` months: out[:, j] = cum[:, j - offset].
+
+        Months with no source (j - offset outside the year) are 0.0; a negative
+        offset looks ahead, as CAPEX inventory lead times do.
+        """
+        offset = int(offset)
+        cache_key = (signed, offset)
+        out = self._shifted.get(cache_key)
+        if out is None:
+            cum = self.signed_cum if signed else self.entry_cum
+            n_months = cum.shape[1]
+            out = np.zeros_like(cum)
+            if 0 <= offset < n_months:
+                out[:, offset:] = cum[:, :n_months - offset]
+            elif -n_months < offset < 0:
+                out[:, :n_months + offset] = cum[:, -offset:]
+            self._shifted[cache_key] = out
+        return out
+
+    def shifted_rows(self, offsets: np.ndarray, signed: bool = True) -> np.ndarray:
+        """Per-row offsets: row i is `shifted(offsets[i])[i]`, assembled from the cached shifts."""
+        rows = self.signed_cum.shape[0] if signed else self.entry_cum.shape[0]
+        out = np.zeros((rows, len(self.months)))
+        for off in np.unique(offsets):
+            mask = offsets == off
+            out[mask] = self.shifted(int(off), signed)[mask]
+        return out
+
+    def replace(self, sub: "_VolumeCube", ids: List[int], positions: List[int]):
+        """Overwrite combinations `ids` and entries `positions` with the series of a sub-plan cube."""
+        self.signed_raw[ids] = sub.signed_raw
+        self.signed_cum[ids] = sub.signed_cum
+        self.entry_raw[positions] = sub.entry_raw
+        self.entry_cum[positions] = sub.entry_cum
+        self._shifted.clear()
+        self._lists.clear()
+
+    def lists(self, name: str) -> List[List[float]]:
+        """Python-list view of an array attribute (e.g. 'entry_cum') for the scalar loops."""
+        out = self._lists.get(name)
+        if out is None:
+            out = self._lists[name] = getattr(self, name).tolist()
+        return out
+
+
+class _CashSpill:
+    """Cash shifted past the end of a fiscal year, carried into the next years.
+
+    Amounts are whole paise, keyed by channel ('recurring', 'one_time',
+    'passthrough_inflow', 'passthrough_outflow', or 'opex' / 'capex' plus the
+    item name) and by how many months past the year end they land.
+    """
+
+    def __init__(self, incoming: Optional[Dict[Tuple[str, Optional[str]], Dict[int, float]]] = None):
+        self.incoming = incoming or {}
+        self.outgoing: Dict[Tuple[str, Optional[str]], Dict[int, float]] = {}
+
+    def add(self, channel: str, item: Optional[str], months_past_end: int, amount: float):
+        bucket = self.outgoing.setdefault((channel, item), {})
+        bucket[months_past_end] = bucket.get(months_past_end, 0.0) + amount
+
+    def add_many(self, channel: str, item: Optional[str], months_past_end: np.ndarray, amounts: np.ndarray):
+        """`add` for many amounts at once."""
+        bucket = self.outgoing.setdefault((channel, item), {})
+        for k in np.unique(months_past_end).tolist():
+            bucket[k] = bucket.get(k, 0.0) + float(_paise_sum(amounts[months_past_end == k]))
+
+    def incoming_items(self, channel: str) -> List[Optional[str]]:
+        return [item for (ch, item) in self.incoming if ch == channel]
+
+    def take(self, channel: str, item: Optional[str], target: np.ndarray):
+        """Add cash spilled into this year to the month series `target`; amounts landing past this year spill on."""
+        for k, amount in sorted(self.incoming.pop((channel, item), {}).items()):
+            if k < len(target):
+                target[k] += amount
+            else:
+                self.add(channel, item, k - len(target), amount)
+
+    def next_year(self) -> "_CashSpill":
+        return _CashSpill(self.outgoing)
+
+
+def _shift_months(values: np.ndarray, offsets, start: Optional[np.ndarray] = None,
+                  spill: Optional[_CashSpill] = None, channel: str = '', item: Optional[str] = None) -> np.ndarray:
+    """Cash timing kernel: month totals of (rows x months) paise `values`, row i paid `offsets[i]` months later.
+
+    `offsets` is one int or one per row; the result includes `start` (0.0 by
+    default). Amounts landing past the last month go to `spill` under
+    `channel` / `item` (dropped without one); a target before the first month
+    counts from the year end, as the `months[target]` lookup did.
+    """
+    n_rows, n_months = values.shape
+    total = np.zeros(n_months) if start is None else np.asarray(start, dtype=float)
+    if not values.size:
+        return total + 0.0
+    offsets = np.broadcast_to(np.asarray(offsets, dtype=np.int64), (n_rows,))
+    targets = np.arange(n_months)[None, :] + offsets[:, None]
+    if targets.min() < -n_months:
+        raise IndexError('list index out of range')
+    in_year = targets < n_months
+    landed = np.zeros((n_rows, n_months))
+    landed[np.nonzero(in_year)[0], targets[in_year] % n_months] = values[in_year]
+    if spill is not None and not in_year.all():
+        spill.add_many(channel, item, targets[~in_year] - n_months, values[~in_year])
+    return total + _paise_sum(landed, 0)
+
+
+def _revenue_calc_finish(
+    payload: RevenueCalcPayload,
+    reg: _CombinationRegistry,
+    cube: _VolumeCube,
+    rows: List[RevenueRow],
+    monthly_totals: Dict[str, float],
+    monthly_recurring_totals: Dict[str, float],
+    monthly_one_time_totals: Dict[str, float],
+    grand_total: float,
+    spill: Optional["_CashSpill"] = None,
+    include_rows: bool = True,
+) -> RevenueCalcResponse:
+    """Opex, cashflow and CAPEX stages plus response assembly.
+
+    Shared by every revenue engine: it only needs the finished revenue rows
+    (`rows[cid]` belongs to combination id `cid` of `reg`) and their (already
+    rounded) monthly totals, so the engines differ solely in how the rows are
+    produced. Volumes are read from the request's shared `cube`.
+
+    Cash shifted past the last month is dropped unless a `spill` is given
+    (multi-year horizon): then it is collected there, and cash spilled into
+    this year by the previous one is added first. With `include_rows=False`
+    the response has no rows and `rows` only needs the cashflow series
+    (see `_CashflowRow`).
+    """
+    fy = payload.fiscal_year
+    months = payload.months or FISCAL_MONTHS
+    lob_upper = (getattr(payload, 'lob', 'FTTH') or 'FTTH').upper()
+    passthrough_site_types = {'HPSC', 'LITE SITE', 'HLS'}
+    passthrough_items = {'ELECTRICITY', 'RENT'}
+    enable_small_cell_passthrough = lob_upper == 'SMALL CELL'
+    monthly_passthrough_revenue = {m:0.0 for m in months}
+    monthly_passthrough_expense = {m:0.0 for m in months}
+    total_passthrough_revenue = 0.0
+    total_passthrough_expense = 0.0
+
+    # -------- OPEX CALCULATION --------
+    # Evaluated on (items x included entries x months) arrays: rates come from
+    # dense (items x combinations) matrices, fresh volumes are the cube's
+    # cumulative series shifted by each item's offset, and the passthrough split
+    # and overrides are masks. Sums run in entry order so totals match a
+    # per-entry `+=` loop exactly.
+    opex_items_results: List[Dict[str, Any]] = []
+    opex_paise = np.zeros(len(months))
+    total_opex_paise = 0.0
+    opex_rate_map = reg.item_rates(getattr(payload, 'opex_rates', []))
+    include_fresh = getattr(payload, 'include_fresh_volumes', True)
+    # Build override map: item -> months dict
+    override_map: Dict[str, Dict[str,float]] = {}
+    for ov in getattr(payload, 'existing_opex_overrides', []) or []:
+        item_name = ov.get('item') if isinstance(ov, dict) else None
+        months_obj = ov.get('months') if isinstance(ov, dict) else None
+        if not item_name or not months_obj:
+            continue
+        override_map[item_name] = {m: float(months_obj.get(m,0) or 0) for m in months}
+    opex_items = [item for item in getattr(payload, 'opex_items', []) or [] if item.get('name')]
+    names = [item.get('name') for item in opex_items]
+    fresh_offsets = [int(item.get('fresh_offset_months') or 0) for item in opex_items]
+    is_passthrough = [enable_small_cell_passthrough and str(name).strip().upper() in passthrough_items for name in names]
+    # Passthrough items ignore overrides (always recomputed per combo)
+    has_override = [not pt and name in override_map for name, pt in zip(names, is_passthrough)]
+    inc_pos, entry_slot, slot_ids = reg.included_combinations()
+    n_slots = len(slot_ids)
+    inc_ids = np.asarray(reg.entry_ids, dtype=np.intp)[inc_pos]
+    passthrough_site = np.array([reg.entry_site_type[pos] in passthrough_site_types for pos in inc_pos.tolist()], dtype=bool)
+    existing_rates, fresh_rates = reg.item_rate_matrices(opex_rate_map, names)
+    existing_part = np.asarray(reg.entry_exit, dtype=float)[inc_pos] * existing_rates[:, inc_ids]
+    existing_part[np.asarray(has_override, dtype=bool)] = 0.0
+    fresh_part = np.zeros((len(names), len(inc_pos), len(months)))
+    if include_fresh:
+        for i, item_offset in enumerate(fresh_offsets):
+            fresh_part[i] = cube.shifted(item_offset)[inc_pos]
+        fresh_part *= fresh_rates[:, inc_ids][:, :, None]
+    opex_values = existing_part[:, :, None] + fresh_part
+    # Per-item P&L per included combination (rows in slot order), pre-cashflow shift
+    combo_item_pl: Dict[str, np.ndarray] = {}
+    # Passthrough P&L (+ cash) per included combination for qualified site types/items
+    passthrough_combo_pl: Dict[str, np.ndarray] = {}
+    passthrough_running = np.zeros(len(months))
+    # Per-opex-item cashflow offsets (additional to combination-level)
+    item_cashflow_offset_map: Dict[str, int] = {}
+    passthrough_inflow_offset_map: Dict[str, int] = {}
+    passthrough_outflow_offset_map: Dict[str, int] = {}
+    for i, item in enumerate(opex_items):
+        name = names[i]
+        item_offset = fresh_offsets[i]
+        # Optional per-item cashflow offset (independent timing for cash actualization of this opex item)
+        item_cashflow_offset = int(item.get('cashflow_offset_months') or 0)
+        if item_cashflow_offset < 0:
+            item_cashflow_offset = 0
+        item_cashflow_offset_map[name] = item_cashflow_offset
+        # Passthrough-specific offsets: inflow and outflow can differ
+        pt_inflow_offset = int(item.get('passthrough_inflow_offset_months') or item_cashflow_offset)
+        pt_outflow_offset = int(item.get('passthrough_outflow_offset_months') or item_cashflow_offset)
+        if pt_inflow_offset < 0:
+            pt_inflow_offset = 0
+        if pt_outflow_offset < 0:
+            pt_outflow_offset = 0
+        passthrough_inflow_offset_map[name] = pt_inflow_offset
+        passthrough_outflow_offset_map[name] = pt_outflow_offset
+        values, slots = opex_values[i], entry_slot
+        if is_passthrough[i]:
+            # Qualified site types book the item as passthrough revenue and expense instead
+            pt_values = values[passthrough_site]
+            if n_slots:
+                if name not in passthrough_combo_pl:
+                    passthrough_combo_pl[name] = np.zeros((n_slots, len(months)))
+                np.add.at(passthrough_combo_pl[name], entry_slot[passthrough_site], pt_values)
+            passthrough_running = _sequential_sum(np.vstack([passthrough_running, pt_values]), 0)
+            values, slots = values[~passthrough_site], entry_slot[~passthrough_site]
+        if n_slots:
+            if name not in combo_item_pl:
+                combo_item_pl[name] = np.zeros((n_slots, len(months)))
+            # np.add.at applies repeated slots (duplicate combinations) one after another
+            np.add.at(combo_item_pl[name], slots, values)
+        # Start with override months if present, else zeros
+        start = [override_map[name][m] for m in months] if has_override[i] else [0.0] * len(months)
+        item_paise = _to_paise(_sequential_sum(np.vstack([start, values]), 0))
+        item_monthly = dict(zip(months, _rupees(item_paise).tolist()))
+        item_total = float(_rupees(_paise_sum(item_paise)))
+        opex_paise = opex_paise + item_paise
+        total_opex_paise += _paise_sum(item_paise)
+        if log_opex.isEnabledFor(logging.DEBUG):
+            log_opex.debug("[OPEX] item=%s, fresh_offset=%d, override=%s, passthrough=%s, total=%s", name, item_offset, has_override[i], is_passthrough[i], item_total)
+        opex_items_results.append({
+            'name': name,
+            'fresh_offset_months': item_offset,
+            'cashflow_offset_months': item_cashflow_offset_map.get(name, 0),
+            'override_applied': has_override[i],
+            'monthly': item_monthly,
+            'total': item_total
+        })
+    # Add passthrough P&L (Small Cell rent/electricity for specific site types)
+    if enable_small_cell_passthrough and any(v != 0 for v in passthrough_running.tolist()):
+        passthrough_paise = _to_paise(passthrough_running)
+        monthly_passthrough_revenue = dict(zip(months, _rupees(passthrough_paise).tolist()))
+        monthly_passthrough_expense = dict(zip(months, _rupees(passthrough_paise).tolist()))
+        total_passthrough_revenue = float(_rupees(_paise_sum(passthrough_paise)))
+        total_passthrough_expense = total_passthrough_revenue
+        revenue_paise = _to_paise([monthly_totals[m] for m in months]) + passthrough_paise
+        monthly_totals = dict(zip(months, _rupees(revenue_paise).tolist()))
+        grand_total = float(_rupees(_paise(grand_total) + _paise_sum(passthrough_paise)))
+        opex_paise = opex_paise + passthrough_paise
+        total_opex_paise += _paise_sum(passthrough_paise)
+        opex_items_results.append({
+            'name': 'Passthrough Expense',
+            'fresh_offset_months': 0,
+            'cashflow_offset_months': 0,
+            'override_applied': False,
+            'monthly': monthly_passthrough_expense,
+            'total': total_passthrough_expense,
+            'site_types': sorted(list(passthrough_site_types)),
+            'items': ['Electricity', 'Rent']
+        })
+    monthly_opex_totals = dict(zip(months, _rupees(opex_paise).tolist()))
+    total_opex = float(_rupees(total_opex_paise))
+
+    # -------- CASHFLOW (shifted) --------
+    # Month series below are paise arrays until the response is assembled.
+    cash_recurring = np.zeros(len(months))
+    cash_one_time = np.zeros(len(months))
+    cash_passthrough = np.zeros(len(months))
+    passthrough_cash_outflow = np.zeros(len(months))
+    # Per-item shifted outflows
+    cash_item_outflows: Dict[str, np.ndarray] = {name: np.zeros(len(months)) for name in combo_item_pl.keys()}
+    if spill is not None:
+        spill.take('recurring', None, cash_recurring)
+        spill.take('one_time', None, cash_one_time)
+        spill.take('passthrough_inflow', None, cash_passthrough)
+        spill.take('passthrough_outflow', None, passthrough_cash_outflow)
+        for item_name in spill.incoming_items('opex'):
+            spill.take('opex', item_name, cash_item_outflows.setdefault(item_name, np.zeros(len(months))))
+    if log_cashflow.isEnabledFor(logging.DEBUG):
+        log_cashflow.debug("[CF-DEBUG] rows list: %d rows, checking monthly_cashflow_recurring...", len(rows))
+        for i, row in enumerate(rows):
+            if i % CALC_LOG_SAMPLE:
+                continue
+            total_cf_rec = sum(row.monthly_cashflow_recurring.values()) if row.monthly_cashflow_recurring else 0
+            log_cashflow.debug("[CF-DEBUG] row %d: %s, total monthly_cashflow_recurring sum: %s, dict: %s", i, row.dimensions, total_cf_rec, row.monthly_cashflow_recurring)
+    # Combination cash: the uploaded existing cashflow (already timed; no shift)
+    # plus each combination's cashflow delayed by its offset.
+    month_index = {m: i for i, m in enumerate(months)}
+    n_rows = len(rows)
+    for channel, cash, existing_cf, cf_offsets, field in (
+            ('recurring', cash_recurring, reg.existing_cashflow_rec, reg.cashflow_rec_offset, 'monthly_cashflow_recurring'),
+            ('one_time', cash_one_time, reg.existing_cashflow_ot, reg.cashflow_ot_offset, 'monthly_cashflow_one_time')):
+        existing = np.zeros((len(existing_cf), len(months)))
+        for k, ex_cf in enumerate(existing_cf.values()):
+            existing[k, [month_index[m] for m in ex_cf]] = list(ex_cf.values())
+        row_cf = np.array([[getattr(row, field).get(m, 0) for m in months] for row in rows],
+                          dtype=float).reshape(n_rows, len(months))
+        cash += _paise_sum(_to_paise(existing), 0)
+        cash[:] = _shift_months(_to_paise(row_cf, rounded=True), cf_offsets[:n_rows], cash, spill, channel)
+
+    slot_cf_off = np.asarray(reg.cashflow_offset, dtype=np.int64)[slot_ids]
+    # Passthrough inflow/outflow shifting (Small Cell rent/electricity):
+    # combination offset + the item's passthrough inflow / outflow offset
+    if enable_small_cell_passthrough:
+        for item_name, item_pl in passthrough_combo_pl.items():
+            pt_values = _to_paise(item_pl)
+            cash_passthrough[:] = _shift_months(pt_values, slot_cf_off + passthrough_inflow_offset_map.get(item_name, 0),
+                                                cash_passthrough, spill, 'passthrough_inflow')
+            passthrough_cash_outflow[:] = _shift_months(pt_values, slot_cf_off + passthrough_outflow_offset_map.get(item_name, 0),
+                                                        passthrough_cash_outflow, spill, 'passthrough_outflow')
+
+    # Opex shifting per combination & item: combination-level cashflow offset + per-item offset
+    for item_name, item_pl in combo_item_pl.items():
+        outflow = cash_item_outflows[item_name]
+        outflow[:] = _shift_months(_to_paise(item_pl), slot_cf_off + item_cashflow_offset_map.get(item_name, 0),
+                                   outflow, spill, 'opex', item_name)
+    # Aggregate totals
+    cash_gross = cash_recurring + cash_one_time + cash_passthrough
+    cash_outflow_totals = passthrough_cash_outflow + 0.0
+    for mv in cash_item_outflows.values():
+        cash_outflow_totals = cash_outflow_totals + mv
+    cash_net_operating = cash_gross - cash_outflow_totals
+    # Build per-item list (in millions for display)
+    cash_outflow_items_list = []
+    for name, mv in cash_item_outflows.items():
+        cash_outflow_items_list.append({
+            'name': name,
+            'cashflow_offset_months': item_cashflow_offset_map.get(name, 0),
+            'monthly': dict(zip(months, _millions(mv).tolist())),
+            'total': _millions(_paise_sum(mv))
+        })
+    if enable_small_cell_passthrough and any(v != 0 for v in passthrough_cash_outflow.tolist()):
+        cash_outflow_items_list.append({
+            'name': 'Passthrough Expense',
+            'cashflow_offset_months': 0,
+            'monthly': dict(zip(months, _millions(passthrough_cash_outflow).tolist())),
+            'total': _millions(_paise_sum(passthrough_cash_outflow))
+        })
+    # Convert cashflow to millions for display
+    cash_recurring, cash_one_time, cash_passthrough, cash_gross, cash_outflow_totals, cash_net_operating = (
+        dict(zip(months, _millions(series).tolist()))
+        for series in (cash_recurring, cash_one_time, cash_passthrough, cash_gross, cash_outflow_totals, cash_net_operating))
+    total_cash_rec = _exact_total(list(cash_recurring.values()))
+    total_cash_one = _exact_total(list(cash_one_time.values()))
+    total_cash_gross = _exact_total(list(cash_gross.values()))
+    total_cash_outflow = _exact_total(list(cash_outflow_totals.values()))
+    total_cash_net = _exact_total(list(cash_net_operating.values()))
+
+    # -------- CAPEX (refined: per-combination recognition & cash shifting) --------
+    # Recognition, inventory look-ahead, refunds, service cash delays and the
+    # group roll-up run on (included entries x months) arrays with dense rate
+    # matrices. Cash is timed once recognition is complete, because duplicate
+    # item names share one per-combination store.
+    capex_rate_map = reg.item_rates(getattr(payload, 'capex_rates', []))
+    capex_override_map: Dict[str, Dict[str,float]] = {}
+    for ov in getattr(payload, 'existing_capex_overrides', []) or []:
+        item_name = ov.get('item') if isinstance(ov, dict) else None
+        months_obj = ov.get('months') if isinstance(ov, dict) else None
+        if not item_name or not months_obj:
+            continue
+        capex_override_map[item_name] = {m: float(months_obj.get(m,0) or 0) for m in months}
+    capex_items = [item for item in getattr(payload, 'capex_items', []) or [] if item.get('name')]
+    capex_names = [item.get('name') for item in capex_items]
+    capex_existing_rates, capex_fresh_rates = reg.item_rate_matrices(capex_rate_map, capex_names)
+    # Signed (decom inverted) base exit volume; only replacement items use it
+    inc_exit = np.asarray(reg.entry_exit, dtype=float)[inc_pos]
+    inc_capex_cf_off = np.asarray(reg.entry_capex_cashflow_offset, dtype=np.int64)[inc_pos]
+    capex_items_recognized: List[Dict[str, Any]] = []
+    # Recognized amounts per included combination (rows in slot order)
+    capex_combo_recog: Dict[str, np.ndarray] = {}
+    inventory_groups = {'First Time Inventory', 'Replacement Inventory'}
+    for i, item in enumerate(capex_items):
+        iname = capex_names[i]
+        igroup = item.get('group') or ''
+        itype = item.get('type') or 'first_time'
+        cf_off_item = int(item.get('cashflow_offset_months') or 0)
+        is_refund = bool(item.get('is_refund')) or (itype == 'deposit_refund')
+        is_advance_procurement = igroup in inventory_groups
+        override_months = capex_override_map.get(iname)
+        existing_part = 0.0
+        if itype == 'replacement':
+            if override_months is not None:
+                existing_part = np.array([override_months.get(m, 0.0) for m in months])
+            else:
+                existing_part = (inc_exit * capex_existing_rates[i, inc_ids])[:, None]
+        fresh_part = np.zeros((len(inc_pos), len(months)))
+        if itype in ('first_time','replacement','people'):
+            # Inventory items are bought ahead: volume is looked up `cf_off_item` months later
+            fresh_part = cube.shifted(-cf_off_item if is_advance_procurement else 0)[inc_pos] * capex_fresh_rates[i, inc_ids][:, None]
+        amounts = (existing_part + fresh_part) * (-1.0 if is_refund else 1.0)
+        if len(slot_ids):
+            if iname not in capex_combo_recog:
+                capex_combo_recog[iname] = np.zeros((len(slot_ids), len(months)))
+            np.add.at(capex_combo_recog[iname], entry_slot, amounts)
+        recog_paise = _to_paise(_sequential_sum(amounts, 0))
+        capex_items_recognized.append({
+            'name': iname,
+            'group': igroup,
+            'type': itype,
+            'cashflow_offset_months': cf_off_item,
+            'is_refund': is_refund,
+            'monthly': dict(zip(months, _rupees(recog_paise).tolist())),
+            'total': float(_rupees(_paise_sum(recog_paise)))
+        })
+    # Cash: inventory items already have their offset applied at recognition and are
+    # paid as recognized; service items are paid after the combination + item delay.
+    capex_cash_map: Dict[str, np.ndarray] = {}
+    for item, iname in zip(capex_items, capex_names):
+        item_cf_off = int(item.get('cashflow_offset_months') or 0)
+        is_advance_procurement = (item.get('group') or '') in inventory_groups
+        item_cash = np.zeros(len(months))
+        if spill is not None:
+            spill.take('capex', iname, item_cash)
+        if iname in capex_combo_recog:
+            # One row per included entry: duplicate combinations pay their store once per occurrence
+            recog_rows = _to_paise(capex_combo_recog[iname])[entry_slot]
+            if is_advance_procurement:
+                item_cash = _shift_months(recog_rows, 0, item_cash)
+            else:
+                item_cash = _shift_months(recog_rows, inc_capex_cf_off + item_cf_off, item_cash, spill, 'capex', iname)
+        capex_cash_map[iname] = item_cash
+    # Group CAPEX cashflow by group header
+    group_headers = [
+        'First Time Inventory',
+        'First Time Capex',
+        'Replacement Inventory',
+        'Replacement Capex',
+        'Capex People',
+        'ROW Deposit',
+        'Deposit Refund'
+    ]
+    group_cash = {g: np.zeros(len(months)) for g in group_headers}
+    for item in getattr(payload, 'capex_items', []):
+        igroup = item.get('group')
+        mv = capex_cash_map.get(item.get('name'))
+        if igroup in group_headers and mv is not None:
+            group_cash[igroup] = group_cash[igroup] + mv
+    capex_group_cash = {g: dict(zip(months, _rupees(v).tolist())) for g, v in group_cash.items()}
+    capex_group_total = {g: float(_rupees(_paise_sum(v))) for g, v in group_cash.items()}
+    # Provide overall monthly CAPEX total as before
+    capex_cash_total = np.zeros(len(months))
+    for mv in capex_cash_map.values():
+        capex_cash_total = capex_cash_total + mv
+    monthly_capex_totals = dict(zip(months, _rupees(capex_cash_total).tolist()))
+    total_capex = float(_rupees(_paise_sum(capex_cash_total)))
+    if log_capex.isEnabledFor(logging.DEBUG):
+        for g in group_headers:
+            log_capex.debug("[CAPEX] group=%s, total=%s", g, capex_group_total[g])
+    # Convert to millions for display
+    monthly_net_cashflow = {m: round((cash_net_operating[m] - monthly_capex_totals[m]) / 1_000_000, 2) for m in months}
+    # Cumulative net cash in whole hundredths (of a million), so it stays exact
+    running_cum = 0.0
+    monthly_cum_net_cashflow: Dict[str,float] = {}
+    peak_funding = 0.0
+    for m, hundredths in zip(months, _to_paise(list(monthly_net_cashflow.values()), rounded=True).tolist()):
+        running_cum += hundredths
+        monthly_cum_net_cashflow[m] = running_cum / 100
+        if running_cum < peak_funding:
+            peak_funding = running_cum
+    total_net_cashflow = _exact_total(list(monthly_net_cashflow.values()))
+    peak_funding = peak_funding / 100
+
+    return RevenueCalcResponse(
+        fiscal_year=fy,
+        months=months,
+        rows=rows if include_rows else [],
+        monthly_totals=monthly_totals,
+        monthly_recurring_totals=monthly_recurring_totals,
+        monthly_one_time_totals=monthly_one_time_totals,
+        monthly_passthrough_revenue=monthly_passthrough_revenue,
+        monthly_passthrough_expense=monthly_passthrough_expense,
+        total_revenue=grand_total,
+        total_passthrough_revenue=total_passthrough_revenue,
+        total_passthrough_expense=total_passthrough_expense,
+        opex_items=opex_items_results,
+        monthly_opex_totals=monthly_opex_totals,
+        total_opex=total_opex,
+        monthly_cash_recurring_inflow=cash_recurring,
+        monthly_cash_one_time_inflow=cash_one_time,
+        monthly_cash_passthrough_inflow=cash_passthrough,
+        monthly_cash_gross_inflow=cash_gross,
+        monthly_cash_outflow_items=cash_outflow_items_list,
+        monthly_cash_outflow_totals=cash_outflow_totals,
+        monthly_cash_net_operating=cash_net_operating,
+        total_cash_recurring_inflow=total_cash_rec,
+        total_cash_one_time_inflow=total_cash_one,
+        total_cash_gross_inflow=total_cash_gross,
+        total_cash_outflow=total_cash_outflow,
+        total_cash_net_operating=total_cash_net,
+        capex_items=capex_items_recognized,
+        monthly_capex_totals=monthly_capex_totals,
+        total_capex=total_capex,
+        monthly_net_cashflow=monthly_net_cashflow,
+        monthly_cum_net_cashflow=monthly_cum_net_cashflow,
+        peak_funding=peak_funding,
+        total_net_cashflow=total_net_cashflow,
+        capex_group_cash=capex_group_cash,
+        capex_group_total=capex_group_total
+    )
+
+
+def _revenue_calc_core(payload: RevenueCalcPayload) -> RevenueCalcResponse:
+    """Core revenue/cost/cashflow calculation (Python reference engine).
+
+    LOB-specific handlers call it (through `_revenue_calc`) after making
+    lightweight modifications to the payload.
+    """
+    reg = _CombinationRegistry(payload)
+    cube = _VolumeCube(payload, reg)
+    return _revenue_calc_finish(payload, reg, cube, *_revenue_rows_python(payload, reg, cube))
+
+
+def _revenue_rows_python(payload: RevenueCalcPayload, reg: _CombinationRegistry, cube: _VolumeCube):
+    """Per-combination, per-month revenue loop (the original implementation).
+
+    Returns (rows, monthly_totals, monthly_recurring_totals, monthly_one_time_totals, grand_total).
+    """
+    months = payload.months or FISCAL_MONTHS
+    rate_entries = reg.rate_entries(payload.rates)
+
+    # Totals in whole paise
+    monthly_totals_p = {m:0.0 for m in months}
+    monthly_recurring_totals_p = {m:0.0 for m in months}
+    monthly_one_time_totals_p = {m:0.0 for m in months}
+    rows: List[RevenueRow] = []
+    grand_total_p = 0.0
+    DEN = 180.0
+    
+    for cid, key in enumerate(reg.keys):
+        r = rate_entries[cid] or RateEntry(dimensions={}, recurring_rate=0, one_time_rate=0)
+        FR = r.recurring_rate if r else 0.0
+        FO = r.one_time_rate if r else 0.0
+        ER = r.existing_recurring_rate if r else 0.0
+        EO = r.existing_one_time_rate if r else 0.0
+        trace = _trace_enabled(log_revenue, cid)
+        trace_cf = _trace_enabled(log_cashflow, cid)
+        if trace:
+            log_revenue.debug("[RATES] key=%s: FR=%s, FO=%s, ER=%s, EO=%s", key, FR, FO, ER, EO)
+        include_fresh = getattr(payload, 'include_fresh_volumes', True)
+        combo_obj = payload.volumes[reg.first_pos[cid]]
+
+        # Existing per-Lob example preserved (Small Cell multiplier handled by handler if needed)
+        # Signed base exit volume (decommissioning entries are negative)
+        E = reg.base_exit(cid)
+        if trace:
+            log_revenue.debug("[BASE-EXIT] key=%s, base_exit_year=%s, E=%s, exit_volumes=%s", key, payload.base_exit_year, E, combo_obj.exit_volumes if combo_obj else 'N/A')
+        existing_override_rec: Dict[str, float] | None = None
+        existing_override_ot: Dict[str, float] | None = None
+        if payload.base_exit_year and combo_obj and combo_obj.existing_revenue:
+            override = combo_obj.existing_revenue.get(payload.base_exit_year)
+            if override:
+                existing_override_rec = {m: float(override.get('recurring', {}).get(m, 0) or 0) for m in months}
+                existing_override_ot = {m: float(override.get('one_time', {}).get(m, 0) or 0) for m in months}
+        raw_vols = cube.lists('signed_raw')[cid]
+        cum_raw = cube.lists('signed_cum')[cid]
+        if trace:
+            log_revenue.debug("[VOL-DEBUG] key=%s, raw_vols=%s, cum_raw=%s", key, raw_vols, cum_raw)
+        # Offsets resolved at ingress (combo specific -> combo fresh -> payload specific -> payload fresh)
+        recurring_offset = reg.recurring_offset[cid]
+        one_time_offset = reg.one_time_offset[cid]
         # Backward compatibility: keep single offset variable for other uses
-        offset = parsed_combo_offset if parsed_combo_offset is not None else payload_fresh
+        offset = reg.fresh_offset[cid]
         
-        if recurring_offset > 0 or one_time_offset > 0:
-            print(f"[CALC] key={key}, recurring_offset={recurring_offset}, one_time_offset={one_time_offset}, include_fresh={include_fresh}, FR={FR}, FO={FO}")
+        if trace and (recurring_offset > 0 or one_time_offset > 0):
+            log_revenue.debug("[CALC] key=%s, recurring_offset=%s, one_time_offset=%s, include_fresh=%s, FR=%s, FO=%s", key, recurring_offset, one_time_offset, include_fresh, FR, FO)
         
         # Check LOB flags for custom logic
         lob_name = (getattr(payload, 'lob', 'FTTH') or 'FTTH').upper()
@@ -1422,8 +2963,8 @@ def _revenue_calc_core(payload: RevenueCalcPayload) -> RevenueCalcResponse:
         fresh_recurring_total = 0.0
         existing_one_time_total = 0.0
         fresh_one_time_total = 0.0
-        total_recurring = 0.0
-        total_one_time = 0.0
+        total_recurring_p = 0.0  # whole paise
+        total_one_time_p = 0.0
 
         # Track whether we've recognized one-time revenue for this combination
         # This ensures one-time is recognized only once, accounting for offset
@@ -1464,22 +3005,22 @@ def _revenue_calc_core(payload: RevenueCalcPayload) -> RevenueCalcResponse:
                 # Recurring: use recurring_offset
                 if idx >= recurring_offset and len(cum_raw) > (idx - recurring_offset):
                     eff_cum_recurring = cum_raw[idx - recurring_offset]
-                    if idx < 4:
-                        print(f"[LOOP-REC] month {idx}({m}): idx({idx}) >= recurring_offset({recurring_offset}), eff_cum_recurring={eff_cum_recurring}, cum_raw[{idx-recurring_offset}]={cum_raw[idx-recurring_offset]}")
+                    if trace and idx < 4:
+                        log_revenue.debug("[LOOP-REC] month %d(%s): idx(%d) >= recurring_offset(%d), eff_cum_recurring=%s, cum_raw[%d]=%s", idx, m, idx, recurring_offset, eff_cum_recurring, idx - recurring_offset, cum_raw[idx - recurring_offset])
                 else:
                     eff_cum_recurring = 0.0
-                    if idx < 4:
-                        print(f"[LOOP-REC] month {idx}({m}): idx({idx}) < recurring_offset({recurring_offset}), eff_cum_recurring=0, cum_raw length={len(cum_raw)}")
+                    if trace and idx < 4:
+                        log_revenue.debug("[LOOP-REC] month %d(%s): idx(%d) < recurring_offset(%d), eff_cum_recurring=0, cum_raw length=%d", idx, m, idx, recurring_offset, len(cum_raw))
                 
                 # One-time: use one_time_offset
                 if idx >= one_time_offset and len(cum_raw) > (idx - one_time_offset):
                     eff_cum_one_time = cum_raw[idx - one_time_offset]
-                    if one_time_offset > 0 and idx < 4:
-                        print(f"[LOOP-OT] month {idx}({m}): idx({idx}) >= one_time_offset({one_time_offset}), eff_cum_one_time={eff_cum_one_time}")
+                    if trace and one_time_offset > 0 and idx < 4:
+                        log_revenue.debug("[LOOP-OT] month %d(%s): idx(%d) >= one_time_offset(%d), eff_cum_one_time=%s", idx, m, idx, one_time_offset, eff_cum_one_time)
                 else:
                     eff_cum_one_time = 0.0
-                    if one_time_offset > 0 and idx < 4:
-                        print(f"[LOOP-OT] month {idx}({m}): idx({idx}) < one_time_offset({one_time_offset}), eff_cum_one_time=0")
+                    if trace and one_time_offset > 0 and idx < 4:
+                        log_revenue.debug("[LOOP-OT] month %d(%s): idx(%d) < one_time_offset(%d), eff_cum_one_time=0", idx, m, idx, one_time_offset)
                 
                 # Get non-cumulative fresh volume for this month (for cashflow) - use offset for backward compatibility
                 if idx >= offset and len(cum_raw) > (idx - offset):
@@ -1520,7 +3061,7 @@ def _revenue_calc_core(payload: RevenueCalcPayload) -> RevenueCalcResponse:
                 else:
                     if getattr(payload, 'formula_recurring', None):
                         try:
-                            fresh_rec_m = _safe_eval(payload.formula_recurring, {'volume': eff_cum_recurring, 'recurring_rate': FR}) if FR else 0.0
+                            fresh_rec_m = _evaluate_formula(payload.formula_recurring, {'volume': eff_cum_recurring, 'recurring_rate': FR}) if FR else 0.0
                         except HTTPException:
                             raise
                         except Exception:
@@ -1543,7 +3084,7 @@ def _revenue_calc_core(payload: RevenueCalcPayload) -> RevenueCalcResponse:
                     # OHFC: divide by 12
                     if getattr(payload, 'formula_one_time', None):
                         try:
-                            yearly_ot_fresh = _safe_eval(payload.formula_one_time, {'total_volume_year': eff_cum_one_time, 'one_time_rate': FO, 'volume': eff_cum_one_time}) if FO else 0.0
+                            yearly_ot_fresh = _evaluate_formula(payload.formula_one_time, {'total_volume_year': eff_cum_one_time, 'one_time_rate': FO, 'volume': eff_cum_one_time}) if FO else 0.0
                             pl_ot_m_fresh = (yearly_ot_fresh / 12.0) if yearly_ot_fresh else 0.0
                         except HTTPException:
                             raise
@@ -1555,7 +3096,7 @@ def _revenue_calc_core(payload: RevenueCalcPayload) -> RevenueCalcResponse:
                     denom = (lock_in_val * 12.0) if lock_in_val > 0 else 12.0
                     if getattr(payload, 'formula_one_time', None):
                         try:
-                            yearly_ot_fresh = _safe_eval(payload.formula_one_time, {'total_volume_year': eff_cum_one_time, 'one_time_rate': FO, 'volume': eff_cum_one_time}) if FO else 0.0
+                            yearly_ot_fresh = _evaluate_formula(payload.formula_one_time, {'total_volume_year': eff_cum_one_time, 'one_time_rate': FO, 'volume': eff_cum_one_time}) if FO else 0.0
                             pl_ot_m_fresh = (yearly_ot_fresh / denom) if yearly_ot_fresh else 0.0
                         except HTTPException:
                             raise
@@ -1566,7 +3107,7 @@ def _revenue_calc_core(payload: RevenueCalcPayload) -> RevenueCalcResponse:
                 else:
                     if getattr(payload, 'formula_one_time', None):
                         try:
-                            yearly_ot_fresh = _safe_eval(payload.formula_one_time, {'total_volume_year': eff_cum_one_time, 'one_time_rate': FO, 'volume': eff_cum_one_time}) if FO else 0.0
+                            yearly_ot_fresh = _evaluate_formula(payload.formula_one_time, {'total_volume_year': eff_cum_one_time, 'one_time_rate': FO, 'volume': eff_cum_one_time}) if FO else 0.0
                             pl_ot_m_fresh = yearly_ot_fresh / DEN if yearly_ot_fresh else 0.0
                         except HTTPException:
                             raise
@@ -1593,8 +3134,8 @@ def _revenue_calc_core(payload: RevenueCalcPayload) -> RevenueCalcResponse:
             # Existing Recurring Cashflow: base exit volume * recurring rate with offset = (fresh recurring offset - 1)
             existing_rec_cf_offset = max((recurring_offset or 0) - 1, 0)
             cashflow_existing_rec_m = E * ER if idx >= existing_rec_cf_offset else 0.0
-            if idx < 4:
-                print(f"[CASHFLOW-EXIST] month {idx}({m}): E={E}, ER={ER}, existing_rec_cf_offset={existing_rec_cf_offset}, cashflow_existing_rec_m={cashflow_existing_rec_m}")
+            if trace_cf and idx < 4:
+                log_cashflow.debug("[CASHFLOW-EXIST] month %d(%s): E=%s, ER=%s, existing_rec_cf_offset=%d, cashflow_existing_rec_m=%s", idx, m, E, ER, existing_rec_cf_offset, cashflow_existing_rec_m)
             
             # Existing One-Time Cashflow: $0 (NO existing one-time cashflow)
             cashflow_existing_ot_m = 0.0
@@ -1607,15 +3148,15 @@ def _revenue_calc_core(payload: RevenueCalcPayload) -> RevenueCalcResponse:
                 if eff_cum_recurring_cf > 0:
                     if getattr(payload, 'formula_recurring', None):
                         try:
-                            cashflow_fresh_rec_m = _safe_eval(payload.formula_recurring, {'volume': eff_cum_recurring_cf, 'recurring_rate': FR}) if FR else 0.0
+                            cashflow_fresh_rec_m = _evaluate_formula(payload.formula_recurring, {'volume': eff_cum_recurring_cf, 'recurring_rate': FR}) if FR else 0.0
                         except:
                             cashflow_fresh_rec_m = eff_cum_recurring_cf * FR if FR else 0.0
                     else:
                         cashflow_fresh_rec_m = eff_cum_recurring_cf * FR if FR else 0.0
-                    if idx < 4:
-                        print(f"[CASHFLOW-CF] month {idx}({m}): eff_cum_recurring_cf={eff_cum_recurring_cf}, FR={FR}, cashflow_fresh_rec_m={cashflow_fresh_rec_m}")
-            elif idx < 4:
-                print(f"[CASHFLOW] month {idx}({m}): skipped - include_fresh={include_fresh}, eff_cum_recurring={eff_cum_recurring}, idx={idx}, recurring_offset={recurring_offset}")
+                    if trace_cf and idx < 4:
+                        log_cashflow.debug("[CASHFLOW-CF] month %d(%s): eff_cum_recurring_cf=%s, FR=%s, cashflow_fresh_rec_m=%s", idx, m, eff_cum_recurring_cf, FR, cashflow_fresh_rec_m)
+            elif trace_cf and idx < 4:
+                log_cashflow.debug("[CASHFLOW] month %d(%s): skipped - include_fresh=%s, eff_cum_recurring=%s, idx=%d, recurring_offset=%d", idx, m, include_fresh, eff_cum_recurring, idx, recurring_offset)
 
             if is_dark_fiber:
                 cashflow_fresh_rec_m *= pair_multiplier
@@ -1633,26 +3174,27 @@ def _revenue_calc_core(payload: RevenueCalcPayload) -> RevenueCalcResponse:
             
             cashflow_ot_m = cashflow_existing_ot_m + cashflow_fresh_ot_m
             cashflow_rec_m = cashflow_existing_rec_m + cashflow_fresh_rec_m
-            if idx < 4:
-                print(f"[CASHFLOW-TOTAL] month {idx}({m}): cashflow_rec_m={cashflow_rec_m}, cashflow_ot_m={cashflow_ot_m}")
+            if trace_cf and idx < 4:
+                log_cashflow.debug("[CASHFLOW-TOTAL] month %d(%s): cashflow_rec_m=%s, cashflow_ot_m=%s", idx, m, cashflow_rec_m, cashflow_ot_m)
 
             rec_m = existing_rec_m + fresh_rec_m
             ot_m = existing_ot_m_adjusted + fresh_ot_m
             # debug removed
-            # Round per month components before aggregation so row totals equal sum of displayed months
-            rec_m_r = round(rec_m, DECIMALS)
-            ot_m_r = round(ot_m, DECIMALS)
-            total_m_r = round(rec_m_r + ot_m_r, DECIMALS)
-            cashflow_rec_m_r = round(cashflow_rec_m, DECIMALS)
-            cashflow_ot_m_r = round(cashflow_ot_m, DECIMALS)
-            cashflow_total_m_r = round(cashflow_rec_m_r + cashflow_ot_m_r, DECIMALS)
+            # Round per month components to paise before aggregation so row totals equal sum of displayed months
+            rec_m_p = _paise(rec_m)
+            ot_m_p = _paise(ot_m)
+            rec_m_r = rec_m_p / PAISE_PER_RUPEE
+            ot_m_r = ot_m_p / PAISE_PER_RUPEE
+            total_m_r = (rec_m_p + ot_m_p) / PAISE_PER_RUPEE
+            cashflow_rec_m_r = _paise(cashflow_rec_m) / PAISE_PER_RUPEE
+            cashflow_ot_m_r = _paise(cashflow_ot_m) / PAISE_PER_RUPEE
             
             monthly_rec[m] = rec_m_r
             monthly_ot[m] = ot_m_r
             monthly_rev[m] = total_m_r
             # Store component splits for one-time
-            monthly_existing_ot_map[m] = round(existing_ot_m_adjusted, DECIMALS)
-            monthly_fresh_ot_map[m] = round(fresh_ot_m, DECIMALS)
+            monthly_existing_ot_map[m] = _paise(existing_ot_m_adjusted) / PAISE_PER_RUPEE
+            monthly_fresh_ot_map[m] = _paise(fresh_ot_m) / PAISE_PER_RUPEE
             # Store cashflow components
             monthly_cashflow_rec_map[m] = cashflow_rec_m_r
             monthly_cashflow_ot_map[m] = cashflow_ot_m_r
@@ -1661,24 +3203,23 @@ def _revenue_calc_core(payload: RevenueCalcPayload) -> RevenueCalcResponse:
             fresh_recurring_total += fresh_rec_m
             existing_one_time_total += existing_ot_m_adjusted
             fresh_one_time_total += fresh_ot_m
-            total_recurring += rec_m_r
-            total_one_time += ot_m_r
+            total_recurring_p += rec_m_p
+            total_one_time_p += ot_m_p
+            monthly_totals_p[m] += rec_m_p + ot_m_p
+            monthly_recurring_totals_p[m] += rec_m_p
+            monthly_one_time_totals_p[m] += ot_m_p
 
         # Round aggregated subtotals
-        existing_recurring_total = round(existing_recurring_total, DECIMALS)
-        fresh_recurring_total = round(fresh_recurring_total, DECIMALS)
-        existing_one_time_total = round(existing_one_time_total, DECIMALS)
-        fresh_one_time_total = round(fresh_one_time_total, DECIMALS)
-        total_recurring = round(total_recurring, DECIMALS)
-        total_one_time = round(total_one_time, DECIMALS)
-        row_total = round(total_recurring + total_one_time, DECIMALS)
-        for m in months:
-            monthly_totals[m] += monthly_rev[m]
-            monthly_recurring_totals[m] += monthly_rec[m]
-            monthly_one_time_totals[m] += monthly_ot[m]
-        grand_total += row_total
+        existing_recurring_total = _paise(existing_recurring_total) / PAISE_PER_RUPEE
+        fresh_recurring_total = _paise(fresh_recurring_total) / PAISE_PER_RUPEE
+        existing_one_time_total = _paise(existing_one_time_total) / PAISE_PER_RUPEE
+        fresh_one_time_total = _paise(fresh_one_time_total) / PAISE_PER_RUPEE
+        total_recurring = total_recurring_p / PAISE_PER_RUPEE
+        total_one_time = total_one_time_p / PAISE_PER_RUPEE
+        row_total = (total_recurring_p + total_one_time_p) / PAISE_PER_RUPEE
+        grand_total_p += total_recurring_p + total_one_time_p
         dims = r.dimensions or {kv.split('=')[0]: kv.split('=')[1] for kv in key.split('|') if '=' in kv}
-        rows.append(RevenueRow(
+        rows.append(_revenue_row(
             dimensions=dims,
             monthly_revenue=monthly_rev,
             monthly_recurring=monthly_rec,
@@ -1695,495 +3236,608 @@ def _revenue_calc_core(payload: RevenueCalcPayload) -> RevenueCalcResponse:
             existing_one_time=existing_one_time_total,
             fresh_one_time=fresh_one_time_total
         ))
-    # Final rounding for overall totals (already sums of rounded per-row values)
-    for m in months:
-        monthly_totals[m] = round(monthly_totals[m], DECIMALS)
-        monthly_recurring_totals[m] = round(monthly_recurring_totals[m], DECIMALS)
-        monthly_one_time_totals[m] = round(monthly_one_time_totals[m], DECIMALS)
-    grand_total = round(grand_total, DECIMALS)
+    # Overall totals: exact sums of the per-row paise
+    monthly_totals = {m: v / PAISE_PER_RUPEE for m, v in monthly_totals_p.items()}
+    monthly_recurring_totals = {m: v / PAISE_PER_RUPEE for m, v in monthly_recurring_totals_p.items()}
+    monthly_one_time_totals = {m: v / PAISE_PER_RUPEE for m, v in monthly_one_time_totals_p.items()}
+    grand_total = grand_total_p / PAISE_PER_RUPEE
+    return rows, monthly_totals, monthly_recurring_totals, monthly_one_time_totals, grand_total
 
-    # -------- OPEX CALCULATION --------
-    opex_items_results: List[Dict[str, Any]] = []
-    monthly_opex_totals: Dict[str, float] = {m:0.0 for m in months}
-    total_opex = 0.0
-    # Track passthrough (P&L + cash) for qualified site types/items
-    passthrough_combo_pl: Dict[str, Dict[str, Dict[str, float]]] = {}
-    # Build lookup for opex rates: item -> key -> (existing_rate,fresh_rate)
-    opex_rate_map: Dict[str, Dict[str, Dict[str,float]]] = {}
-    for entry in getattr(payload, 'opex_rates', []) or []:
-        dims = entry.get('dimensions') or {}
-        item_name = entry.get('item')
-        if not item_name:
-            continue
-        k = _dim_key(dims)
-        opex_rate_map.setdefault(item_name, {})[k] = {
-            'existing_rate': float(entry.get('existing_rate') or 0),
-            'fresh_rate': float(entry.get('fresh_rate') or 0)
-        }
-    include_fresh = getattr(payload, 'include_fresh_volumes', True)
-    # Build override map: item -> months dict
-    override_map: Dict[str, Dict[str,float]] = {}
-    for ov in getattr(payload, 'existing_opex_overrides', []) or []:
-        item_name = ov.get('item') if isinstance(ov, dict) else None
-        months_obj = ov.get('months') if isinstance(ov, dict) else None
-        fy_row = ov.get('fiscal_year') if isinstance(ov, dict) else None
-        if not item_name or not months_obj:
-            continue
-        override_map[item_name] = {m: float(months_obj.get(m,0) or 0) for m in months}
-    # Track per-combination per-item monthly P&L (pre-cashflow shift) to build cashflow later
-    combo_item_pl: Dict[str, Dict[str, Dict[str, float]]] = {}  # item -> combo_key -> month -> value
-    # New: per-opex-item cashflow offsets (additional to combination-level)
-    item_cashflow_offset_map: Dict[str, int] = {}
-    passthrough_inflow_offset_map: Dict[str, int] = {}
-    passthrough_outflow_offset_map: Dict[str, int] = {}
-    for item in getattr(payload, 'opex_items', []) or []:
-        name = item.get('name')
-        if not name:
-            continue
-        item_offset = int(item.get('fresh_offset_months') or 0)
-        # Optional per-item cashflow offset (independent timing for cash actualization of this opex item)
-        item_cashflow_offset = int(item.get('cashflow_offset_months') or 0)
-        if item_cashflow_offset < 0:
-            item_cashflow_offset = 0
-        item_cashflow_offset_map[name] = item_cashflow_offset
-        # Passthrough-specific offsets: inflow and outflow can differ
-        pt_inflow_offset = int(item.get('passthrough_inflow_offset_months') or item_cashflow_offset)
-        pt_outflow_offset = int(item.get('passthrough_outflow_offset_months') or item_cashflow_offset)
-        if pt_inflow_offset < 0:
-            pt_inflow_offset = 0
-        if pt_outflow_offset < 0:
-            pt_outflow_offset = 0
-        passthrough_inflow_offset_map[name] = pt_inflow_offset
-        passthrough_outflow_offset_map[name] = pt_outflow_offset
-        is_passthrough_item = enable_small_cell_passthrough and str(name).strip().upper() in passthrough_items
-        # Passthrough items ignore overrides (always recomputed per combo)
-        has_override = False if is_passthrough_item else name in override_map
-        # Start with override months if present, else zeros
-        item_monthly = {m: (override_map[name][m] if has_override else 0.0) for m in months}
-        # Iterate combinations for fresh + (existing if no override)
-        for combo in payload.volumes:
-            if combo.included is False:
-                continue
-            key = _dim_key(combo.dimensions)
-            rates_obj = opex_rate_map.get(name, {}).get(key, {'existing_rate':0.0,'fresh_rate':0.0})
-            existing_rate = rates_obj['existing_rate']
-            fresh_rate = rates_obj['fresh_rate']
-            E = 0.0
-            if payload.base_exit_year:
-                E = float(combo.exit_volumes.get(payload.base_exit_year, 0) or 0)
-                # Decom combos reduce base exit volume
-                if decom_map.get(key):
-                    E = -E
-            fy_months = combo.volumes.get(fy, {})
-            raw_vols = [float(fy_months.get(m,0) or 0) for m in months]
-            cum_raw = []
-            run = 0.0
-            for v in raw_vols:
-                run += v
-                cum_raw.append(run)
-            # Prepare per-combo item store
-            cit = combo_item_pl.setdefault(name, {}).setdefault(key, {m:0.0 for m in months})
-            pt_store = None
-            if is_passthrough_item:
-                pt_store = passthrough_combo_pl.setdefault(name, {}).setdefault(key, {m:0.0 for m in months})
-            # Use dimensions-based site type; fallback to explicit site_type attr if present
-            site_type_val = _get_site_type(getattr(combo, 'dimensions', None)) or str(getattr(combo, 'site_type', '') or '')
-            site_type_upper = site_type_val.strip().upper()
-            for idx, m in enumerate(months):
-                eff_cum = 0.0
-                if include_fresh:
-                    # Apply the same offset logic as revenue: check bounds before accessing
-                    if idx >= item_offset and len(cum_raw) > (idx - item_offset):
-                        eff_cum = cum_raw[idx - item_offset]
-                    else:
-                        eff_cum = 0.0
-                existing_part = 0.0 if has_override else (E * existing_rate)
-                fresh_part = eff_cum * fresh_rate if include_fresh else 0.0
-                val = existing_part + fresh_part
-
-                if is_passthrough_item and site_type_upper in passthrough_site_types:
-                    pt_store[m] += val
-                    monthly_passthrough_revenue[m] += val
-                    monthly_passthrough_expense[m] += val
-                    continue
 
-                item_monthly[m] += val
-                cit[m] += val
-        # Round
-        item_monthly = {m: round(v, DECIMALS) for m,v in item_monthly.items()}
-        item_total = round(sum(item_monthly.values()), DECIMALS)
-        for m in months:
-            monthly_opex_totals[m] += item_monthly[m]
-        total_opex += item_total
-        opex_items_results.append({
-            'name': name,
-            'fresh_offset_months': item_offset,
-            'cashflow_offset_months': item_cashflow_offset_map.get(name, 0),
-            'override_applied': has_override,
-            'monthly': item_monthly,
-            'total': item_total
-        })
-    # Add passthrough P&L (Small Cell rent/electricity for specific site types)
-    if enable_small_cell_passthrough and any(v != 0 for v in monthly_passthrough_revenue.values()):
-        monthly_passthrough_revenue = {m: round(v, DECIMALS) for m,v in monthly_passthrough_revenue.items()}
-        monthly_passthrough_expense = {m: round(v, DECIMALS) for m,v in monthly_passthrough_expense.items()}
-        total_passthrough_revenue = round(sum(monthly_passthrough_revenue.values()), DECIMALS)
-        total_passthrough_expense = round(sum(monthly_passthrough_expense.values()), DECIMALS)
-        for m in months:
-            monthly_totals[m] = round(monthly_totals[m] + monthly_passthrough_revenue[m], DECIMALS)
-            monthly_opex_totals[m] += monthly_passthrough_expense[m]
-        grand_total = round(grand_total + total_passthrough_revenue, DECIMALS)
-        total_opex += total_passthrough_expense
-        opex_items_results.append({
-            'name': 'Passthrough Expense',
-            'fresh_offset_months': 0,
-            'cashflow_offset_months': 0,
-            'override_applied': False,
-            'monthly': monthly_passthrough_expense,
-            'total': total_passthrough_expense,
-            'site_types': sorted(list(passthrough_site_types)),
-            'items': ['Electricity', 'Rent']
-        })
+# ------------------ Money (fixed-point paise) ------------------
+# Amounts are rounded to whole paise once, where they are produced (a row's
+# month value, an opex item's month total, ...), and carried as paise through
+# every aggregation; rupees and millions are only formed for the response.
+# Sums of whole paise are exact and independent of order, so totals are
+# additive (a total always equals the sum of its parts). Paise are held in
+# float64, which is exact for whole numbers up to 2**53 paise (~90 trillion
+# rupees) and lets non-finite amounts (e.g. from a custom formula) still reach
+# the response as null.
+
+PAISE_PER_RUPEE = 100
+
+
+def _round_money(values: "np.ndarray", decimals: int = 2) -> "np.ndarray":
+    """Element-wise equivalent of Python's round(x, decimals).
+
+    np.rint(x * 10**d) agrees with round() except where the scaled product lands
+    within float error of a half (or overflows); those few elements are re-rounded
+    with round().
+    """
+    scale = 10.0 ** decimals
+    with np.errstate(over='ignore', invalid='ignore'):
+        scaled = values * scale
+        out = np.rint(scaled) / scale
+        frac = np.abs(scaled - np.trunc(scaled))
+        ambiguous = (np.abs(frac - 0.5) <= 2 * np.spacing(np.abs(scaled))) | ~np.isfinite(scaled)
+    if ambiguous.any():
+        flat = out.reshape(-1)
+        src = values.reshape(-1)
+        for i in np.flatnonzero(ambiguous.reshape(-1)):
+            flat[i] = round(float(src[i]), decimals)
+    return out
+
+
+def _paise(amount: float) -> float:
+    """round(amount, 2) in whole paise; a zero keeps the sign of its source like np.rint."""
+    rupees = round(amount, 2)
+    if not math.isfinite(rupees):
+        return rupees
+    return math.copysign(float(round(rupees * PAISE_PER_RUPEE)), rupees)
+
+
+def _to_paise(amounts, rounded: bool = False) -> np.ndarray:
+    """Element-wise `_paise`: whole hundredths of each amount (paise of rupees, or of any 2-decimal unit).
+
+    With `rounded=True` the amounts are already rounded to 2 decimals (row
+    values, response figures), so a plain rint gives the same paise.
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    return np.rint((amounts if rounded else _round_money(amounts)) * PAISE_PER_RUPEE)
+
+
+def _paise_sum(paise: np.ndarray, axis: Optional[int] = None):
+    """Exact total of whole-paise amounts; + 0.0 turns an all -0.0 total into 0.0 like a `0.0 +=` loop."""
+    return np.sum(paise, axis=axis) + 0.0
+
+
+def _rupees(paise):
+    """Paise back to rupees: the same float round(x, 2) gives for the amount."""
+    return paise / PAISE_PER_RUPEE
+
+
+def _millions(paise):
+    """Response display unit: rupees / 1,000,000 rounded to 2 decimals (a month series or one total)."""
+    if np.ndim(paise) == 0:
+        return round(float(paise) / PAISE_PER_RUPEE / 1_000_000, 2)
+    return _round_money(_rupees(np.asarray(paise)) / 1_000_000)
+
+
+def _exact_total(amounts) -> float:
+    """round(sum(amounts), 2) for 2-decimal amounts, summed as whole hundredths without float drift."""
+    return float(_paise_sum(_to_paise(amounts, rounded=True))) / PAISE_PER_RUPEE
+
+
+# ------------------ Vectorized Revenue Engine ------------------
+# Same rules as the per-month loop in `_revenue_calc_core`, evaluated on
+# (combinations x months) NumPy arrays. Every rounding and summation step is
+# performed in the same order as the loop so the response is identical.
+
+REVENUE_ENGINE = os.environ.get('REVENUE_ENGINE', 'vectorized').strip().lower()
+
+
+def _sequential_sum(values: "np.ndarray", axis: int) -> "np.ndarray":
+    """Left-to-right sum along `axis`, matching `total = 0.0; total += v` loops.
+
+    np.sum uses pairwise summation, which can differ in the last bit and flip a
+    later round(); accumulate is strictly sequential. Adding 0.0 reproduces the
+    0.0 start value (it only normalises a -0.0 result).
+    """
+    if values.shape[axis] == 0:
+        return np.zeros(values.shape[:axis] + values.shape[axis + 1:]) + 0.0
+    return np.add.accumulate(values, axis=axis).take(-1, axis=axis) + 0.0
+
+
+def _formula_matrix(expr: str, mask: np.ndarray, variables: Dict[str, np.ndarray],
+                    fallback: Optional[np.ndarray] = None) -> np.ndarray:
+    """Evaluate a custom formula where `mask` holds and 0.0 elsewhere.
+
+    Elements are visited in row-major order, i.e. the Python engine's
+    combination/month order, so the first error raised is the same one.
+    """
+    out = np.zeros(mask.shape)
+    if not mask.any():
+        return out
+    try:
+        compiled = _compile_formula(expr)
+    except HTTPException:
+        if fallback is None:
+            raise
+        out[mask] = fallback[mask]
+        return out
+    cols = {k: np.broadcast_to(v, mask.shape)[mask] for k, v in variables.items()}
+    out[mask] = compiled.evaluate_array(cols, None if fallback is None else fallback[mask])
+    return out
+
+
+def _revenue_rows_vectorized(payload: RevenueCalcPayload, reg: _CombinationRegistry, cube: _VolumeCube):
+    """Vectorized equivalent of the revenue row loop in `_revenue_calc_core`.
+
+    Returns (rows, monthly_totals, monthly_recurring_totals, monthly_one_time_totals, grand_total).
+    """
+    months = list(payload.months or FISCAL_MONTHS)
+    n_months = len(months)
+    DEN = 180.0
+    DECIMALS = 2
+    keys = reg.keys
+    n = reg.size
+
+    lob_name = (getattr(payload, 'lob', 'FTTH') or 'FTTH').upper()
+    is_small_cell = lob_name == 'SMALL CELL'
+    is_sdu = lob_name == 'SDU'
+    is_ohfc = lob_name == 'OHFC'
+    is_active = lob_name == 'ACTIVE'
+    is_dark_fiber = lob_name == 'DARK FIBER'
+    include_fresh = getattr(payload, 'include_fresh_volumes', True)
+
+    rate_entries = reg.rate_entries(payload.rates)
+
+    FR = np.zeros(n); FO = np.zeros(n); ER = np.zeros(n); EO = np.zeros(n)
+    E = np.array([reg.base_exit(cid) for cid in range(n)], dtype=float)
+    rec_off = np.array(reg.recurring_offset, dtype=np.int64)
+    ot_off = np.array(reg.one_time_offset, dtype=np.int64)
+    pair_multiplier = np.ones(n)
+    lock_in = np.ones(n)
+    has_override = np.zeros(n, dtype=bool)
+    override_rec = np.zeros((n, n_months))
+    override_ot = np.zeros((n, n_months))
+    dims_list: List[Dict[str, str]] = []
+
+    for i, key in enumerate(keys):
+        r = rate_entries[i] or RateEntry(dimensions={}, recurring_rate=0, one_time_rate=0)
+        FR[i] = r.recurring_rate
+        FO[i] = r.one_time_rate
+        ER[i] = r.existing_recurring_rate
+        EO[i] = r.existing_one_time_rate
+        combo_obj = payload.volumes[reg.first_pos[i]]
+        if payload.base_exit_year and combo_obj and combo_obj.existing_revenue:
+            override = combo_obj.existing_revenue.get(payload.base_exit_year)
+            if override:
+                has_override[i] = True
+                override_rec[i] = [float(override.get('recurring', {}).get(m, 0) or 0) for m in months]
+                override_ot[i] = [float(override.get('one_time', {}).get(m, 0) or 0) for m in months]
+
+        if combo_obj and isinstance(combo_obj.dimensions, dict):
+            if is_dark_fiber:
+                for k, v in combo_obj.dimensions.items():
+                    try:
+                        if 'pair' in str(k).lower().replace('_', ' ').strip():
+                            parsed = float(v)
+                            if parsed > 0:
+                                pair_multiplier[i] = parsed
+                            break
+                    except Exception:
+                        continue
+            if is_sdu:
+                for k, v in combo_obj.dimensions.items():
+                    try:
+                        if str(k).lower().replace('-', ' ').replace('_', ' ').strip() in ['lock in', 'lockin']:
+                            lv = float(v)
+                            if lv > 0:
+                                lock_in[i] = lv
+                            break
+                    except Exception:
+                        continue
+        dims_list.append(r.dimensions or {kv.split('=')[0]: kv.split('=')[1] for kv in key.split('|') if '=' in kv})
+
+    cum = cube.signed_cum
+    month_idx = np.arange(n_months)[None, :]
+    col = lambda a: a[:, None]
+    sdu_denom = col(lock_in * 12.0)
+
+    # Existing components (constant per month unless an uploaded override exists)
+    existing_rec = np.broadcast_to(col(E * ER), (n, n_months))
+    if is_small_cell or is_active or is_ohfc:
+        existing_ot = np.zeros((n, n_months))
     else:
-        monthly_passthrough_revenue = {m:0.0 for m in months}
-        monthly_passthrough_expense = {m:0.0 for m in months}
-        total_passthrough_revenue = 0.0
-        total_passthrough_expense = 0.0
-
-    for m in months:
-        monthly_opex_totals[m] = round(monthly_opex_totals[m], DECIMALS)
-    total_opex = round(total_opex, DECIMALS)
-
-    # -------- CASHFLOW (shifted) - TESTING DEBUG --------
-    cash_recurring = {m:0.0 for m in months}
-    cash_one_time = {m:0.0 for m in months}
-    cash_passthrough = {m:0.0 for m in months}
-    passthrough_cash_outflow = {m:0.0 for m in months}
-    # Per-item shifted outflows
-    cash_item_outflows: Dict[str, Dict[str,float]] = {name: {m:0.0 for m in months} for name in combo_item_pl.keys()}
-    # Build helper maps for revenue rows by key
-    rev_row_map = {}
-    for r in rows:
-        rev_row_map[_dim_key(r.dimensions)] = r
-    print(f"[CF-DEBUG] rows list: {len(rows)} rows, checking monthly_cashflow_recurring...")
-    for i, row in enumerate(rows):
-        total_cf_rec = sum(row.monthly_cashflow_recurring.values()) if row.monthly_cashflow_recurring else 0
-        print(f"[CF-DEBUG] row {i}: {row.dimensions}, total monthly_cashflow_recurring sum: {total_cf_rec}, dict: {row.monthly_cashflow_recurring}")
-    for key, row in rev_row_map.items():
-        cf_off_base = cashflow_offset_map.get(key, 0)
-        cf_rec_off = cashflow_rec_offset_map.get(key)
-        cf_ot_off = cashflow_ot_offset_map.get(key)
-        # Fallback to base CF offset when specific offsets are not provided
-        cf_rec_shift = cf_rec_off if cf_rec_off is not None else cf_off_base
-        cf_ot_shift = cf_ot_off if cf_ot_off is not None else cf_off_base
-        # Add uploaded existing cashflow directly (already timed; no shift)
-        ex_cf_rec = existing_cashflow_rec_map.get(key)
-        if ex_cf_rec:
-            for m,v in ex_cf_rec.items():
-                cash_recurring[m] += v
-        ex_cf_ot = existing_cashflow_ot_map.get(key)
-        if ex_cf_ot:
-            for m,v in ex_cf_ot.items():
-                cash_one_time[m] += v
-        for idx, m in enumerate(months):
-            # Recurring shift
-            target_idx_rec = idx + cf_rec_shift
-            if target_idx_rec < len(months):
-                tm_rec = months[target_idx_rec]
-                cf_val = row.monthly_cashflow_recurring.get(m, 0)
-                cash_recurring[tm_rec] += cf_val
-            # One-time shift
-            target_idx_ot = idx + cf_ot_shift
-            if target_idx_ot < len(months):
-                tm_ot = months[target_idx_ot]
-                cash_one_time[tm_ot] += row.monthly_cashflow_one_time.get(m, 0)
-
-    # Passthrough inflow/outflow shifting (Small Cell rent/electricity)
-    if enable_small_cell_passthrough:
-        for item_name, combo_map in passthrough_combo_pl.items():
-            pt_inflow_cf_off = passthrough_inflow_offset_map.get(item_name, 0)
-            pt_outflow_cf_off = passthrough_outflow_offset_map.get(item_name, 0)
-            for key, month_vals in combo_map.items():
-                cf_off_combo = cashflow_offset_map.get(key, 0)
-                # Inflow shift: combo offset + passthrough inflow offset
-                inflow_cf_off = cf_off_combo + pt_inflow_cf_off
-                # Outflow shift: combo offset + passthrough outflow offset
-                outflow_cf_off = cf_off_combo + pt_outflow_cf_off
-                for idx, m in enumerate(months):
-                    # Inflow (cash_passthrough)
-                    target_idx_inflow = idx + inflow_cf_off
-                    if target_idx_inflow < len(months):
-                        tm_inflow = months[target_idx_inflow]
-                        shifted_val = round(month_vals[m], DECIMALS)
-                        cash_passthrough[tm_inflow] += shifted_val
-                    # Outflow (passthrough_cash_outflow)
-                    target_idx_outflow = idx + outflow_cf_off
-                    if target_idx_outflow < len(months):
-                        tm_outflow = months[target_idx_outflow]
-                        shifted_val = round(month_vals[m], DECIMALS)
-                        passthrough_cash_outflow[tm_outflow] += shifted_val
-
-    # Opex shifting per combination & item
-    for item_name, combo_map in combo_item_pl.items():
-        base_item_cf_off = item_cashflow_offset_map.get(item_name, 0)
-        for key, month_vals in combo_map.items():
-            cf_off_combo = cashflow_offset_map.get(key, 0)
-            # Combined shift = combination-level cashflow offset + per-item offset
-            cf_off = cf_off_combo + base_item_cf_off
-            for idx, m in enumerate(months):
-                target_idx = idx + cf_off
-                if target_idx >= len(months):
-                    continue
-                tm = months[target_idx]
-                cash_item_outflows[item_name][tm] += round(month_vals[m], DECIMALS)
-    # Aggregate totals
-    cash_gross = {m: round(cash_recurring[m] + cash_one_time[m] + cash_passthrough[m], DECIMALS) for m in months}
-    cash_outflow_totals = {m:0.0 for m in months}
-    for m in months:
-        for item_name in cash_item_outflows.keys():
-            cash_outflow_totals[m] += cash_item_outflows[item_name][m]
-        cash_outflow_totals[m] += passthrough_cash_outflow[m]
-        cash_outflow_totals[m] = round(cash_outflow_totals[m], DECIMALS)
-    cash_net_operating = {m: round(cash_gross[m] - cash_outflow_totals[m], DECIMALS) for m in months}
-    # Build per-item list
-    cash_outflow_items_list = []
-    for name, mv in cash_item_outflows.items():
-        cash_outflow_items_list.append({
-            'name': name,
-            'cashflow_offset_months': item_cashflow_offset_map.get(name, 0),
-            'monthly': {m: round(mv[m], DECIMALS) for m in months},
-            'total': round(sum(mv.values()), DECIMALS)
-        })
-    if enable_small_cell_passthrough and any(v != 0 for v in passthrough_cash_outflow.values()):
-        cash_outflow_items_list.append({
-            'name': 'Passthrough Expense',
-            'cashflow_offset_months': 0,
-            'monthly': {m: round(passthrough_cash_outflow[m], DECIMALS) for m in months},
-            'total': round(sum(passthrough_cash_outflow.values()), DECIMALS)
-        })
-    # Convert cashflow to millions for display
-    cash_recurring = {m: round(v / 1_000_000, 2) for m, v in cash_recurring.items()}
-    cash_one_time = {m: round(v / 1_000_000, 2) for m, v in cash_one_time.items()}
-    cash_passthrough = {m: round(v / 1_000_000, 2) for m, v in cash_passthrough.items()}
-    cash_gross = {m: round(v / 1_000_000, 2) for m, v in cash_gross.items()}
-    cash_outflow_totals = {m: round(v / 1_000_000, 2) for m, v in cash_outflow_totals.items()}
-    cash_net_operating = {m: round(v / 1_000_000, 2) for m, v in cash_net_operating.items()}
-    
-    # Update per-item outflows to millions
-    for item in cash_outflow_items_list:
-        item['monthly'] = {m: round(v / 1_000_000, 2) for m, v in item['monthly'].items()}
-        item['total'] = round(item['total'] / 1_000_000, 2)
-    
-    total_cash_rec = round(sum(cash_recurring.values()), 2)
-    total_cash_one = round(sum(cash_one_time.values()), 2)
-    total_cash_gross = round(sum(cash_gross.values()), 2)
-    total_cash_outflow = round(sum(cash_outflow_totals.values()), 2)
-    total_cash_net = round(sum(cash_net_operating.values()), 2)
+        denom = sdu_denom if is_sdu else DEN
+        existing_ot = np.broadcast_to(np.where(col(EO) != 0, col(E * EO) / denom, 0.0), (n, n_months))
+    existing_rec = np.where(col(has_override), override_rec, existing_rec)
+    existing_ot = np.where(col(has_override), override_ot, existing_ot)
+
+    # Offset-shifted cumulative fresh volumes
+    if include_fresh:
+        eff_cum_rec = cube.shifted_rows(rec_off)
+        eff_cum_ot = cube.shifted_rows(ot_off)
+        fresh_vol_ot = eff_cum_ot - cube.shifted_rows(ot_off + 1)
+    else:
+        eff_cum_rec = np.zeros((n, n_months))
+        eff_cum_ot = np.zeros((n, n_months))
+        fresh_vol_ot = np.zeros((n, n_months))
+
+    # Fresh recurring (P&L)
+    rec_mask = eff_cum_rec > 0
+    if is_sdu:
+        first_tranche = (eff_cum_rec / 2.0) * col(FR)
+        second_valid = month_idx >= col(rec_off + 2)
+        second_tranche = np.where(second_valid, (cube.shifted_rows(rec_off + 2) / 2.0) * col(FR), 0.0)
+        fresh_rec = np.where(rec_mask, first_tranche + second_tranche, 0.0)
+    elif payload.formula_recurring:
+        fresh_rec = _formula_matrix(payload.formula_recurring, rec_mask & col(FR != 0),
+                                    {'volume': eff_cum_rec, 'recurring_rate': col(FR)})
+    else:
+        fresh_rec = np.where(rec_mask, eff_cum_rec * col(FR), 0.0)
+    if is_dark_fiber:
+        fresh_rec = fresh_rec * col(pair_multiplier)
 
-    # -------- CAPEX (refined: per-combination recognition & cash shifting) --------
-    capex_rate_map: Dict[str, Dict[str, Dict[str,float]]] = {}
-    for entry in getattr(payload, 'capex_rates', []) or []:
-        dims = entry.get('dimensions') or {}
-        item_name = entry.get('item')
-        if not item_name:
-            continue
-        k = _dim_key(dims)
-        capex_rate_map.setdefault(item_name, {})[k] = {
-            'existing_rate': float(entry.get('existing_rate') or 0),
-            'fresh_rate': float(entry.get('fresh_rate') or 0)
-        }
-    capex_override_map: Dict[str, Dict[str,float]] = {}
-    for ov in getattr(payload, 'existing_capex_overrides', []) or []:
-        item_name = ov.get('item') if isinstance(ov, dict) else None
-        months_obj = ov.get('months') if isinstance(ov, dict) else None
-        if not item_name or not months_obj:
-            continue
-        capex_override_map[item_name] = {m: float(months_obj.get(m,0) or 0) for m in months}
-    capex_items_recognized: List[Dict[str, Any]] = []
-    capex_combo_recog: Dict[str, Dict[str, Dict[str,float]]] = {}
-    inventory_groups = {'First Time Inventory', 'Replacement Inventory'}
-    for item in getattr(payload, 'capex_items', []) or []:
-        iname = item.get('name')
-        if not iname:
-            continue
-        igroup = item.get('group') or ''
-        itype = item.get('type') or 'first_time'
-        cf_off_item = int(item.get('cashflow_offset_months') or 0)
-        is_refund = bool(item.get('is_refund')) or (itype == 'deposit_refund')
-        is_advance_procurement = igroup in inventory_groups
-        override_months = capex_override_map.get(iname)
-        monthly_recog_total = {m:0.0 for m in months}
-        for combo in payload.volumes:
-            if combo.included is False:
-                continue
-            key = _dim_key(combo.dimensions)
-            fy_months = combo.volumes.get(fy, {})
-            raw_vols = [float(fy_months.get(m,0) or 0) for m in months]
-            cum_raw = []
-            run_v = 0.0
-            for v in raw_vols:
-                run_v += v
-                cum_raw.append(run_v)
-            # Recognition combo offset disabled (P&L CAPEX recognition deprecated, using cashflow only)
-            eff_recog_off = 0
-            rates_obj = capex_rate_map.get(iname, {}).get(key, {'existing_rate':0.0,'fresh_rate':0.0})
-            existing_rate = rates_obj['existing_rate']
-            fresh_rate = rates_obj['fresh_rate']
-            E = 0.0
-            if itype == 'replacement' and payload.base_exit_year:
-                E = float(combo.exit_volumes.get(payload.base_exit_year, 0) or 0)
-                # If this combo represents decommissioning, invert the exit base
-                if decom_map.get(key):
-                    E = -E
-            combo_store = capex_combo_recog.setdefault(iname, {}).setdefault(key, {m:0.0 for m in months})
-            for midx, m in enumerate(months):
-                existing_part = 0.0
-                if itype == 'replacement':
-                    existing_part = (override_months.get(m,0.0) if override_months is not None else (E * existing_rate))
-                
-                # For inventory items, apply advance offset to volume lookup
-                # For service items, use current month volume
-                vol_offset = cf_off_item if is_advance_procurement else 0
-                lookup_idx = midx + vol_offset if is_advance_procurement else midx
-                
-                # Safe offset logic: only access if index is valid
-                if lookup_idx >= 0 and lookup_idx < len(cum_raw):
-                    eff_cum = cum_raw[lookup_idx]
-                else:
-                    eff_cum = 0.0
-                
-                fresh_part = 0.0
-                if itype in ('first_time','replacement','people'):
-                    fresh_part = eff_cum * fresh_rate
-                amount = (existing_part + fresh_part) * (-1 if is_refund else 1)
-                combo_store[m] += amount
-                monthly_recog_total[m] += amount
-        monthly_recog_total = {m: round(v, DECIMALS) for m,v in monthly_recog_total.items()}
-        capex_items_recognized.append({
-            'name': iname,
-            'group': igroup,
-            'type': itype,
-            'cashflow_offset_months': cf_off_item,
-            'is_refund': is_refund,
-            'monthly': monthly_recog_total,
-            'total': round(sum(monthly_recog_total.values()), DECIMALS)
+    # Fresh one-time (P&L)
+    if is_small_cell or is_active:
+        fresh_ot = np.zeros((n, n_months))
+    else:
+        ot_denom = 12.0 if is_ohfc else (sdu_denom if is_sdu else DEN)
+        ot_mask = (eff_cum_ot > 0) & col(FO != 0)
+        if payload.formula_one_time:
+            yearly_ot = _formula_matrix(payload.formula_one_time, ot_mask,
+                                        {'total_volume_year': eff_cum_ot, 'one_time_rate': col(FO), 'volume': eff_cum_ot})
+            fresh_ot = np.where(yearly_ot != 0, yearly_ot / ot_denom, 0.0)
+        else:
+            fresh_ot = np.where(ot_mask, eff_cum_ot * col(FO) / ot_denom, 0.0)
+    if is_dark_fiber:
+        fresh_ot = fresh_ot * col(pair_multiplier)
+
+    # Cashflow: existing recurring starts (recurring offset - 1) months in, fresh
+    # recurring uses the unshifted cumulative, fresh one-time is paid upfront.
+    existing_cf_off = np.maximum(rec_off - 1, 0)
+    cf_existing_rec = np.where(month_idx >= col(existing_cf_off), col(E * ER), 0.0)
+    if include_fresh:
+        cf_fresh_rec = np.where((cum > 0) & col(FR != 0), cum * col(FR), 0.0)
+        if payload.formula_recurring:
+            # Formula failures fall back to volume * rate here rather than failing the request
+            cf_fresh_rec = _formula_matrix(payload.formula_recurring, (cum > 0) & col(FR != 0),
+                                           {'volume': cum, 'recurring_rate': col(FR)}, fallback=cf_fresh_rec)
+    else:
+        cf_fresh_rec = np.zeros((n, n_months))
+    if is_dark_fiber:
+        cf_fresh_rec = cf_fresh_rec * col(pair_multiplier)
+    if is_small_cell or is_active or is_ohfc or not include_fresh:
+        cf_fresh_ot = np.zeros((n, n_months))
+    else:
+        cf_ot_mask = (fresh_vol_ot > 0) & col(FO != 0) & (month_idx >= col(ot_off))
+        cf_fresh_ot = np.where(cf_ot_mask, fresh_vol_ot * col(FO), 0.0)
+    if is_dark_fiber:
+        cf_fresh_ot = cf_fresh_ot * col(pair_multiplier)
+    cashflow_ot = 0.0 + cf_fresh_ot
+    cashflow_rec = cf_existing_rec + cf_fresh_rec
+
+    rec = existing_rec + fresh_rec
+    ot = existing_ot + fresh_ot
+    rec_p = _to_paise(rec)
+    ot_p = _to_paise(ot)
+    rec_r = _rupees(rec_p)
+    ot_r = _rupees(ot_p)
+    total_r = _rupees(rec_p + ot_p)
+    existing_ot_r = _round_money(existing_ot, DECIMALS)
+    fresh_ot_r = _round_money(fresh_ot, DECIMALS)
+    cashflow_rec_r = _round_money(cashflow_rec, DECIMALS)
+    cashflow_ot_r = _round_money(cashflow_ot, DECIMALS)
+
+    existing_recurring_total = _round_money(_sequential_sum(existing_rec, 1), DECIMALS)
+    fresh_recurring_total = _round_money(_sequential_sum(fresh_rec, 1), DECIMALS)
+    existing_one_time_total = _round_money(_sequential_sum(existing_ot, 1), DECIMALS)
+    fresh_one_time_total = _round_money(_sequential_sum(fresh_ot, 1), DECIMALS)
+    total_recurring_p = _paise_sum(rec_p, 1)
+    total_one_time_p = _paise_sum(ot_p, 1)
+    total_recurring = _rupees(total_recurring_p)
+    total_one_time = _rupees(total_one_time_p)
+    row_total = _rupees(total_recurring_p + total_one_time_p)
+
+    monthly_totals = dict(zip(months, _rupees(_paise_sum(rec_p + ot_p, 0)).tolist()))
+    monthly_recurring_totals = dict(zip(months, _rupees(_paise_sum(rec_p, 0)).tolist()))
+    monthly_one_time_totals = dict(zip(months, _rupees(_paise_sum(ot_p, 0)).tolist()))
+    grand_total = float(_rupees(_paise_sum(total_recurring_p + total_one_time_p)))
+
+    columns = [a.tolist() for a in (total_r, rec_r, ot_r, existing_ot_r, fresh_ot_r, cashflow_rec_r, cashflow_ot_r)]
+    scalars = [a.tolist() for a in (total_recurring, total_one_time, row_total, existing_recurring_total,
+                                    fresh_recurring_total, existing_one_time_total, fresh_one_time_total)]
+    rows: List[RevenueRow] = []
+    for i in range(n):
+        rev_i, rec_i, ot_i, ex_ot_i, fr_ot_i, cf_rec_i, cf_ot_i = (c[i] for c in columns)
+        rows.append(_revenue_row(
+            dimensions=dims_list[i],
+            monthly_revenue=dict(zip(months, rev_i)),
+            monthly_recurring=dict(zip(months, rec_i)),
+            monthly_one_time=dict(zip(months, ot_i)),
+            monthly_existing_one_time=dict(zip(months, ex_ot_i)),
+            monthly_fresh_one_time=dict(zip(months, fr_ot_i)),
+            monthly_cashflow_recurring=dict(zip(months, cf_rec_i)),
+            monthly_cashflow_one_time=dict(zip(months, cf_ot_i)),
+            total_recurring=scalars[0][i],
+            total_one_time=scalars[1][i],
+            total_revenue=scalars[2][i],
+            existing_recurring=scalars[3][i],
+            fresh_recurring=scalars[4][i],
+            existing_one_time=scalars[5][i],
+            fresh_one_time=scalars[6][i],
+        ))
+    return rows, monthly_totals, monthly_recurring_totals, monthly_one_time_totals, grand_total
+
+
+def _revenue_rows_for(engine: str):
+    """Row builder for an engine name ('vectorized' or 'python')."""
+    return _revenue_rows_vectorized if engine == 'vectorized' else _revenue_rows_python
+
+
+class _RevenueTotals:
+    """Running monthly and grand totals over finished rows, kept in whole paise (exact in any order)."""
+
+    def __init__(self, months: List[str]):
+        self.months = months
+        self.monthly = np.zeros((3, len(months)))  # revenue, recurring, one-time
+        self.grand_total = 0.0
+
+    def add(self, rows: List[RevenueRow]):
+        if not rows:
+            return
+        values = np.array([[[row.monthly_revenue[m] for m in self.months],
+                            [row.monthly_recurring[m] for m in self.months],
+                            [row.monthly_one_time[m] for m in self.months]] for row in rows], dtype=float)
+        self.monthly = self.monthly + _paise_sum(_to_paise(values, rounded=True), 0)
+        self.grand_total += float(_paise_sum(_to_paise([row.total_revenue for row in rows], rounded=True)))
+
+    def result(self):
+        """(monthly_totals, monthly_recurring_totals, monthly_one_time_totals, grand_total) in rupees."""
+        revenue, recurring, one_time = _rupees(self.monthly).tolist()
+        return (dict(zip(self.months, revenue)), dict(zip(self.months, recurring)),
+                dict(zip(self.months, one_time)), float(_rupees(self.grand_total)))
+
+
+def _revenue_totals(rows: List[RevenueRow], months: List[str]):
+    """Monthly and grand totals over finished rows (see `_RevenueTotals`)."""
+    totals = _RevenueTotals(months)
+    totals.add(rows)
+    return totals.result()
+
+
+# ------------------ Per-combination Row Memo ------------------
+# A revenue row depends only on its combination's entries (every occurrence),
+# its winning RateEntry and the payload-level settings (LOB, fiscal year,
+# months, base exit year, offsets, formulas, ...). Rows are memoized across
+# requests under a fingerprint of exactly these inputs, so an edited plan only
+# recomputes the combinations whose inputs changed; changing a payload-level
+# setting changes every fingerprint. Totals, opex, cashflow and CAPEX are
+# always aggregated again. At most REVENUE_MEMO_ROWS rows are kept (LRU);
+# 0 disables the memo.
+
+REVENUE_MEMO_ROWS = int(os.environ.get('REVENUE_MEMO_ROWS', '20000'))
+# Payload fields that never reach the revenue rows (shards drop them as well)
+_ROW_INDEPENDENT_FIELDS = {
+    'volumes', 'rates',
+    'opex_items', 'opex_rates', 'existing_opex_overrides',
+    'capex_items', 'capex_rates', 'existing_capex_overrides',
+}
+
+
+class _RowMemo:
+    """Thread-safe LRU of RevenueRow objects keyed by input fingerprint."""
+
+    def __init__(self, max_rows: int):
+        self.max_rows = max_rows
+        self._rows: "OrderedDict[bytes, RevenueRow]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, fingerprints: List[bytes]) -> List[Optional[RevenueRow]]:
+        with self._lock:
+            out = []
+            for fp in fingerprints:
+                row = self._rows.get(fp)
+                if row is not None:
+                    self._rows.move_to_end(fp)
+                out.append(row)
+            found = sum(row is not None for row in out)
+            self.hits += found
+            self.misses += len(out) - found
+            return out
+
+    def put_many(self, fingerprints: List[bytes], rows: List[RevenueRow]):
+        with self._lock:
+            for fp, row in zip(fingerprints, rows):
+                self._rows[fp] = row
+                self._rows.move_to_end(fp)
+            while len(self._rows) > self.max_rows:
+                self._rows.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._rows), 'max_entries': self.max_rows,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_row_memo = _RowMemo(REVENUE_MEMO_ROWS)
+
+
+def _row_fingerprints(payload: RevenueCalcPayload, reg: _CombinationRegistry, engine: str) -> List[bytes]:
+    """Fingerprint of every input of each combination's revenue row, by combination id."""
+    base = hashlib.blake2b(digest_size=20)
+    base.update(engine.encode('utf-8') + b'\n')
+    base.update(payload.model_dump_json(exclude=_ROW_INDEPENDENT_FIELDS).encode('utf-8'))
+    occurrences: List[List[int]] = [[] for _ in range(reg.size)]
+    for pos, cid in enumerate(reg.entry_ids):
+        occurrences[cid].append(pos)
+    rate_entries = reg.rate_entries(payload.rates)
+    fingerprints: List[bytes] = []
+    for cid in range(reg.size):
+        h = base.copy()
+        for pos in occurrences[cid]:
+            h.update(b'\nV' + payload.volumes[pos].model_dump_json().encode('utf-8'))
+        rate = rate_entries[cid]
+        h.update(b'\nR' + (rate.model_dump_json().encode('utf-8') if rate is not None else b'-'))
+        fingerprints.append(h.digest())
+    return fingerprints
+
+
+def _combination_payload(payload: RevenueCalcPayload, reg: _CombinationRegistry, ids: List[int]) -> RevenueCalcPayload:
+    """Revenue-only payload with just the combinations `ids` (ascending): all their entries and rates."""
+    wanted = set(ids)
+    rate_entries = reg.rate_entries(payload.rates)
+    return payload.model_copy(update={
+        'volumes': [payload.volumes[pos] for pos, cid in enumerate(reg.entry_ids) if cid in wanted],
+        'rates': [rate_entries[cid] for cid in ids if rate_entries[cid] is not None],
+        'opex_items': [], 'opex_rates': [], 'existing_opex_overrides': [],
+        'capex_items': [], 'capex_rates': [], 'existing_capex_overrides': [],
+    })
+
+
+def _revenue_rows_memo(payload: RevenueCalcPayload, reg: _CombinationRegistry, cube: _VolumeCube, engine: str) -> List[RevenueRow]:
+    """Revenue rows by combination id, computing only those not in the row memo."""
+    if _row_memo.max_rows <= 0:
+        return _revenue_rows(payload, reg, cube, engine)
+    fingerprints = _row_fingerprints(payload, reg, engine)
+    rows = _row_memo.get_many(fingerprints)
+    missing = [cid for cid, row in enumerate(rows) if row is None]
+    if not missing:
+        return rows
+    if len(missing) == reg.size:
+        computed = _revenue_rows(payload, reg, cube, engine)
+    else:
+        # Sub-plan ids follow first appearance, i.e. ascending ids of this plan
+        sub = _combination_payload(payload, reg, missing)
+        sub_reg = _CombinationRegistry(sub)
+        computed = _revenue_rows(sub, sub_reg, _VolumeCube(sub, sub_reg), engine)
+    for cid, row in zip(missing, computed):
+        rows[cid] = row
+    _row_memo.put_many([fingerprints[cid] for cid in missing], computed)
+    return rows
+
+
+# ------------------ Sharded Execution ------------------
+# Plans with at least REVENUE_SHARD_MIN combinations build their revenue rows on
+# a process pool. Each shard gets a contiguous range of combination ids (with
+# every occurrence of those combinations) and returns finished rows; the parent
+# concatenates them in id order and then computes totals and the opex,
+# cashflow and CAPEX stages exactly as a serial run would. No partial sums
+# cross process boundaries, so the response is identical.
+
+REVENUE_SHARD_MIN = int(os.environ.get('REVENUE_SHARD_MIN', '20000'))
+REVENUE_SHARD_WORKERS = int(os.environ.get('REVENUE_SHARD_WORKERS', '0') or 0) or (os.cpu_count() or 1)
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+_in_pool_worker = False
+
+
+def _mark_pool_worker():
+    """Process-pool initializer: flags the worker so its calculations never shard again."""
+    global _in_pool_worker
+    _in_pool_worker = True
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """Process pool shared by sharded and batch calculations."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn rather than fork: the server process runs threads
+            _process_pool = ProcessPoolExecutor(max_workers=REVENUE_SHARD_WORKERS,
+                                                mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=_mark_pool_worker)
+        return _process_pool
+
+
+def _shard_count(reg: _CombinationRegistry) -> int:
+    # Pool workers (e.g. batch LOB calculations) never shard again. Checked with
+    # an explicit flag: the server itself is a spawn child under uvicorn's
+    # reload or --workers, so parent_process() cannot tell them apart.
+    if reg.size < REVENUE_SHARD_MIN or REVENUE_SHARD_WORKERS < 2 or _in_pool_worker:
+        return 1
+    return min(REVENUE_SHARD_WORKERS, reg.size)
+
+
+def _shard_payloads(payload: RevenueCalcPayload, reg: _CombinationRegistry, shards: int) -> List[RevenueCalcPayload]:
+    """Split a payload into `shards` payloads covering contiguous combination id ranges."""
+    bounds = [k * reg.size // shards for k in range(shards + 1)]
+    volumes: List[List[DynamicVolumeCombination]] = [[] for _ in range(shards)]
+    rates: List[List[RateEntry]] = [[] for _ in range(shards)]
+    for pos, cid in enumerate(reg.entry_ids):
+        volumes[bisect.bisect_right(bounds, cid) - 1].append(payload.volumes[pos])
+    for r in payload.rates:
+        cid = reg.id_for(r.dimensions)
+        if cid is not None:
+            rates[bisect.bisect_right(bounds, cid) - 1].append(r)
+    return [
+        payload.model_copy(update={
+            'volumes': volumes[k], 'rates': rates[k],
+            'opex_items': [], 'opex_rates': [], 'existing_opex_overrides': [],
+            'capex_items': [], 'capex_rates': [], 'existing_capex_overrides': [],
         })
-    # Cash shift for service items only (inventory items already have offset applied at recognition)
-    inventory_groups = {'First Time Inventory', 'Replacement Inventory'}
-    capex_cash_map: Dict[str, Dict[str,float]] = {}
-    for item in getattr(payload, 'capex_items', []) or []:
-        iname = item.get('name')
-        if not iname:
-            continue
-        igroup = item.get('group') or ''
-        item_cf_off = int(item.get('cashflow_offset_months') or 0)
-        is_advance_procurement = igroup in inventory_groups
-        item_cash_months = {m:0.0 for m in months}
-        combo_map = capex_combo_recog.get(iname, {})
-        for combo in payload.volumes:
-            if combo.included is False:
-                continue
-            key = _dim_key(combo.dimensions)
-            combo_cf_off = int(getattr(combo, 'capex_cashflow_offset_months', 0) or 0)
-            cf_off = combo_cf_off + item_cf_off
-            month_vals = combo_map.get(key)
-            if not month_vals:
-                continue
-            # For inventory items: offset already applied at recognition, copy directly
-            # For service items: apply delay offset (pay AFTER transaction)
-            if is_advance_procurement:
-                for m in months:
-                    item_cash_months[m] += round(month_vals[m], DECIMALS)
-            else:
-                for midx, m in enumerate(months):
-                    target_idx = midx + cf_off
-                    if target_idx >= len(months):
-                        continue
-                    tm = months[target_idx]
-                    item_cash_months[tm] += round(month_vals[m], DECIMALS)
-        capex_cash_map[iname] = item_cash_months
-    # Group CAPEX cashflow by group header
-    group_headers = [
-        'First Time Inventory',
-        'First Time Capex',
-        'Replacement Inventory',
-        'Replacement Capex',
-        'Capex People',
-        'ROW Deposit',
-        'Deposit Refund'
+        for k in range(shards)
     ]
-    capex_group_cash = {g: {m: 0.0 for m in months} for g in group_headers}
-    capex_group_total = {g: 0.0 for g in group_headers}
-    for item in getattr(payload, 'capex_items', []):
-        iname = item.get('name')
-        igroup = item.get('group')
-        if igroup in group_headers:
-            mv = capex_cash_map.get(iname, {})
-            for m in months:
-                capex_group_cash[igroup][m] += mv.get(m, 0.0)
-            capex_group_total[igroup] += sum(mv.values())
-    # Provide overall monthly CAPEX total as before
-    monthly_capex_totals = {m:0.0 for m in months}
-    for mv in capex_cash_map.values():
-        for m in months:
-            monthly_capex_totals[m] += mv[m]
-    monthly_capex_totals = {m: round(v, DECIMALS) for m,v in monthly_capex_totals.items()}
-    total_capex = round(sum(monthly_capex_totals.values()), DECIMALS)
-    # Convert to millions for display
-    monthly_net_cashflow = {m: round((cash_net_operating[m] - monthly_capex_totals[m]) / 1_000_000, 2) for m in months}
-    running_cum = 0.0
-    monthly_cum_net_cashflow: Dict[str,float] = {}
-    peak_funding = 0.0
-    for m in months:
-        running_cum += monthly_net_cashflow[m]
-        monthly_cum_net_cashflow[m] = round(running_cum, 2)
-        if running_cum < peak_funding:
-            peak_funding = running_cum
-    total_net_cashflow = round(sum(monthly_net_cashflow.values()), 2)
-    peak_funding = round(peak_funding, 2)
 
-    return RevenueCalcResponse(
-        fiscal_year=fy,
-        months=months,
-        rows=rows,
-        monthly_totals=monthly_totals,
-        monthly_recurring_totals=monthly_recurring_totals,
-        monthly_one_time_totals=monthly_one_time_totals,
-        monthly_passthrough_revenue=monthly_passthrough_revenue,
-        monthly_passthrough_expense=monthly_passthrough_expense,
-        total_revenue=grand_total,
-        total_passthrough_revenue=total_passthrough_revenue,
-        total_passthrough_expense=total_passthrough_expense,
-        opex_items=opex_items_results,
-        monthly_opex_totals=monthly_opex_totals,
-        total_opex=total_opex,
-        monthly_cash_recurring_inflow=cash_recurring,
-        monthly_cash_one_time_inflow=cash_one_time,
-        monthly_cash_passthrough_inflow=cash_passthrough,
-        monthly_cash_gross_inflow=cash_gross,
-        monthly_cash_outflow_items=cash_outflow_items_list,
-        monthly_cash_outflow_totals=cash_outflow_totals,
-        monthly_cash_net_operating=cash_net_operating,
-        total_cash_recurring_inflow=total_cash_rec,
-        total_cash_one_time_inflow=total_cash_one,
-        total_cash_gross_inflow=total_cash_gross,
-        total_cash_outflow=total_cash_outflow,
-        total_cash_net_operating=total_cash_net,
-        capex_items=capex_items_recognized,
-        monthly_capex_totals=monthly_capex_totals,
-        total_capex=total_capex,
-        monthly_net_cashflow=monthly_net_cashflow,
-        monthly_cum_net_cashflow=monthly_cum_net_cashflow,
-        peak_funding=peak_funding,
-        total_net_cashflow=total_net_cashflow,
-        capex_group_cash=capex_group_cash,
-        capex_group_total=capex_group_total
-    )
+
+def _revenue_rows_shard(payload: RevenueCalcPayload, engine: str):
+    """Process-pool entry point: revenue rows for one shard payload.
+
+    HTTPException does not pickle, so request errors come back as values.
+    """
+    try:
+        reg = _CombinationRegistry(payload)
+        cube = _VolumeCube(payload, reg)
+        return 'ok', _revenue_rows_for(engine)(payload, reg, cube)[0]
+    except HTTPException as e:
+        return 'error', e.status_code, e.detail
+
+
+def _revenue_rows_sharded(payload: RevenueCalcPayload, reg: _CombinationRegistry, engine: str, shards: int) -> List[RevenueRow]:
+    pool = _get_process_pool()
+    futures = [pool.submit(_revenue_rows_shard, p, engine) for p in _shard_payloads(payload, reg, shards)]
+    rows: List[RevenueRow] = []
+    # Results are consumed in shard order, so the first error is the one a serial run raises
+    for fut in futures:
+        result = fut.result()
+        if result[0] == 'error':
+            for other in futures:
+                other.cancel()
+            raise HTTPException(status_code=result[1], detail=result[2])
+        rows.extend(result[1])
+    return rows
+
+
+def _revenue_rows(payload: RevenueCalcPayload, reg: _CombinationRegistry, cube: _VolumeCube, engine: str) -> List[RevenueRow]:
+    """Revenue rows by combination id, sharded across the process pool for large plans."""
+    shards = _shard_count(reg)
+    if shards > 1:
+        return _revenue_rows_sharded(payload, reg, engine, shards)
+    return _revenue_rows_for(engine)(payload, reg, cube)[0]
+
+
+def _revenue_calc(payload: RevenueCalcPayload, spill: Optional[_CashSpill] = None) -> RevenueCalcResponse:
+    """Run the configured engine (payload.engine, else REVENUE_ENGINE).
+
+    Rows of unchanged combinations come from the row memo; large plans
+    (REVENUE_SHARD_MIN combinations or more) are sharded across the process
+    pool. The response is the same either way. `spill` carries cash across
+    fiscal years (see `_revenue_calc_finish`).
+    """
+    engine = (payload.engine or REVENUE_ENGINE).strip().lower()
+    reg = _CombinationRegistry(payload)
+    cube = _VolumeCube(payload, reg)
+    rows = _revenue_rows_memo(payload, reg, cube, engine)
+    return _revenue_calc_finish(payload, reg, cube, rows, *_revenue_totals(rows, cube.months), spill=spill)
 
 
 # Register handlers here: map the payload.lob value to a handler function.
 LOB_HANDLERS = {
-    'FTTH': _revenue_calc_core,
+    'FTTH': _revenue_calc,
     'Small Cell': _handler_small_cell,
     'Active': _handler_active,
     'SDU': _handler_sdu,
@@ -2193,6 +3847,805 @@ LOB_HANDLERS = {
 }
 
 
+# ------------------ Result Cache ------------------
+# /api/revenue/calculate is a pure function of its payload, so finished
+# responses are cached as JSON bytes keyed by a SHA-256 of the normalised
+# payload (JSON of the validated model, plus the LOB). The same
+# digest is the response ETag: a browser revalidating with If-None-Match gets
+# 304 Not Modified without any calculation, even after the entry was evicted.
+# Entries are bounded by count and total size (LRU) and expire after a TTL.
+
+RESULT_CACHE_ENTRIES = int(os.environ.get('RESULT_CACHE_ENTRIES', '64'))
+RESULT_CACHE_MAX_BYTES = int(float(os.environ.get('RESULT_CACHE_MAX_MB', '256')) * 1024 * 1024)
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', '600'))
+
+
+class _ResultCache:
+    """Thread-safe LRU of serialized responses with entry, byte and TTL bounds."""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, bytes, Dict[str, str]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Tuple[bytes, Dict[str, str]]]:
+        """Cached (body, headers) or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key: str, body: bytes, headers: Optional[Dict[str, str]] = None):
+        if self.max_entries <= 0 or len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic(), body, dict(headers or {}))
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key: str):
+        self._bytes -= len(self._entries.pop(key)[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._entries), 'bytes': self._bytes,
+                'max_entries': self.max_entries, 'max_bytes': self.max_bytes, 'ttl_seconds': self.ttl,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'expirations': self.expirations,
+            }
+
+
+_result_cache = _ResultCache(RESULT_CACHE_ENTRIES, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL)
+
+
+def _payload_digest(payload: RevenueCalcPayload) -> str:
+    """Content hash of a calculation request: LOB plus the validated payload as JSON.
+
+    Dumping the model normalises formatting, defaults and number types. Mapping
+    key order is kept on purpose: rows echo `dimensions` as sent, so payloads
+    differing only in key order do not have identical responses.
+    """
+    digest = hashlib.sha256((payload.lob or 'FTTH').encode('utf-8') + b'\n')
+    digest.update(payload.model_dump_json().encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+@app.get("/api/revenue/cache")
+def revenue_cache_stats():
+    return {**_result_cache.stats(), 'row_memo': _row_memo.stats()}
+
+
+@app.delete("/api/revenue/cache")
+def revenue_cache_clear():
+    _result_cache.clear()
+    _row_memo.clear()
+    return {**_result_cache.stats(), 'row_memo': _row_memo.stats()}
+
+
+# ------------------ Batch (multi-LOB) Calculation ------------------
+
+class BatchRevenueCalcPayload(BaseModel):
+    payloads: List[RevenueCalcPayload] = Field(..., description="One revenue payload per LOB (lob values must be unique); all share fiscal_year and months.")
+
+
+class ConsolidatedSummary(BaseModel):
+    fiscal_year: str
+    months: List[str]
+    lobs: List[str]
+    # P&L
+    monthly_revenue: Dict[str, float]
+    monthly_passthrough_revenue: Dict[str, float]
+    monthly_opex: Dict[str, float]
+    monthly_passthrough_expense: Dict[str, float]
+    monthly_ebitda: Dict[str, float] = Field(..., description="Revenue + passthrough revenue - opex - passthrough expense")
+    total_revenue: float
+    total_opex: float
+    total_ebitda: float
+    # Cashflow (millions, like the per-LOB cashflow figures)
+    monthly_cash_gross_inflow: Dict[str, float]
+    monthly_cash_outflow_totals: Dict[str, float]
+    monthly_cash_net_operating: Dict[str, float]
+    monthly_capex_totals: Dict[str, float]
+    monthly_net_cashflow: Dict[str, float]
+    monthly_cum_net_cashflow: Dict[str, float]
+    total_capex: float
+    total_net_cashflow: float
+    peak_funding: float = Field(..., description="Lowest company-level cumulative net cashflow (not the sum of per-LOB peaks)")
+
+
+class BatchRevenueCalcResponse(BaseModel):
+    results: Dict[str, RevenueCalcResponse]
+    consolidated: ConsolidatedSummary
+
+
+def _calculate_lob(payload: RevenueCalcPayload) -> RevenueCalcResponse:
+    lob = (getattr(payload, 'lob', None) or 'FTTH')
+    return LOB_HANDLERS.get(lob, _revenue_calc)(payload)
+
+
+def _calculate_lob_worker(payload: RevenueCalcPayload):
+    """Process-pool entry point for one LOB; request errors are returned, not raised."""
+    try:
+        return 'ok', _calculate_lob(payload)
+    except HTTPException as e:
+        return 'error', e.status_code, e.detail
+
+
+def _consolidate(fy: str, months: List[str], results: Dict[str, RevenueCalcResponse]) -> ConsolidatedSummary:
+    """Company-level P&L and cashflow: per-LOB figures summed month by month, in whole paise."""
+
+    def month_paise(field: str) -> np.ndarray:
+        values = [[(getattr(res, field) or {}).get(m, 0.0) for m in months] for res in results.values()]
+        return _paise_sum(_to_paise(values, rounded=True).reshape(len(values), len(months)), 0)
+
+    def by_month(paise: np.ndarray) -> Dict[str, float]:
+        return dict(zip(months, _rupees(paise).tolist()))
+
+    revenue = month_paise('monthly_totals')
+    pt_revenue = month_paise('monthly_passthrough_revenue')
+    opex = month_paise('monthly_opex_totals')
+    pt_expense = month_paise('monthly_passthrough_expense')
+    ebitda = revenue + pt_revenue - opex - pt_expense
+    capex = month_paise('monthly_capex_totals')
+    # Net cashflow is in millions; its whole hundredths are summed the same way
+    net_cashflow = month_paise('monthly_net_cashflow')
+    running_cum = 0.0
+    cum_net_cashflow: Dict[str, float] = {}
+    peak_funding = 0.0
+    for m, hundredths in zip(months, net_cashflow.tolist()):
+        running_cum += hundredths
+        cum_net_cashflow[m] = running_cum / 100
+        if running_cum < peak_funding:
+            peak_funding = running_cum
+    return ConsolidatedSummary(
+        fiscal_year=fy,
+        months=months,
+        lobs=list(results.keys()),
+        monthly_revenue=by_month(revenue),
+        monthly_passthrough_revenue=by_month(pt_revenue),
+        monthly_opex=by_month(opex),
+        monthly_passthrough_expense=by_month(pt_expense),
+        monthly_ebitda=by_month(ebitda),
+        total_revenue=_exact_total([res.total_revenue for res in results.values()]),
+        total_opex=_exact_total([res.total_opex for res in results.values()]),
+        total_ebitda=float(_rupees(_paise_sum(ebitda))),
+        monthly_cash_gross_inflow=by_month(month_paise('monthly_cash_gross_inflow')),
+        monthly_cash_outflow_totals=by_month(month_paise('monthly_cash_outflow_totals')),
+        monthly_cash_net_operating=by_month(month_paise('monthly_cash_net_operating')),
+        monthly_capex_totals=by_month(capex),
+        monthly_net_cashflow=by_month(net_cashflow),
+        monthly_cum_net_cashflow=cum_net_cashflow,
+        total_capex=float(_rupees(_paise_sum(capex))),
+        total_net_cashflow=float(_rupees(_paise_sum(net_cashflow))),
+        peak_funding=peak_funding / 100,
+    )
+
+
+@app.post("/api/revenue/calculate/batch", response_model=BatchRevenueCalcResponse)
+@calc_endpoint
+def revenue_calculate_batch(payload: BatchRevenueCalcPayload):
+    """Calculate several LOBs in one request and consolidate them.
+
+    LOBs run concurrently on the process pool (REVENUE_SHARD_WORKERS) when it
+    has more than one worker, otherwise one after another. Each result is
+    exactly what /api/revenue/calculate returns for that payload.
+    """
+    if not payload.payloads:
+        raise HTTPException(status_code=400, detail="No payloads supplied")
+    lobs = [(p.lob or 'FTTH') for p in payload.payloads]
+    if len(set(lobs)) != len(lobs):
+        raise HTTPException(status_code=400, detail="Each LOB may appear only once in a batch")
+    fy = payload.payloads[0].fiscal_year
+    months = list(payload.payloads[0].months or FISCAL_MONTHS)
+    for p in payload.payloads[1:]:
+        if p.fiscal_year != fy or list(p.months or FISCAL_MONTHS) != months:
+            raise HTTPException(status_code=400, detail="All payloads in a batch must share fiscal_year and months")
+    results: Dict[str, RevenueCalcResponse] = {}
+    if len(payload.payloads) > 1 and REVENUE_SHARD_WORKERS > 1:
+        pool = _get_process_pool()
+        futures = [pool.submit(_calculate_lob_worker, p) for p in payload.payloads]
+        for lob, fut in zip(lobs, futures):
+            result = fut.result()
+            if result[0] == 'error':
+                for other in futures:
+                    other.cancel()
+                raise HTTPException(status_code=result[1], detail=f"{lob}: {result[2]}")
+            results[lob] = result[1]
+    else:
+        for lob, p in zip(lobs, payload.payloads):
+            try:
+                results[lob] = _calculate_lob(p)
+            except HTTPException as e:
+                raise HTTPException(status_code=e.status_code, detail=f"{lob}: {e.detail}")
+    return _json_response(BatchRevenueCalcResponse(results=results, consolidated=_consolidate(fy, months, results)))
+
+
+
+# ------------------ Multi-year Horizon ------------------
+
+class HorizonCalcPayload(BaseModel):
+    payload: RevenueCalcPayload = Field(..., description="Plan for the first year of the horizon (payload.fiscal_year).")
+    fiscal_years: List[str] = Field(default_factory=list, description="Fiscal years to compute, starting with payload.fiscal_year. Alternative to `years`.")
+    years: Optional[int] = Field(default=None, description="Number of consecutive fiscal years; labels continue payload.fiscal_year (FY25-26, FY26-27, ...).")
+
+
+class HorizonYearSummary(BaseModel):
+    fiscal_year: str
+    total_revenue: float
+    total_opex: float
+    total_capex: float
+    total_net_cashflow: float
+    cum_net_cashflow: float = Field(..., description="Cumulative net cashflow since the start of the horizon, at year end")
+    peak_funding: float = Field(..., description="Lowest cumulative net cashflow since the start of the horizon")
+
+
+class HorizonCalcResponse(BaseModel):
+    fiscal_years: List[str]
+    results: Dict[str, RevenueCalcResponse]
+    summary: List[HorizonYearSummary]
+    monthly_cum_net_cashflow: Dict[str, Dict[str, float]] = Field(default_factory=dict, description="fiscal year -> month -> cumulative net cashflow since the start of the horizon")
+    total_revenue: float = 0.0
+    total_opex: float = 0.0
+    total_capex: float = 0.0
+    total_net_cashflow: float = 0.0
+    peak_funding: float = 0.0
+
+
+def _next_fiscal_year(fy: str) -> str:
+    match = re.fullmatch(r'FY(\d{2})-(\d{2})', fy.strip())
+    if not match:
+        raise HTTPException(status_code=400, detail=f"Cannot derive the fiscal year after '{fy}'; pass fiscal_years explicitly")
+    start = int(match.group(2))
+    return f"FY{start:02d}-{(start + 1) % 100:02d}"
+
+
+def _horizon_year_payload(payload: RevenueCalcPayload, prev: RevenueCalcPayload, fy: str) -> RevenueCalcPayload:
+    """Payload for the year after `prev`: exit volumes carried forward, prev year as base year.
+
+    A combination's exit volume at the end of `prev` is its base exit volume
+    plus that year's volumes, unless the plan already states it. Uploaded
+    existing opex/CAPEX overrides only apply to the year they were given for.
+    """
+    prev_fy = prev.fiscal_year
+    months = prev.months or FISCAL_MONTHS
+    volumes = []
+    for combo, prev_combo in zip(payload.volumes, prev.volumes):
+        exit_volumes = dict(combo.exit_volumes or {})
+        if prev_fy not in exit_volumes:
+            base = float((prev_combo.exit_volumes or {}).get(prev.base_exit_year, 0) or 0) if prev.base_exit_year else 0.0
+            year_vols = combo.volumes.get(prev_fy, {})
+            for m in months:
+                base += float(year_vols.get(m, 0) or 0)
+            exit_volumes[prev_fy] = base
+        volumes.append(combo.model_copy(update={'exit_volumes': exit_volumes}))
+    return payload.model_copy(update={
+        'fiscal_year': fy,
+        'base_exit_year': prev_fy,
+        'volumes': volumes,
+        'existing_opex_overrides': [ov for ov in payload.existing_opex_overrides or [] if isinstance(ov, dict) and ov.get('fiscal_year') == prev_fy],
+        'existing_capex_overrides': [ov for ov in payload.existing_capex_overrides or [] if isinstance(ov, dict) and ov.get('fiscal_year') == prev_fy],
+    })
+
+
+@app.post("/api/revenue/horizon", response_model=HorizonCalcResponse)
+@calc_endpoint
+def revenue_horizon(payload: HorizonCalcPayload):
+    """Calculate consecutive fiscal years in one request.
+
+    Each year is a regular calculation of the same plan, with exit volumes
+    carried forward from the previous year. Cash shifted past March (cashflow,
+    opex and CAPEX offsets) lands in the following year instead of being
+    dropped; cash shifted past the last year is dropped as before.
+    """
+    base = payload.payload
+    fiscal_years = list(payload.fiscal_years)
+    if not fiscal_years:
+        fiscal_years = [base.fiscal_year]
+        for _ in range(max((payload.years or 1) - 1, 0)):
+            fiscal_years.append(_next_fiscal_year(fiscal_years[-1]))
+    if fiscal_years[0] != base.fiscal_year:
+        raise HTTPException(status_code=400, detail="fiscal_years must start with payload.fiscal_year")
+    if len(set(fiscal_years)) != len(fiscal_years):
+        raise HTTPException(status_code=400, detail="fiscal_years must be unique")
+
+    results: Dict[str, RevenueCalcResponse] = {}
+    summary: List[HorizonYearSummary] = []
+    monthly_cum: Dict[str, Dict[str, float]] = {}
+    spill = _CashSpill()
+    year_payload = base
+    running_cum = 0.0
+    peak_funding = 0.0
+    for k, fy in enumerate(fiscal_years):
+        if k:
+            year_payload = _horizon_year_payload(base, year_payload, fy)
+        # LOB handlers only normalise payload.lob, so the engine is called directly
+        res = _revenue_calc(year_payload, spill=spill)
+        spill = spill.next_year()
+        results[fy] = res
+        monthly_cum[fy] = {}
+        # Net cashflow (millions) accumulated in whole hundredths, exact across years
+        for m, hundredths in zip(res.months, _to_paise([res.monthly_net_cashflow.get(m, 0.0) for m in res.months], rounded=True).tolist()):
+            running_cum += hundredths
+            monthly_cum[fy][m] = running_cum / 100
+            if running_cum < peak_funding:
+                peak_funding = running_cum
+        summary.append(HorizonYearSummary(
+            fiscal_year=fy,
+            total_revenue=res.total_revenue,
+            total_opex=res.total_opex,
+            total_capex=res.total_capex,
+            total_net_cashflow=res.total_net_cashflow,
+            cum_net_cashflow=running_cum / 100,
+            peak_funding=peak_funding / 100,
+        ))
+    return _json_response(HorizonCalcResponse(
+        fiscal_years=fiscal_years,
+        results=results,
+        summary=summary,
+        monthly_cum_net_cashflow=monthly_cum,
+        total_revenue=_exact_total([s.total_revenue for s in summary]),
+        total_opex=_exact_total([s.total_opex for s in summary]),
+        total_capex=_exact_total([s.total_capex for s in summary]),
+        total_net_cashflow=_exact_total([s.total_net_cashflow for s in summary]),
+        peak_funding=peak_funding / 100,
+    ))
+
+
+# ------------------ Scenario Sweep ------------------
+
+SCENARIO_MAX = int(os.environ.get('SCENARIO_MAX', '500'))
+
+
+class ScenarioGrid(BaseModel):
+    """Values to sweep; every combination of them is one scenario (empty list = as planned)."""
+    recurring_rate_multipliers: List[float] = Field(default_factory=lambda: [1.0], description="Applied to fresh and existing recurring rates")
+    one_time_rate_multipliers: List[float] = Field(default_factory=lambda: [1.0], description="Applied to fresh and existing one-time rates")
+    opex_rate_multipliers: List[float] = Field(default_factory=lambda: [1.0])
+    capex_rate_multipliers: List[float] = Field(default_factory=lambda: [1.0])
+    recurring_offset_months: List[Optional[int]] = Field(default_factory=lambda: [None], description="Recurring revenue offset for every combination (None = as planned)")
+    cashflow_offset_months: List[Optional[int]] = Field(default_factory=lambda: [None], description="Cashflow offset for every combination, replacing recurring/one-time specific ones (None = as planned)")
+    capex_offset_months: List[Optional[int]] = Field(default_factory=lambda: [None], description="cashflow_offset_months for every CAPEX item (None = as planned)")
+
+
+class ScenarioSweepPayload(BaseModel):
+    payload: RevenueCalcPayload
+    grid: ScenarioGrid = Field(default_factory=ScenarioGrid)
+
+
+class ScenarioResult(BaseModel):
+    parameters: Dict[str, Any]
+    total_revenue: float
+    total_opex: float
+    total_capex: float
+    peak_funding: float
+    total_net_cashflow: float
+
+
+class ScenarioSweepResponse(BaseModel):
+    fiscal_year: str
+    scenarios: List[ScenarioResult]
+
+
+def _scale_rate_entries(rates: List[RateEntry], recurring: float, one_time: float) -> List[RateEntry]:
+    if recurring == 1.0 and one_time == 1.0:
+        return rates
+    return [r.model_copy(update={
+        'recurring_rate': r.recurring_rate * recurring,
+        'existing_recurring_rate': r.existing_recurring_rate * recurring,
+        'one_time_rate': r.one_time_rate * one_time,
+        'existing_one_time_rate': r.existing_one_time_rate * one_time,
+    }) for r in rates]
+
+
+def _scale_item_rates(entries: List[Dict[str, Any]], multiplier: float) -> List[Dict[str, Any]]:
+    if multiplier == 1.0:
+        return entries
+    return [{**e,
+             'existing_rate': float(e.get('existing_rate') or 0) * multiplier,
+             'fresh_rate': float(e.get('fresh_rate') or 0) * multiplier} for e in entries or []]
+
+
+@app.post("/api/revenue/scenarios", response_model=ScenarioSweepResponse)
+@calc_endpoint
+def revenue_scenarios(payload: ScenarioSweepPayload):
+    """Headline metrics for a grid of rate multipliers and offset overrides.
+
+    The combination registry and volume cube are built once and shared by all
+    scenarios; each scenario only re-runs the rate/offset dependent stages.
+    """
+    base = payload.payload
+    grid = payload.grid
+    axes = {
+        'recurring_rate_multiplier': grid.recurring_rate_multipliers or [1.0],
+        'one_time_rate_multiplier': grid.one_time_rate_multipliers or [1.0],
+        'opex_rate_multiplier': grid.opex_rate_multipliers or [1.0],
+        'capex_rate_multiplier': grid.capex_rate_multipliers or [1.0],
+        'recurring_offset_months': grid.recurring_offset_months or [None],
+        'cashflow_offset_months': grid.cashflow_offset_months or [None],
+        'capex_offset_months': grid.capex_offset_months or [None],
+    }
+    count = math.prod(len(v) for v in axes.values())
+    if count > SCENARIO_MAX:
+        raise HTTPException(status_code=400, detail=f"Grid has {count} scenarios; the limit is {SCENARIO_MAX}")
+    for name in ('recurring_offset_months', 'cashflow_offset_months', 'capex_offset_months'):
+        if any(v is not None and v < 0 for v in axes[name]):
+            raise HTTPException(status_code=400, detail=f"{name} must be >= 0")
+
+    engine = (base.engine or REVENUE_ENGINE).strip().lower()
+    reg = _CombinationRegistry(base)
+    cube = _VolumeCube(base, reg)
+    scenarios: List[ScenarioResult] = []
+    for values in itertools.product(*axes.values()):
+        params = dict(zip(axes.keys(), values))
+        scen_payload = base.model_copy(update={
+            'rates': _scale_rate_entries(base.rates, params['recurring_rate_multiplier'], params['one_time_rate_multiplier']),
+            'opex_rates': _scale_item_rates(base.opex_rates, params['opex_rate_multiplier']),
+            'capex_rates': _scale_item_rates(base.capex_rates, params['capex_rate_multiplier']),
+            'capex_items': base.capex_items if params['capex_offset_months'] is None else
+                           [{**item, 'cashflow_offset_months': params['capex_offset_months']} for item in base.capex_items or []],
+        })
+        scen_reg = copy.copy(reg)
+        if params['recurring_offset_months'] is not None:
+            scen_reg.recurring_offset = [params['recurring_offset_months']] * reg.size
+        if params['cashflow_offset_months'] is not None:
+            scen_reg.cashflow_offset = [params['cashflow_offset_months']] * reg.size
+            scen_reg.cashflow_rec_offset = [params['cashflow_offset_months']] * reg.size
+            scen_reg.cashflow_ot_offset = [params['cashflow_offset_months']] * reg.size
+        res = _revenue_calc_finish(scen_payload, scen_reg, cube, *_revenue_rows_for(engine)(scen_payload, scen_reg, cube))
+        scenarios.append(ScenarioResult(
+            parameters=params,
+            total_revenue=res.total_revenue,
+            total_opex=res.total_opex,
+            total_capex=res.total_capex,
+            peak_funding=res.peak_funding,
+            total_net_cashflow=res.total_net_cashflow,
+        ))
+    return ScenarioSweepResponse(fiscal_year=base.fiscal_year, scenarios=scenarios)
+
+
+# ------------------ Calculation Sessions ------------------
+# A session keeps a plan server-side together with its combination registry,
+# volume cube and finished revenue rows. Deltas name combinations by their
+# dimensions; only those combinations are re-indexed and get new revenue rows,
+# which replace their old rows in place. Totals, opex, cashflow and CAPEX are
+# then aggregated again from the per-combination state in combination order,
+# so a session response is identical to a full calculation of the edited plan.
+# Sessions idle for CALC_SESSION_TTL seconds expire; beyond CALC_SESSION_MAX
+# the least recently used session is dropped.
+
+CALC_SESSION_MAX = int(os.environ.get('CALC_SESSION_MAX', '32'))
+CALC_SESSION_TTL = float(os.environ.get('CALC_SESSION_TTL', '1800'))
+COMBINATION_OFFSET_FIELDS = (
+    'fresh_offset_months', 'recurring_offset_months', 'one_time_offset_months',
+    'cashflow_offset_months', 'cashflow_recurring_offset_months', 'cashflow_one_time_offset_months',
+    'capex_offset_months', 'capex_cashflow_offset_months',
+)
+RATE_ENTRY_FIELDS = ('recurring_rate', 'one_time_rate', 'existing_recurring_rate', 'existing_one_time_rate')
+ITEM_RATE_FIELDS = ('existing_rate', 'fresh_rate')
+
+
+class CombinationDelta(BaseModel):
+    """Changes to one planned combination; fields left empty are kept."""
+    dimensions: Dict[str, str]
+    volumes: Dict[str, float] = Field(default_factory=dict, description="Planning-year volumes to replace {Month: volume}")
+    exit_volume: Optional[float] = Field(default=None, description="Exit volume of payload.base_exit_year")
+    included: Optional[bool] = None
+    offsets: Dict[str, Optional[int]] = Field(default_factory=dict, description="Combination offsets to set, e.g. {'recurring_offset_months': 2}")
+    rates: Dict[str, float] = Field(default_factory=dict, description="Revenue rates to set, e.g. {'recurring_rate': 120}")
+    opex_rates: Dict[str, Dict[str, float]] = Field(default_factory=dict, description="item -> {existing_rate, fresh_rate}")
+    capex_rates: Dict[str, Dict[str, float]] = Field(default_factory=dict, description="item -> {existing_rate, fresh_rate}")
+
+
+class CalcSessionDeltaPayload(BaseModel):
+    changes: List[CombinationDelta]
+
+
+class CalcSessionResponse(BaseModel):
+    session_id: str
+    recalculated: int = Field(description="Combinations whose revenue rows were recomputed")
+    result: RevenueCalcResponse
+
+
+class _CalcSession:
+    """Server-side state of one session: the plan and its per-combination results."""
+
+    def __init__(self, payload: RevenueCalcPayload):
+        self.lock = threading.Lock()
+        self.touched = time.monotonic()
+        self.payload = payload
+        self.engine = (payload.engine or REVENUE_ENGINE).strip().lower()
+        self.reg = reg = _CombinationRegistry(payload)
+        self.cube = _VolumeCube(payload, reg)
+        # Payload positions of every occurrence, and the winning rate entry, per combination id
+        self.positions: Dict[int, List[int]] = {}
+        for pos, cid in enumerate(reg.entry_ids):
+            self.positions.setdefault(cid, []).append(pos)
+        self.rate_pos: Dict[int, int] = {}
+        for i, r in enumerate(payload.rates):
+            cid = reg.id_for(r.dimensions)
+            if cid is not None:
+                self.rate_pos[cid] = i
+        self.opex_rate_pos = self._item_rate_positions(payload.opex_rates)
+        self.capex_rate_pos = self._item_rate_positions(payload.capex_rates)
+        self.rows = _revenue_rows_memo(payload, reg, self.cube, self.engine)
+
+    def _item_rate_positions(self, entries: List[Dict[str, Any]]) -> Dict[Tuple[str, int], int]:
+        out: Dict[Tuple[str, int], int] = {}
+        for i, entry in enumerate(entries or []):
+            cid = self.reg.id_for(entry.get('dimensions') or {}) if entry.get('item') else None
+            if cid is not None:
+                out[(entry['item'], cid)] = i
+        return out
+
+    def result(self) -> RevenueCalcResponse:
+        return _revenue_calc_finish(self.payload, self.reg, self.cube, self.rows,
+                                    *_revenue_totals(self.rows, self.cube.months))
+
+    def _validate(self, change: CombinationDelta) -> int:
+        cid = self.reg.id_for(change.dimensions)
+        if cid is None:
+            raise HTTPException(status_code=400, detail=f"Combination not in session plan: {_dim_key(change.dimensions)}")
+        unknown_months = set(change.volumes) - set(self.cube.months)
+        if unknown_months:
+            raise HTTPException(status_code=400, detail=f"Unknown months: {', '.join(sorted(unknown_months))}")
+        if change.exit_volume is not None and not self.payload.base_exit_year:
+            raise HTTPException(status_code=400, detail="exit_volume requires payload.base_exit_year")
+        for name, value in change.offsets.items():
+            if name not in COMBINATION_OFFSET_FIELDS:
+                raise HTTPException(status_code=400, detail=f"Unknown offset field: {name}")
+            if value is not None and value < 0:
+                raise HTTPException(status_code=400, detail=f"{name} must be >= 0")
+        for name in change.rates:
+            if name not in RATE_ENTRY_FIELDS:
+                raise HTTPException(status_code=400, detail=f"Unknown rate field: {name}")
+        for item_rates in (change.opex_rates, change.capex_rates):
+            for item, fields in item_rates.items():
+                for name in fields:
+                    if name not in ITEM_RATE_FIELDS:
+                        raise HTTPException(status_code=400, detail=f"Unknown rate field for {item}: {name}")
+        return cid
+
+    def apply(self, changes: List[CombinationDelta]) -> int:
+        """Apply deltas and recompute the revenue rows of the changed combinations.
+
+        Every occurrence of a combination receives the change. New values are
+        staged and the affected rows computed before anything is committed, so a
+        failing delta leaves the session unchanged. Returns the number of
+        recomputed combinations.
+        """
+        payload, reg = self.payload, self.reg
+        fy = payload.fiscal_year
+        cids = [self._validate(change) for change in changes]
+        volumes: Dict[int, DynamicVolumeCombination] = {}
+        rates: Dict[int, RateEntry] = {}
+        item_rates: Dict[Tuple[str, Tuple[str, int]], Dict[str, Any]] = {}
+        for cid, change in zip(cids, changes):
+            for pos in self.positions[cid]:
+                combo = volumes.get(pos, payload.volumes[pos])
+                update: Dict[str, Any] = dict(change.offsets)
+                if change.volumes:
+                    update['volumes'] = {**combo.volumes, fy: {**combo.volumes.get(fy, {}), **change.volumes}}
+                if change.exit_volume is not None:
+                    update['exit_volumes'] = {**combo.exit_volumes, payload.base_exit_year: change.exit_volume}
+                if change.included is not None:
+                    update['included'] = change.included
+                volumes[pos] = combo.model_copy(update=update)
+            if change.rates:
+                current = rates.get(cid)
+                if current is None and cid in self.rate_pos:
+                    current = payload.rates[self.rate_pos[cid]]
+                if current is None:
+                    current = RateEntry(dimensions=dict(change.dimensions))
+                rates[cid] = current.model_copy(update=change.rates)
+            for kind, changed in (('opex', change.opex_rates), ('capex', change.capex_rates)):
+                entries = payload.opex_rates if kind == 'opex' else payload.capex_rates
+                positions = self.opex_rate_pos if kind == 'opex' else self.capex_rate_pos
+                for item, fields in changed.items():
+                    current = item_rates.get((kind, (item, cid)))
+                    if current is None and (item, cid) in positions:
+                        current = entries[positions[(item, cid)]]
+                    if current is None:
+                        current = {'dimensions': dict(change.dimensions), 'item': item}
+                    item_rates[(kind, (item, cid))] = {**current, **fields}
+
+        ids = sorted(set(cids))
+        positions = sorted(pos for cid in ids for pos in self.positions[cid])
+        sub = payload.model_copy(update={
+            'volumes': [volumes.get(pos, payload.volumes[pos]) for pos in positions],
+            'rates': [rates[cid] if cid in rates else payload.rates[self.rate_pos[cid]]
+                      for cid in ids if cid in rates or cid in self.rate_pos],
+            'opex_items': [], 'opex_rates': [], 'existing_opex_overrides': [],
+            'capex_items': [], 'capex_rates': [], 'existing_capex_overrides': [],
+        })
+        sub_reg = _CombinationRegistry(sub)
+        sub_cube = _VolumeCube(sub, sub_reg)
+        sub_rows = _revenue_rows_for(self.engine)(sub, sub_reg, sub_cube)[0]
+
+        for pos, combo in volumes.items():
+            payload.volumes[pos] = combo
+        for cid, entry in rates.items():
+            if cid in self.rate_pos:
+                payload.rates[self.rate_pos[cid]] = entry
+            else:
+                self.rate_pos[cid] = len(payload.rates)
+                payload.rates.append(entry)
+        for (kind, key), entry in item_rates.items():
+            entries = payload.opex_rates if kind == 'opex' else payload.capex_rates
+            index = self.opex_rate_pos if kind == 'opex' else self.capex_rate_pos
+            if key in index:
+                entries[index[key]] = entry
+            else:
+                index[key] = len(entries)
+                entries.append(entry)
+        # Sub-plan ids follow first appearance, which is id order here as well
+        sub_ids = [reg.key_to_id[key] for key in sub_reg.keys]
+        reg.replace(sub_reg, sub_ids, positions)
+        self.cube.replace(sub_cube, sub_ids, positions)
+        for k, cid in enumerate(sub_ids):
+            self.rows[cid] = sub_rows[k]
+        return len(sub_ids)
+
+
+_calc_sessions: "OrderedDict[str, _CalcSession]" = OrderedDict()
+_calc_sessions_lock = threading.Lock()
+
+
+def _expire_sessions(now: float):
+    while _calc_sessions:
+        sid, session = next(iter(_calc_sessions.items()))
+        if len(_calc_sessions) <= CALC_SESSION_MAX and now - session.touched <= CALC_SESSION_TTL:
+            break
+        del _calc_sessions[sid]
+
+
+def _get_session(session_id: str) -> _CalcSession:
+    now = time.monotonic()
+    with _calc_sessions_lock:
+        _expire_sessions(now)
+        session = _calc_sessions.get(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Calculation session not found or expired")
+        session.touched = now
+        _calc_sessions.move_to_end(session_id)
+    return session
+
+
+@app.post("/api/revenue/session", response_model=CalcSessionResponse)
+@calc_endpoint
+def revenue_session_create(payload: RevenueCalcPayload):
+    """Calculate a plan and keep it server-side for incremental updates."""
+    session = _CalcSession(payload)
+    result = session.result()
+    session_id = uuid.uuid4().hex
+    with _calc_sessions_lock:
+        _calc_sessions[session_id] = session
+        _expire_sessions(time.monotonic())
+    return _json_response(CalcSessionResponse(session_id=session_id, recalculated=session.reg.size, result=result))
+
+
+@app.post("/api/revenue/session/{session_id}/delta", response_model=CalcSessionResponse)
+@calc_endpoint
+def revenue_session_delta(session_id: str, payload: CalcSessionDeltaPayload):
+    """Apply volume, rate and offset changes for specific combinations and return the updated result."""
+    session = _get_session(session_id)
+    with session.lock:
+        recalculated = session.apply(payload.changes)
+        result = session.result()
+    return _json_response(CalcSessionResponse(session_id=session_id, recalculated=recalculated, result=result))
+
+
+@app.delete("/api/revenue/session/{session_id}")
+def revenue_session_delete(session_id: str):
+    with _calc_sessions_lock:
+        if _calc_sessions.pop(session_id, None) is None:
+            raise HTTPException(status_code=404, detail="Calculation session not found or expired")
+    return {"message": "Session closed.", "session_id": session_id}
+
+
+# ------------------ Streaming (NDJSON) Calculation ------------------
+# /api/revenue/calculate/stream computes the plan in chunks of
+# REVENUE_STREAM_CHUNK combinations and writes each chunk's rows as soon as
+# they are ready, one JSON object per line ({"type": "row", ...RevenueRow}).
+# A last line ({"type": "summary", ...}) carries every other response field.
+# Only the cashflow series of written rows are kept for the summary, so
+# memory does not grow with the full response. Errors in the first chunk are
+# regular HTTP errors; later ones end the stream with an
+# {"type": "error", "status_code": ..., "detail": ...} line.
+
+REVENUE_STREAM_CHUNK = max(int(os.environ.get('REVENUE_STREAM_CHUNK', '1000')), 1)
+
+
+class _CashflowRow:
+    """What the cashflow stage of `_revenue_calc_finish` reads from a row already streamed."""
+    __slots__ = ('dimensions', 'monthly_cashflow_recurring', 'monthly_cashflow_one_time')
+
+    def __init__(self, row: RevenueRow):
+        self.dimensions = row.dimensions
+        self.monthly_cashflow_recurring = row.monthly_cashflow_recurring
+        self.monthly_cashflow_one_time = row.monthly_cashflow_one_time
+
+
+def _json_line(data: Any) -> bytes:
+    return _json_bytes(data) + b'\n'
+
+
+def _revenue_rows_chunk(chunk: RevenueCalcPayload, engine: str) -> List[RevenueRow]:
+    reg = _CombinationRegistry(chunk)
+    return _revenue_rows_for(engine)(chunk, reg, _VolumeCube(chunk, reg))[0]
+
+
+def _revenue_ndjson(payload: RevenueCalcPayload, reg: _CombinationRegistry, cube: _VolumeCube, engine: str,
+                    chunks: List[RevenueCalcPayload], first_rows: List[RevenueRow]):
+    totals = _RevenueTotals(cube.months)
+    cash_rows: List[_CashflowRow] = []
+    # The endpoint's calculation slot ends when it returns the response, so the stream takes its own
+    with _calc_slots:
+        for k, chunk in enumerate(chunks):
+            try:
+                rows = first_rows if k == 0 else _revenue_rows_chunk(chunk, engine)
+            except HTTPException as e:
+                yield _json_line({'type': 'error', 'status_code': e.status_code, 'detail': e.detail})
+                return
+            totals.add(rows)
+            cash_rows.extend(_CashflowRow(row) for row in rows)
+            yield b''.join(_json_line({'type': 'row', **_plain(row)}) for row in rows)
+        first_rows = rows = None
+        try:
+            res = _revenue_calc_finish(payload, reg, cube, cash_rows, *totals.result(), include_rows=False)
+        except HTTPException as e:
+            yield _json_line({'type': 'error', 'status_code': e.status_code, 'detail': e.detail})
+            return
+        summary = _plain(res)
+        summary.pop('rows')
+        yield _json_line({'type': 'summary', **summary})
+
+
+@app.post("/api/revenue/calculate/stream")
+@calc_endpoint
+def revenue_calculate_stream(payload: RevenueCalcPayload):
+    """/api/revenue/calculate as NDJSON: rows as they are computed, then a summary line."""
+    # LOB handlers only normalise payload.lob, so the engine is called directly
+    engine = (payload.engine or REVENUE_ENGINE).strip().lower()
+    reg = _CombinationRegistry(payload)
+    cube = _VolumeCube(payload, reg)
+    chunks = _shard_payloads(payload, reg, max(-(-reg.size // REVENUE_STREAM_CHUNK), 1))
+    first_rows = _revenue_rows_chunk(chunks[0], engine)
+    return StreamingResponse(_revenue_ndjson(payload, reg, cube, engine, chunks, first_rows),
+                             media_type='application/x-ndjson')
+
+
 if os.path.exists(frontend_dist_path):
     app.mount("/", StaticFiles(directory=frontend_dist_path, html=True), name="static")
 
@@ -0,0 +1,128 @@
+import requests
+import json
+import sys
+
+BASE_URL = "http://localhost:8000"
+
+# Same payloads through both engines; responses must be identical
+payload = {
+    "lob": "Dark Fiber",
+    "fiscal_year": "FY25-26",
+    "base_exit_year": "FY24-25",
+    "volumes": [
+        {
+            "dimensions": {"customer": "TestCust", "circle": "MH", "type": "New", "pairs": "4"},
+            "volumes": {"FY25-26": {"Apr": 10, "May": 0, "Jun": 25.5, "Jul": 0, "Aug": 3, "Sep": 0, "Oct": 0, "Nov": 7, "Dec": 0, "Jan": 0, "Feb": 1, "Mar": 0}},
+            "exit_volumes": {"FY24-25": 120},
+            "recurring_offset_months": 1,
+            "one_time_offset_months": 2,
+            "cashflow_recurring_offset_months": 1,
+            "included": True
+        },
+        {
+            "dimensions": {"customer": "TestCust", "circle": "DL", "type": "Decom"},
+            "volumes": {"FY25-26": {"Apr": 0, "May": 4, "Jun": 0, "Jul": 0, "Aug": 0, "Sep": 2, "Oct": 0, "Nov": 0, "Dec": 0, "Jan": 0, "Feb": 0, "Mar": 0}},
+            "exit_volumes": {"FY24-25": 30},
+            "included": True
+        }
+    ],
+    "rates": [
+        {"dimensions": {"customer": "TestCust", "circle": "MH", "type": "New", "pairs": "4"},
+         "recurring_rate": 1234.57, "one_time_rate": 45000.0, "existing_recurring_rate": 999.99, "existing_one_time_rate": 30000.0},
+        {"dimensions": {"customer": "TestCust", "circle": "DL", "type": "Decom"},
+         "recurring_rate": 800.0, "one_time_rate": 0.0, "existing_recurring_rate": 800.0, "existing_one_time_rate": 0.0}
+    ],
+    "opex_items": [{"name": "Rent", "fresh_offset_months": 1, "cashflow_offset_months": 1}],
+    "opex_rates": [{"dimensions": {"customer": "TestCust", "circle": "MH", "type": "New", "pairs": "4"}, "item": "Rent", "existing_rate": 10.0, "fresh_rate": 12.5}],
+    "capex_items": [{"name": "Fiber - First Time", "group": "First Time Inventory", "type": "first_time", "cashflow_offset_months": 1, "is_refund": False}],
+    "capex_rates": [{"dimensions": {"customer": "TestCust", "circle": "MH", "type": "New", "pairs": "4"}, "item": "Fiber - First Time", "existing_rate": 0.0, "fresh_rate": 5000.0}]
+}
+
+# Small Cell: custom formulas, Rent/Electricity passthrough for HPSC and LITE SITE,
+# a duplicated combination (later volumes win) and an excluded one
+hpsc = {"customer": "TestCust", "Site Type": "HPSC", "type": "RFAI"}
+lite = {"customer": "TestCust", "Site Type": "LITE SITE", "type": "RFAI"}
+macro = {"customer": "OtherCust", "Site Type": "Macro", "type": "Upgrade"}
+small_cell_payload = {
+    "lob": "SMALL CELL",
+    "fiscal_year": "FY25-26",
+    "base_exit_year": "FY24-25",
+    "formula_recurring": "max(volume, 5) * recurring_rate * 1.1",
+    "formula_one_time": "total_volume_year * one_time_rate / 3",
+    "volumes": [
+        {
+            "dimensions": hpsc,
+            "volumes": {"FY25-26": {"Apr": 3, "May": 0, "Jun": 12, "Jul": 0, "Aug": 0, "Sep": 4, "Oct": 0, "Nov": 0, "Dec": 1, "Jan": 0, "Feb": 0, "Mar": 2}},
+            "exit_volumes": {"FY24-25": 40},
+            "recurring_offset_months": 2,
+            "cashflow_offset_months": 1,
+            "included": True
+        },
+        {
+            "dimensions": lite,
+            "volumes": {"FY25-26": {"Apr": 0, "May": 7, "Jun": 0, "Jul": 0, "Aug": 5, "Sep": 0, "Oct": 0, "Nov": 3, "Dec": 0, "Jan": 0, "Feb": 9, "Mar": 0}},
+            "exit_volumes": {"FY24-25": 15},
+            "one_time_offset_months": 1,
+            "included": True
+        },
+        {
+            "dimensions": hpsc,
+            "volumes": {"FY25-26": {"Apr": 1, "May": 1, "Jun": 1, "Jul": 1, "Aug": 1, "Sep": 1, "Oct": 1, "Nov": 1, "Dec": 1, "Jan": 1, "Feb": 1, "Mar": 1}},
+            "exit_volumes": {"FY24-25": 99},
+            "included": True
+        },
+        {
+            "dimensions": macro,
+            "volumes": {"FY25-26": {"Apr": 50, "May": 0, "Jun": 0, "Jul": 0, "Aug": 0, "Sep": 0, "Oct": 0, "Nov": 0, "Dec": 0, "Jan": 0, "Feb": 0, "Mar": 0}},
+            "exit_volumes": {"FY24-25": 10},
+            "included": False
+        }
+    ],
+    "rates": [
+        {"dimensions": hpsc, "recurring_rate": 1450.33, "one_time_rate": 1200.0, "existing_recurring_rate": 1333.33, "existing_one_time_rate": 0.0},
+        {"dimensions": lite, "recurring_rate": 875.5, "one_time_rate": 600.0, "existing_recurring_rate": 800.0, "existing_one_time_rate": 0.0},
+        {"dimensions": macro, "recurring_rate": 5000.0, "one_time_rate": 0.0, "existing_recurring_rate": 5000.0, "existing_one_time_rate": 0.0}
+    ],
+    "opex_items": [
+        {"name": "Rent", "fresh_offset_months": 1, "passthrough_inflow_offset_months": 1, "passthrough_outflow_offset_months": 2},
+        {"name": "Electricity", "cashflow_offset_months": 1},
+        {"name": "Network O&M"}
+    ],
+    "opex_rates": [
+        {"dimensions": hpsc, "item": "Rent", "existing_rate": 210.0, "fresh_rate": 230.5},
+        {"dimensions": hpsc, "item": "Electricity", "existing_rate": 95.25, "fresh_rate": 101.0},
+        {"dimensions": lite, "item": "Rent", "existing_rate": 150.0, "fresh_rate": 160.0},
+        {"dimensions": lite, "item": "Network O&M", "existing_rate": 33.3, "fresh_rate": 41.7},
+        {"dimensions": macro, "item": "Rent", "existing_rate": 999.0, "fresh_rate": 999.0}
+    ],
+    "capex_items": [
+        {"name": "Pole - Replacement", "group": "Replacement Inventory", "type": "replacement", "cashflow_offset_months": 2, "is_refund": False},
+        {"name": "Deposit Refund", "group": "Deposit Refund", "type": "deposit_refund", "cashflow_offset_months": 0, "is_refund": True}
+    ],
+    "capex_rates": [
+        {"dimensions": hpsc, "item": "Pole - Replacement", "existing_rate": 12.0, "fresh_rate": 2500.0},
+        {"dimensions": lite, "item": "Deposit Refund", "existing_rate": 5.0, "fresh_rate": 300.0}
+    ]
+}
+
+
+def compare_engines(name, body):
+    results = {}
+    for engine in ("python", "vectorized"):
+        resp = requests.post(f"{BASE_URL}/api/revenue/calculate", json={**body, "engine": engine})
+        print(f"{name} / {engine}: status {resp.status_code}")
+        assert resp.ok, f"{name} / {engine}: {resp.text}"
+        results[engine] = resp.json()
+    same = json.dumps(results["python"], sort_keys=True) == json.dumps(results["vectorized"], sort_keys=True)
+    print(f"{name}: engines identical: {same}, total_revenue: {results['vectorized'].get('total_revenue')}")
+    assert same, f"{name}: python and vectorized engine responses differ"
+
+
+if __name__ == "__main__":
+    try:
+        compare_engines("Dark Fiber", payload)
+        compare_engines("Small Cell", small_cell_payload)
+    except (AssertionError, requests.RequestException) as e:
+        print(f"FAILED: {e}")
+        sys.exit(1)
+    print("\nAll engine comparisons passed")
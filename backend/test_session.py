@@ -0,0 +1,129 @@
+import requests
+import copy
+import json
+import random
+import sys
+
+BASE_URL = "http://localhost:8000"
+MONTHS = ["Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec", "Jan", "Feb", "Mar"]
+OFFSET_FIELDS = ["fresh_offset_months", "recurring_offset_months", "one_time_offset_months",
+                 "cashflow_offset_months", "cashflow_recurring_offset_months", "cashflow_one_time_offset_months",
+                 "capex_offset_months", "capex_cashflow_offset_months"]
+RATE_FIELDS = ["recurring_rate", "one_time_rate", "existing_recurring_rate", "existing_one_time_rate"]
+
+# A calculation session must always answer exactly what /api/revenue/calculate
+# returns for the plan with the same edits applied.
+
+
+def amount(rnd):
+    return rnd.choice([0, rnd.randint(1, 400), round(rnd.uniform(0, 5000), 2)])
+
+
+def make_plan(lob, rnd):
+    combos = [{"customer": c, "circle": ci, "type": t, "Site Type": st}
+              for c, ci, t, st in [("Alpha", "MH", "New", "HPSC"), ("Alpha", "DL", "New", "Macro"),
+                                   ("Beta", "MH", "Upgrade", "LITE SITE"), ("Beta", "KA", "New", "HLS"),
+                                   ("Gamma", "DL", "Decom", "Macro")]]
+    volumes = [{"dimensions": d,
+                "volumes": {"FY25-26": {m: amount(rnd) for m in MONTHS}},
+                "exit_volumes": {"FY24-25": amount(rnd)},
+                "included": True} for d in combos]
+    # Duplicate occurrence of the first combination: every occurrence receives a delta
+    volumes.append({**copy.deepcopy(volumes[0]), "volumes": {"FY25-26": {m: amount(rnd) for m in MONTHS}}})
+    opex_items = [{"name": "Rent", "fresh_offset_months": 1}, {"name": "Electricity", "cashflow_offset_months": 2}]
+    capex_items = [{"name": "Pole - Replacement", "group": "Replacement Inventory", "type": "replacement", "cashflow_offset_months": 1, "is_refund": False},
+                   {"name": "Deposit Refund", "group": "Deposit Refund", "type": "deposit_refund", "cashflow_offset_months": 0, "is_refund": True}]
+    return {
+        "lob": lob,
+        "fiscal_year": "FY25-26",
+        "base_exit_year": "FY24-25",
+        "volumes": volumes,
+        "rates": [{"dimensions": d, **{f: amount(rnd) / 3 for f in RATE_FIELDS}} for d in combos[:4]],
+        "opex_items": opex_items,
+        "opex_rates": [{"dimensions": d, "item": it["name"], "existing_rate": amount(rnd) / 7, "fresh_rate": amount(rnd) / 7}
+                       for d in combos[:3] for it in opex_items],
+        "capex_items": capex_items,
+        "capex_rates": [{"dimensions": combos[1], "item": "Pole - Replacement", "existing_rate": 4.5, "fresh_rate": 1200.0}],
+    }
+
+
+def random_delta(plan, rnd):
+    """A random CombinationDelta, applied to `plan` the way the session applies it."""
+    dims = rnd.choice(plan["volumes"])["dimensions"]
+    change = {"dimensions": dims}
+    if rnd.random() < 0.6:
+        change["volumes"] = {m: amount(rnd) for m in rnd.sample(MONTHS, rnd.randint(1, 4))}
+    if rnd.random() < 0.3:
+        change["exit_volume"] = amount(rnd)
+    if rnd.random() < 0.2:
+        change["included"] = rnd.random() < 0.5
+    if rnd.random() < 0.4:
+        change["offsets"] = {f: rnd.choice([None, 0, 1, 2, 5]) for f in rnd.sample(OFFSET_FIELDS, 2)}
+    if rnd.random() < 0.5:
+        change["rates"] = {f: amount(rnd) / 3 for f in rnd.sample(RATE_FIELDS, 2)}
+    for kind in ("opex", "capex"):
+        if rnd.random() < 0.4:
+            item = rnd.choice(plan[kind + "_items"])["name"]
+            change[kind + "_rates"] = {item: {rnd.choice(["existing_rate", "fresh_rate"]): amount(rnd) / 7}}
+
+    for combo in plan["volumes"]:
+        if combo["dimensions"] != dims:
+            continue
+        combo["volumes"]["FY25-26"].update(change.get("volumes", {}))
+        if "exit_volume" in change:
+            combo["exit_volumes"]["FY24-25"] = change["exit_volume"]
+        if "included" in change:
+            combo["included"] = change["included"]
+        combo.update(change.get("offsets", {}))
+    if "rates" in change:
+        matches = [r for r in plan["rates"] if r["dimensions"] == dims]
+        if matches:
+            matches[-1].update(change["rates"])
+        else:
+            plan["rates"].append({"dimensions": dims, **change["rates"]})
+    for kind in ("opex", "capex"):
+        for item, fields in change.get(kind + "_rates", {}).items():
+            matches = [r for r in plan[kind + "_rates"] if r["item"] == item and r["dimensions"] == dims]
+            if matches:
+                matches[-1].update(fields)
+            else:
+                plan[kind + "_rates"].append({"dimensions": dims, "item": item, **fields})
+    return change
+
+
+def calculate(plan):
+    resp = requests.post(f"{BASE_URL}/api/revenue/calculate", json=plan)
+    assert resp.ok, f"calculate: {resp.text}"
+    return json.dumps(resp.json(), sort_keys=True)
+
+
+def check_session(lob, seed, steps=50):
+    rnd = random.Random(seed)
+    plan = make_plan(lob, rnd)
+    resp = requests.post(f"{BASE_URL}/api/revenue/session", json=plan)
+    assert resp.ok, f"{lob}: create session: {resp.text}"
+    session = resp.json()
+    session_id = session["session_id"]
+    assert json.dumps(session["result"], sort_keys=True) == calculate(plan), f"{lob}: new session differs from calculate"
+    deltas = 0
+    try:
+        for step in range(steps):
+            changes = [random_delta(plan, rnd) for _ in range(rnd.randint(1, 3))]
+            deltas += len(changes)
+            resp = requests.post(f"{BASE_URL}/api/revenue/session/{session_id}/delta", json={"changes": changes})
+            assert resp.ok, f"{lob} step {step}: delta: {resp.text}"
+            got = json.dumps(resp.json()["result"], sort_keys=True)
+            assert got == calculate(plan), f"{lob} step {step}: session differs from calculate after {changes}"
+    finally:
+        requests.delete(f"{BASE_URL}/api/revenue/session/{session_id}")
+    print(f"{lob}: {deltas} deltas, session identical to calculate")
+
+
+if __name__ == "__main__":
+    try:
+        for seed, lob in enumerate(["FTTH", "SMALL CELL", "Dark Fiber", "SDU"]):
+            check_session(lob, seed)
+    except (AssertionError, requests.RequestException) as e:
+        print(f"FAILED: {e}")
+        sys.exit(1)
+    print("\nAll session checks passed")